@@ -3,6 +3,9 @@
 echo "collecting static files"
 python3 manage.py collectstatic --no-input --clear
 
+echo "launching review setup worker"
+python3 manage.py run_review_setup_worker &
+
 echo "launching application"
 gunicorn -b 0.0.0.0:8000 gtfs_grading.wsgi:application
 exec "$@"
@@ -13,13 +13,14 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 from pathlib import Path
 import os
 from django.contrib.messages import constants as messages
-from gtfs_grading_app.gtfs_spec.import_gtfs_spec import load_data_package, get_cascading_drop_down
+from gtfs_grading_app.gtfs_spec.import_gtfs_spec import load_data_package, GtfsSpecRegistry
 import mimetypes
 
 GTFS_SPEC_PATH = 'gtfs_grading_app/gtfs_spec/data-package.json'
 
 GTFS_SPEC = load_data_package(GTFS_SPEC_PATH)
-GTFS_FIELD_DROPDOWN = get_cascading_drop_down(GTFS_SPEC)
+GTFS_SPEC_REGISTRY = GtfsSpecRegistry(GTFS_SPEC)
+GTFS_FIELD_DROPDOWN = GTFS_SPEC_REGISTRY.get_cascading_drop_down()
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -49,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'gtfs_grading_app.profiling.RequestProfileMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -63,7 +65,7 @@ ROOT_URLCONF = 'gtfs_grading.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'gtfs_grading_app.profiling.ProfiledDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')]
         ,
         'APP_DIRS': True,
@@ -143,6 +145,62 @@ mimetypes.add_type("text/css", ".css", True)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Uploaded GTFS feeds and the tables parsed from them, see gtfs_grading_app/Functions/feed_cache.py
+GTFS_FEED_CACHE_DIR = os.environ.get('GTFS_FEED_CACHE_DIR', os.path.join(BASE_DIR, 'feed_cache'))
+GTFS_UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# The feed cache is kept under GTFS_FEED_CACHE_QUOTA bytes by evicting the least recently used feeds, see
+# gtfs_grading_app/Functions/feed_workspace.py. Feeds used in the last GTFS_FEED_CACHE_MIN_AGE seconds are kept.
+GTFS_FEED_CACHE_QUOTA = int(os.environ.get('GTFS_FEED_CACHE_QUOTA', 5 * 1024 ** 3))
+GTFS_FEED_CACHE_MIN_AGE = 10 * 60
+GTFS_FEED_CACHE_SWEEP_INTERVAL = 15 * 60
+
+# Review setup runs in run_review_setup_worker, see gtfs_grading_app/Functions/review_jobs.py. A running job that has
+# not reported progress for this many seconds is queued again.
+REVIEW_SETUP_JOB_TIMEOUT = 30 * 60
+
+# Rows sampled for each review category, beyond the ones reviewed, to replace results the reviewer skips
+REVIEW_SKIP_CANDIDATES = 10
+# Tables whose CSV file is at least this many bytes are sampled by streaming the file instead of loading the table
+REVIEW_STREAMING_SAMPLE_THRESHOLD = int(os.environ.get('REVIEW_STREAMING_SAMPLE_THRESHOLD', 256 * 1024 ** 2))
+# Review categories on the same table with the same data selector review the same sampled rows
+REVIEW_SHARED_TABLE_SAMPLES = os.environ.get('REVIEW_SHARED_TABLE_SAMPLES', '0') == '1'
+# Processes review setup plans the tables of a feed with, 1 plans them one after the other in the calling process
+REVIEW_SETUP_WORKERS = int(os.environ.get('REVIEW_SETUP_WORKERS', 1))
+# Queue review plans for the agencies and route types of a feed when it is uploaded, see precompute_review_plan
+REVIEW_PRECOMPUTE_PLANS = os.environ.get('REVIEW_PRECOMPUTE_PLANS', '1') == '1'
+# Precompute jobs an upload queues at most, the first agencies and route types of the feed. The worker runs them one at
+# a time, a review setup queued while one of them runs waits for it.
+REVIEW_PRECOMPUTE_MAX_PER_UPLOAD = int(os.environ.get('REVIEW_PRECOMPUTE_MAX_PER_UPLOAD', 4))
+# Results evaluate_feed_batch shows, and scores, on one page
+REVIEW_BATCH_SIZE = int(os.environ.get('REVIEW_BATCH_SIZE', 20))
+
+# Request profiling, see gtfs_grading_app/profiling.py. Off unless REQUEST_PROFILING=1 is set in the environment.
+REQUEST_PROFILING = os.environ.get('REQUEST_PROFILING', '0') == '1'
+REQUEST_PROFILING_LOG = os.environ.get('REQUEST_PROFILING_LOG', os.path.join(BASE_DIR, 'logs', 'request_profile.log'))
+
+if REQUEST_PROFILING:
+    os.makedirs(os.path.dirname(REQUEST_PROFILING_LOG), exist_ok=True)
+    LOGGING = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'handlers': {
+            'request_profile': {
+                'class': 'logging.handlers.RotatingFileHandler',
+                'filename': REQUEST_PROFILING_LOG,
+                'maxBytes': 10 * 1024 * 1024,
+                'backupCount': 5,
+            },
+        },
+        'loggers': {
+            'gtfs_grading.profiling': {
+                'handlers': ['request_profile'],
+                'level': 'INFO',
+                'propagate': False,
+            },
+        },
+    }
+
 try:
     GOOGLE_API_KEY = os.environ['GOOGLE_API_KEY']
 except KeyError:
@@ -29,6 +29,9 @@ urlpatterns = [
     path('administration/details/<int:review_id>', name='admin_details', view=views.admin_details),
     path('about/', name='about', view=views.about),
     path('post_gtfs_zip/', name='post_gtfs', view=views.post_gtfs_zip),
+    path('review_setup/<int:job_id>/', name='review_setup_progress', view=views.review_setup_progress),
+    path('review_setup/<int:job_id>/status/', name='review_setup_job_status', view=views.review_setup_job_status),
+    path('feed_cache_stats/', name='feed_cache_stats', view=views.feed_cache_stats),
     # path('gtfs_admin/', name='admin', view=views.gtfs_admin),
     # path('gtfs_admin/view_review_category/', name="view_review_category", view=views.ViewReviewCategory.as_view()),
     # path('gtfs_admin/view_review_widget/<int:pk>/', views.ViewReviewWidget.as_view(), name='view_review_widget'),
@@ -45,6 +48,11 @@ urlpatterns = [
     path('evaluate_feed/<int:review_id>/', name='evaluate_feed', view=views.evaluate_feed),
     path('evaluate_feed/<int:review_id>/<int:active_review_category_id>/', name='evaluate_feed', view=views.evaluate_feed),
     path('evaluate_feed/<int:review_id>/<int:active_review_category_id>/<int:active_result_number>', name='evaluate_feed', view=views.evaluate_feed),
+    path('evaluate_feed_batch/<int:review_id>/<int:active_review_category_id>/', name='evaluate_feed_batch', view=views.evaluate_feed_batch),
+    path('evaluate_feed_batch/<int:review_id>/<int:active_review_category_id>/<int:page_number>', name='evaluate_feed_batch', view=views.evaluate_feed_batch),
+    path('rapid_review/<int:review_id>/<int:active_review_category_id>/', name='rapid_review', view=views.rapid_review),
+    path('rapid_review/<int:review_id>/<int:active_review_category_id>/payload/', name='rapid_review_payload', view=views.rapid_review_payload),
+    path('rapid_review/score/<int:result_id>/', name='rapid_review_score', view=views.rapid_review_score),
     path('evaluate_feed_by_id/<int:review_id>/<int:active_review_category_id>/<int:active_result_id>', name='evaluate_feed_by_result_id', view=views.evaluate_feed_by_result_id),
     path('review/<int:review_id>/', name='review_evaluation_results', view=views.review_evaluation_results),
     path('review/<int:review_id>/<int:active_result_id>/', name='review_evaluation_results', view=views.review_evaluation_results),
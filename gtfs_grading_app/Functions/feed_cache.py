@@ -0,0 +1,584 @@
+#####
+# This file contains a content-addressed cache for GTFS feeds.
+#
+# Every GTFS zip that enters the application is hashed (sha256) and stored once under
+# settings.GTFS_FEED_CACHE_DIR/<hash>/:
+#   - feed.zip - the original zip
+#   - feed/    - the extracted CSV files, only the tables that have been asked for are extracted
+#   - tables/  - one pickled DataFrame per table, written the first time partridge parses that table
+#   - manifest.json - agencies, route types per agency and row counts, file sizes and CRCs per table, computed from
+#     the zip when the entry is created so pages that only need those never read the CSV files, see build_manifest
+#   - views/   - one small json file per (agency, route type) subset that has been reviewed, pointing at the cache entry
+#     of that subset, see get_filtered_feed
+#   - plans/   - review plans sampled ahead of time from this entry, see precompute_review_plan in
+#     gtfs_grading_app/classes/review_setup.py
+#   - last_access - an empty file touched whenever the entry is used, its mtime orders entries for eviction, see
+#     gtfs_grading_app/Functions/feed_workspace.py
+#
+# The hash is what we keep in request.session['gtfs_feed']. Uploading the same zip twice reuses the existing entry and
+# loading a feed reads the pickled tables (already typed by partridge) instead of re-parsing the CSVs. Tables too large
+# to hold in memory can be read in chunks instead, see CachedFeed.iter_chunks, and review setup only reads the columns
+# it uses, stored compactly, see CachedFeed.load_columns.
+#####
+
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from typing import Dict, Iterator, List, Optional, Set
+
+import networkx as nx  # type: ignore
+import numpy as np
+import pandas as pd
+import partridge as ptg  # type: ignore
+from partridge.config import default_config  # type: ignore
+from partridge.utilities import detect_encoding  # type: ignore
+
+from django.conf import settings
+
+CHUNK_SIZE = 1024 * 1024
+# rows per DataFrame yielded by CachedFeed.iter_chunks
+STREAM_CHUNK_ROWS = 100000
+
+_stats_lock = threading.Lock()
+_stats = {'upload_hits': 0,
+          'upload_misses': 0,
+          'table_hits': 0,
+          'table_misses': 0,
+          'view_hits': 0,
+          'view_misses': 0}
+
+
+def _count(stat):
+    with _stats_lock:
+        _stats[stat] += 1
+
+
+def get_cache_root() -> str:
+    return settings.GTFS_FEED_CACHE_DIR
+
+
+def get_entry_dir(feed_hash) -> str:
+    return os.path.join(get_cache_root(), feed_hash)
+
+
+def get_feed_dir(feed_hash) -> str:
+    """returns the directory holding the extracted CSV files of a cached feed"""
+    return os.path.join(get_entry_dir(feed_hash), 'feed')
+
+
+def get_tables_dir(feed_hash) -> str:
+    return os.path.join(get_entry_dir(feed_hash), 'tables')
+
+
+def get_zip_path(feed_hash) -> str:
+    return os.path.join(get_entry_dir(feed_hash), 'feed.zip')
+
+
+def get_manifest_path(feed_hash) -> str:
+    return os.path.join(get_entry_dir(feed_hash), 'manifest.json')
+
+
+def get_views_dir(feed_hash) -> str:
+    return os.path.join(get_entry_dir(feed_hash), 'views')
+
+
+def get_plans_dir(feed_hash) -> str:
+    return os.path.join(get_entry_dir(feed_hash), 'plans')
+
+
+def get_last_access_path(feed_hash) -> str:
+    return os.path.join(get_entry_dir(feed_hash), 'last_access')
+
+
+def is_cached(feed_hash) -> bool:
+    if not feed_hash:
+        return False
+    return os.path.isdir(get_feed_dir(feed_hash))
+
+
+def is_gtfs_member(info) -> bool:
+    """False for directories and for the resource fork files macOS adds to zips"""
+    base_name = os.path.basename(info.filename)
+    return not info.is_dir() and not info.filename.startswith('__MACOSX/') and not base_name.startswith('.')
+
+
+def get_table_closure(file_names) -> Set[str]:
+    """returns the given tables plus every table partridge reads to prune them, e.g. routes.txt needs trips.txt"""
+    config = default_config()
+    closure = set(file_names)
+    for file_name in file_names:
+        if file_name in config:
+            closure.update(nx.descendants(config, file_name))
+    return closure
+
+
+def hash_file(path) -> str:
+    """returns the sha256 hex digest of a file"""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def add_feed_zip(path, feed_hash=None, tables=None, move=False) -> str:
+    """Adds a GTFS zip to the cache and returns its hash. A zip that is already cached is not extracted again.
+
+    Args:
+        path: path of the zip file
+        feed_hash: sha256 of the zip if the caller already computed it
+        tables: file names to extract (along with the tables partridge needs to read them), None extracts everything
+        move: move the zip into the cache instead of copying it
+    """
+    if feed_hash is None:
+        feed_hash = hash_file(path)
+    if is_cached(feed_hash):
+        _count('upload_hits')
+        touch(feed_hash)
+        if move:
+            os.remove(path)
+        if tables is not None:
+            extract_tables(feed_hash, tables)
+        return feed_hash
+
+    _count('upload_misses')
+    os.makedirs(get_cache_root(), exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=get_cache_root(), prefix='.incoming-')
+    try:
+        zip_path = os.path.join(tmp_dir, 'feed.zip')
+        if move:
+            shutil.move(path, zip_path)
+        else:
+            shutil.copyfile(path, zip_path)
+        os.makedirs(os.path.join(tmp_dir, 'feed'))
+        os.makedirs(os.path.join(tmp_dir, 'tables'))
+        _extract(zip_path, os.path.join(tmp_dir, 'feed'), tables)
+        _write_json(build_manifest(zip_path, feed_hash), os.path.join(tmp_dir, 'manifest.json'))
+        open(os.path.join(tmp_dir, 'last_access'), 'w').close()
+        try:
+            os.rename(tmp_dir, get_entry_dir(feed_hash))
+        except OSError:
+            # another request cached the same zip while we were extracting it
+            shutil.rmtree(tmp_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return feed_hash
+
+
+def extract_tables(feed_hash, tables) -> bool:
+    """Extracts tables of a cached feed that are not on disk yet. Returns True if anything was extracted."""
+    feed_dir = get_feed_dir(feed_hash)
+    missing = [t for t in get_table_closure(tables) if not os.path.exists(os.path.join(feed_dir, t))]
+    if not missing:
+        return False
+    return _extract(get_zip_path(feed_hash), feed_dir, missing)
+
+
+def _extract(zip_path, feed_dir, tables=None) -> bool:
+    """Extracts GTFS tables from a zip into a flat directory, only the tables in the closure of `tables` if given"""
+    wanted = None if tables is None else get_table_closure(tables)
+    extracted = False
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        for info in zip_ref.infolist():
+            base_name = os.path.basename(info.filename)
+            if not is_gtfs_member(info) or (wanted is not None and base_name not in wanted):
+                continue
+            target = os.path.join(feed_dir, base_name)
+            if os.path.exists(target):
+                continue
+            fd, tmp_path = tempfile.mkstemp(dir=feed_dir, prefix='.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as out, zip_ref.open(info) as member:
+                    shutil.copyfileobj(member, out, CHUNK_SIZE)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+            os.replace(tmp_path, target)
+            extracted = True
+    return extracted
+
+
+def build_manifest(zip_path, feed_hash) -> dict:
+    """Reads a GTFS zip once and returns a summary of it:
+        {'feed_hash': sha256 of the zip,
+         'agencies': [{'agency_id', 'agency_name', 'route_types': sorted route types of the agency's routes}],
+         'tables': {file name: {'rows', 'size', 'compressed_size', 'crc32'}}}
+    Rows are counted as the non-empty lines after the header, so a quoted value holding a line break counts twice."""
+    manifest: dict = {'feed_hash': feed_hash, 'agencies': [], 'tables': {}}
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        members = {os.path.basename(info.filename): info for info in zip_ref.infolist() if is_gtfs_member(info)}
+        for file_name, info in members.items():
+            if not file_name.endswith('.txt'):
+                continue
+            manifest['tables'][file_name] = {'rows': _count_rows(zip_ref, info),
+                                             'size': info.file_size,
+                                             'compressed_size': info.compress_size,
+                                             'crc32': '{:08x}'.format(info.CRC)}
+
+        agencies = _read_csv_columns(zip_ref, members.get('agency.txt'), ['agency_id', 'agency_name'])
+        routes = _read_csv_columns(zip_ref, members.get('routes.txt'), ['agency_id', 'route_type'])
+
+    route_types: Dict[str, set] = {}
+    for route in routes:
+        agency_id = route['agency_id']
+        if not agency_id and len(agencies) == 1:
+            # agency_id may be left out of routes.txt when the feed has a single agency
+            agency_id = agencies[0]['agency_id']
+        try:
+            route_types.setdefault(agency_id, set()).add(int(route['route_type']))
+        except ValueError:
+            continue
+    for agency in agencies:
+        manifest['agencies'].append({'agency_id': agency['agency_id'],
+                                     'agency_name': agency['agency_name'],
+                                     'route_types': sorted(route_types.get(agency['agency_id'], set()))})
+    return manifest
+
+
+def load_manifest(feed_hash) -> dict:
+    """returns the manifest of a cached feed, building it first for entries cached before manifests existed"""
+    if not is_cached(feed_hash):
+        raise ValueError("GTFS feed not found in cache.")
+    touch(feed_hash)
+    path = get_manifest_path(feed_hash)
+    if not os.path.exists(path):
+        _write_json(build_manifest(get_zip_path(feed_hash), feed_hash), path)
+    with open(path) as f:
+        return json.load(f)
+
+
+def _count_rows(zip_ref, info) -> int:
+    rows = -1
+    with zip_ref.open(info) as member:
+        for line in member:
+            if line.strip():
+                rows += 1
+    return max(rows, 0)
+
+
+def _read_csv_columns(zip_ref, info, columns) -> List[Dict[str, str]]:
+    """returns the given columns of a small table, with missing columns and values as ''"""
+    if info is None:
+        return []
+    with zip_ref.open(info) as member:
+        reader = csv.DictReader(io.TextIOWrapper(member, encoding='utf-8-sig', errors='replace'))
+        if reader.fieldnames:
+            reader.fieldnames = [name.strip() for name in reader.fieldnames]
+        return [{column: (row.get(column) or '').strip() for column in columns} for row in reader]
+
+
+def _write_json(data, path):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def get_filtered_feed(feed_hash, agency, mode, tables) -> str:
+    """Returns the hash of the cache entry holding the rows of a cached feed that belong to one agency and route type.
+    The subset is written with partridge the first time it is asked for and reused by every later review of it.
+
+    Args:
+        feed_hash: hash of the cached feed
+        agency: agency_name to keep
+        mode: route_type to keep
+        tables: file names the subset must contain (when the feed has them)
+    """
+    view = {'agency.txt': {'agency_name': agency},
+            'routes.txt': {'route_type': str(mode)}}
+    wanted = get_table_closure(set(tables) | set(view))
+    index_path = os.path.join(get_views_dir(feed_hash), _get_view_key(agency, mode) + '.json')
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+        if is_cached(index['feed_hash']) and wanted <= set(index['source_tables']):
+            _count('view_hits')
+            touch(index['feed_hash'])
+            return index['feed_hash']
+
+    _count('view_misses')
+    extract_tables(feed_hash, wanted)
+    source_tables = sorted(name for name in os.listdir(get_feed_dir(feed_hash)) if name.endswith('.txt'))
+    tmp_dir = tempfile.mkdtemp(dir=get_cache_root(), prefix='.view-')
+    try:
+        view_zip = ptg.extract_feed(get_feed_dir(feed_hash), os.path.join(tmp_dir, 'view.zip'), view)
+        view_hash = add_feed_zip(view_zip, move=True)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    # wanted tables the feed does not have are recorded too, asking for them again should not rebuild the subset
+    os.makedirs(get_views_dir(feed_hash), exist_ok=True)
+    _write_json({'agency': agency,
+                 'mode': str(mode),
+                 'feed_hash': view_hash,
+                 'source_tables': source_tables + sorted(wanted - set(source_tables))},
+                index_path)
+    return view_hash
+
+
+def _get_view_key(agency, mode) -> str:
+    return hashlib.sha256(json.dumps([agency, str(mode)]).encode('utf-8')).hexdigest()
+
+
+def load_feed(feed_hash) -> 'CachedFeed':
+    """returns a feed object for a cached feed, tables are accessed the same way as on a partridge feed"""
+    if not is_cached(feed_hash):
+        raise ValueError("GTFS feed not found in cache.")
+    touch(feed_hash)
+    return CachedFeed(feed_hash)
+
+
+def touch(feed_hash):
+    """records that a cached feed was used now"""
+    try:
+        with open(get_last_access_path(feed_hash), 'a'):
+            pass
+        os.utime(get_last_access_path(feed_hash))
+    except FileNotFoundError:
+        # the entry was evicted in the meantime
+        pass
+
+
+def list_entries() -> List[Dict]:
+    """returns [{'feed_hash', 'size_bytes', 'last_access'}] for every cache entry, last_access is a unix time"""
+    entries: List[Dict] = []
+    root = get_cache_root()
+    if not os.path.isdir(root):
+        return entries
+    for name in os.listdir(root):
+        entry_dir = os.path.join(root, name)
+        if name.startswith('.') or not os.path.isdir(entry_dir):
+            continue
+        size_bytes = 0
+        for dir_path, dir_names, file_names in os.walk(entry_dir):
+            for file_name in file_names:
+                try:
+                    size_bytes += os.path.getsize(os.path.join(dir_path, file_name))
+                except FileNotFoundError:
+                    continue
+        try:
+            last_access = os.path.getmtime(get_last_access_path(name))
+        except FileNotFoundError:
+            last_access = os.path.getmtime(entry_dir)
+        entries.append({'feed_hash': name, 'size_bytes': size_bytes, 'last_access': last_access})
+    return entries
+
+
+def remove_entry(feed_hash):
+    """Deletes a cache entry. It is renamed away first so it stops being cached before the files are removed."""
+    evicted_dir = tempfile.mkdtemp(dir=get_cache_root(), prefix='.evict-')
+    try:
+        os.rename(get_entry_dir(feed_hash), os.path.join(evicted_dir, feed_hash))
+    finally:
+        shutil.rmtree(evicted_dir, ignore_errors=True)
+
+
+def remove_abandoned_files(max_age) -> int:
+    """Deletes uploads, extractions and evictions that were left half done more than max_age seconds ago, for
+    example by a worker that was killed. Returns how many were deleted."""
+    root = get_cache_root()
+    if not os.path.isdir(root):
+        return 0
+    removed = 0
+    cutoff = time.time() - max_age
+    for name in os.listdir(root):
+        if not name.startswith(('.incoming-', '.view-', '.upload-', '.evict-')):
+            continue
+        path = os.path.join(root, name)
+        try:
+            if os.path.getmtime(path) >= cutoff:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            continue
+    return removed
+
+
+def get_cache_stats() -> Dict[str, int]:
+    """returns hit and miss counters for this process along with the size of the cache on disk"""
+    with _stats_lock:
+        stats = dict(_stats)
+
+    entries = list_entries()
+    stats.update({'entries': len(entries), 'size_bytes': sum(entry['size_bytes'] for entry in entries)})
+    return stats
+
+
+class CachedFeed:
+    """Read access to the tables of a cached feed. Tables are parsed with partridge at most once per feed and kept as
+    pickled DataFrames afterwards."""
+
+    def __init__(self, feed_hash):
+        self.feed_hash = feed_hash
+        self.path = get_feed_dir(feed_hash)
+        self._ptg_feed = None
+        self._tables: Dict[str, pd.DataFrame] = {}
+
+    def __getattr__(self, name) -> pd.DataFrame:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.get(name)
+
+    def get(self, table: str) -> pd.DataFrame:
+        """returns a table by name, for example 'routes' or 'routes.txt'"""
+        file_name = table if table.endswith('.txt') else table + '.txt'
+        df = self._tables.get(file_name)
+        if df is not None:
+            return df
+
+        pickle_path = os.path.join(get_tables_dir(self.feed_hash), file_name.replace('.txt', '.pkl'))
+        if os.path.exists(pickle_path):
+            _count('table_hits')
+            df = pd.read_pickle(pickle_path)
+        else:
+            _count('table_misses')
+            df = self._parse(file_name)
+            self._write_pickle(df, pickle_path)
+
+        self._tables[file_name] = df
+        return df
+
+    def _parse(self, file_name) -> pd.DataFrame:
+        if extract_tables(self.feed_hash, [file_name]) or self._ptg_feed is None:
+            self._ptg_feed = ptg.load_feed(self.path)
+        return self._ptg_feed.get(file_name)
+
+    @staticmethod
+    def _write_pickle(df, pickle_path):
+        os.makedirs(os.path.dirname(pickle_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(pickle_path), suffix='.tmp')
+        os.close(fd)
+        df.to_pickle(tmp_path)
+        os.replace(tmp_path, pickle_path)
+
+    def is_loaded(self, table) -> bool:
+        """returns True when the table is already held in memory by this object"""
+        file_name = table if table.endswith('.txt') else table + '.txt'
+        return file_name in self._tables
+
+    def get_file_size(self, table) -> int:
+        """returns the size in bytes of a table's CSV file, extracting it if needed, or 0 when the feed does not have it"""
+        path = self._get_csv_path(table)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def count_rows(self, table) -> int:
+        """returns an upper bound on the number of rows of a table, read from the manifest when it has the table"""
+        file_name = table if table.endswith('.txt') else table + '.txt'
+        table_info = load_manifest(self.feed_hash)['tables'].get(file_name)
+        if table_info is not None:
+            return table_info['rows']
+        return sum(len(chunk) for chunk in self.iter_chunks(table, usecols=self.get_columns(table)[:1]))
+
+    def get_columns(self, table) -> List[str]:
+        """returns the column names of a table without reading its rows"""
+        path = self._get_csv_path(table)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return []
+        return [column.strip() for column in pd.read_csv(path, nrows=0, encoding=self._get_encoding(path)).columns]
+
+    def iter_chunks(self, table, usecols=None, chunk_rows=STREAM_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+        """Reads a table STREAM_CHUNK_ROWS rows at a time, so it is never held in memory as a whole. Values are the
+        strings as written in the file, convert_types strips and converts them the way partridge does. Rows are not pruned against other tables, which only
+        matters for feeds that were not written by partridge (get_filtered_feed writes the feeds we review)."""
+        path = self._get_csv_path(table)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return
+        wanted = None if usecols is None else set(usecols)
+        reader = pd.read_csv(path,
+                             dtype=str,
+                             encoding=self._get_encoding(path),
+                             index_col=False,
+                             usecols=None if wanted is None else (lambda column: column.strip() in wanted),
+                             chunksize=chunk_rows)
+        with reader:
+            for chunk in reader:
+                # values are only stripped once rows are sampled, stripping every value costs more than parsing
+                chunk.rename(columns=lambda column: column.strip(), inplace=True)
+                yield chunk
+
+    def load_columns(self, table, columns: Optional[List[str]]) -> pd.DataFrame:
+        """returns the columns of a table the table has, all of them when columns is None, with the types partridge
+        gives them but stored compactly, see compact_column. A table this object already holds is projected instead
+        of read again. Nothing is cached, the result is meant to be dropped once the rows it holds are sampled."""
+        file_name = table if table.endswith('.txt') else table + '.txt'
+        df = self._tables.get(file_name)
+        if df is not None:
+            return df if columns is None else df[[column for column in df.columns if column in columns]]
+
+        path = self._get_csv_path(table)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return pd.DataFrame()
+        wanted = None if columns is None else set(columns)
+        df = pd.read_csv(path,
+                         dtype=str,
+                         encoding=self._get_encoding(path),
+                         index_col=False,
+                         usecols=None if wanted is None else (lambda column: column.strip() in wanted))
+        df.rename(columns=lambda column: column.strip(), inplace=True)
+        converters = default_config().nodes.get(file_name, {}).get('converters', {})
+        for column in df.columns:
+            df[column] = compact_column(df[column], converters.get(column))
+        return df
+
+    @staticmethod
+    def convert_types(table, df) -> pd.DataFrame:
+        """returns a copy of rows read with iter_chunks with stripped values and the types partridge gives the
+        table"""
+        file_name = table if table.endswith('.txt') else table + '.txt'
+        df = df.copy()
+        if df.empty:
+            return df
+        for column in df.columns:
+            df[column] = df[column].str.strip()
+        for column, converter in default_config().nodes.get(file_name, {}).get('converters', {}).items():
+            if column in df.columns:
+                df[column] = converter(df[column])
+        return df
+
+    def _get_csv_path(self, table) -> str:
+        file_name = table if table.endswith('.txt') else table + '.txt'
+        extract_tables(self.feed_hash, [file_name])
+        return os.path.join(self.path, file_name)
+
+    @staticmethod
+    def _get_encoding(path) -> str:
+        with open(path, 'rb') as f:
+            return detect_encoding(f)
+
+
+def compact_column(values, converter=None) -> pd.Series:
+    """Strips and converts a column of strings read from a CSV the way partridge does, but each distinct value is
+    stripped and converted once. Strings that repeat, like the route_id of trips or the trip_id and stop_id of stop
+    times, become categorical, and integers are downcast to the smallest type that holds them."""
+    codes, uniques = pd.factorize(values)
+    if not len(uniques):
+        return values if converter is None else converter(values)
+    # values that only differ by the whitespace around them are the same value once stripped
+    stripped_codes, uniques = pd.factorize(pd.Index(uniques).str.strip())
+    codes = np.append(stripped_codes, -1)[codes]
+    missing = codes < 0
+
+    if converter is None:
+        if len(uniques) <= len(values) // 2:
+            return pd.Series(pd.Categorical.from_codes(codes, uniques), index=values.index, name=values.name)
+        converted = uniques.to_numpy(dtype=object)
+    else:
+        converted = np.asarray(converter(pd.Series(uniques, dtype=object)))
+    if missing.any():
+        converted = np.append(converted.astype(object) if converted.dtype.kind in 'OUSM' else converted, np.nan)
+    column = pd.Series(converted[codes], index=values.index, name=values.name)
+    if column.dtype.kind in 'iu':
+        column = pd.to_numeric(column, downcast='integer')
+    return column
@@ -0,0 +1,186 @@
+#####
+# This file contains the ingestion path for uploaded GTFS zip files.
+#
+# An upload is:
+#   1. streamed to disk in chunks while it is hashed, so a large feed is never held in worker memory
+#   2. checked using only the zip central directory and the header row of each table, so nothing is fully inflated
+#      before we know the feed is usable
+#   3. added to the feed cache, extracting only the tables the configured review categories reference
+#
+# Every problem found along the way is recorded against the file it was found in, see FeedIngestReport.
+#####
+
+import csv
+import hashlib
+import io
+import os
+import tempfile
+import zipfile
+import zlib
+from typing import List, Optional, Set, Tuple
+
+from django.conf import settings
+
+from gtfs_grading_app.Functions import feed_cache
+from gtfs_grading_app.classes.classes import related_fields_selector_factory, STRATA_JOINS
+from gtfs_grading_app.gtfs_spec.import_gtfs_spec import get_required_fields
+from gtfs_grading_app.models import review_category
+
+# Tables every feed must contain. A feed also needs at least one of SERVICE_FILES.
+REQUIRED_FILES = ['agency.txt', 'stops.txt', 'routes.txt', 'trips.txt', 'stop_times.txt']
+SERVICE_FILES = ['calendar.txt', 'calendar_dates.txt']
+
+# Raised while inflating a zip member whose data is corrupt, the central directory does not show those
+CORRUPT_MEMBER_ERRORS = (zipfile.BadZipFile, zlib.error, OSError, EOFError)
+
+# Tables read to build the agency and mode pickers on the start new evaluation page
+PICKER_FILES = ['agency.txt', 'routes.txt']
+
+
+class FeedIngestReport:
+    """Errors and warnings found while ingesting a feed, each tied to the file it was found in"""
+
+    def __init__(self):
+        self.errors: List[Tuple[str, str]] = []
+        self.warnings: List[Tuple[str, str]] = []
+        self.feed_hash: Optional[str] = None
+
+    @property
+    def is_valid(self) -> bool:
+        return not self.errors
+
+    def add_error(self, file_name, message):
+        self.errors.append((file_name, message))
+
+    def add_warning(self, file_name, message):
+        self.warnings.append((file_name, message))
+
+
+def ingest_uploaded_feed(uploaded_file) -> FeedIngestReport:
+    """Streams an uploaded GTFS zip to disk, validates it and adds it to the feed cache. The returned report holds the
+    feed hash when the feed is valid."""
+    report = FeedIngestReport()
+    spool_path, feed_hash = spool_upload(uploaded_file)
+    try:
+        members = inspect_feed_zip(spool_path, report)
+        if not report.is_valid:
+            return report
+        tables = get_referenced_tables() | set(PICKER_FILES)
+        try:
+            report.feed_hash = feed_cache.add_feed_zip(spool_path,
+                                                       feed_hash=feed_hash,
+                                                       tables=tables & set(members),
+                                                       move=True)
+        except CORRUPT_MEMBER_ERRORS:
+            # only the header rows were read while checking the feed, a table can still fail to inflate. add_feed_zip
+            # already removed the entry it was writing, an entry that was cached before this upload is left alone.
+            report.add_error('upload', 'The file is corrupt and could not be read.')
+    finally:
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+    return report
+
+
+def spool_upload(uploaded_file) -> Tuple[str, str]:
+    """Writes an UploadedFile to the feed cache directory chunk by chunk and returns the path and sha256 of the copy"""
+    os.makedirs(feed_cache.get_cache_root(), exist_ok=True)
+    sha = hashlib.sha256()
+    fd, spool_path = tempfile.mkstemp(dir=feed_cache.get_cache_root(), prefix='.upload-', suffix='.zip')
+    with os.fdopen(fd, 'wb') as spool:
+        for chunk in uploaded_file.chunks(settings.GTFS_UPLOAD_CHUNK_SIZE):
+            sha.update(chunk)
+            spool.write(chunk)
+    return spool_path, sha.hexdigest()
+
+
+def inspect_feed_zip(path, report) -> List[str]:
+    """Validates a GTFS zip without extracting it and returns the names of the GTFS tables it contains. Only the zip
+    central directory and the first line of each table are read."""
+    try:
+        zip_ref = zipfile.ZipFile(path, 'r')
+    except zipfile.BadZipFile:
+        report.add_error('upload', 'The file is not a valid .zip file.')
+        return []
+
+    with zip_ref:
+        members = {}
+        for info in zip_ref.infolist():
+            if not feed_cache.is_gtfs_member(info) or not info.filename.endswith('.txt'):
+                continue
+            base_name = os.path.basename(info.filename)
+            if base_name in members:
+                report.add_error(base_name, 'The zip contains more than one copy of this file.')
+                continue
+            members[base_name] = info
+
+        for file_name in REQUIRED_FILES:
+            if file_name not in members:
+                report.add_error(file_name, 'This required file is missing from the feed.')
+        if not any(file_name in members for file_name in SERVICE_FILES):
+            report.add_error(' or '.join(SERVICE_FILES), 'The feed must contain at least one of these files.')
+
+        referenced_fields = get_referenced_fields()
+        for file_name, info in members.items():
+            is_required = file_name in REQUIRED_FILES or file_name in SERVICE_FILES
+            if info.file_size == 0:
+                if is_required:
+                    report.add_error(file_name, 'The file is empty.')
+                continue
+            try:
+                header = _read_header(zip_ref, info)
+            except CORRUPT_MEMBER_ERRORS:
+                report.add_error(file_name, 'The file is corrupt and could not be read.')
+                continue
+            if header is None:
+                report.add_error(file_name, 'The header row could not be read.')
+                continue
+            if is_required or file_name in referenced_fields:
+                for field in get_required_fields(file_name):
+                    if field not in header:
+                        report.add_error(file_name, 'The required column "{}" is missing.'.format(field))
+            for field in sorted(referenced_fields.get(file_name, set())):
+                if field not in header:
+                    report.add_warning(file_name, 'The column "{}" is missing, it will be reviewed as blank.'.format(field))
+
+    return list(members)
+
+
+def _read_header(zip_ref, info) -> Optional[List[str]]:
+    """returns the column names of a table, decompressing only as much of the member as the first line needs"""
+    with zip_ref.open(info) as member:
+        line = member.readline()
+    for encoding in ['utf-8-sig', 'latin-1']:
+        try:
+            text = line.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        return None
+    try:
+        header = next(csv.reader(io.StringIO(text)))
+    except (csv.Error, StopIteration):
+        return None
+    return [column.strip() for column in header]
+
+
+def get_referenced_fields() -> dict:
+    """returns {table: set of field names} for every field the configured review categories display"""
+    fields: dict = {}
+    for category in review_category.objects.select_related('gtfs_field', 'review_widget'):
+        fields.setdefault(category.gtfs_field.table, set()).add(category.gtfs_field.name)
+        for field in category.review_widget.related_field_same_table.all():
+            fields.setdefault(field.table, set()).add(field.name)
+    return fields
+
+
+def get_referenced_tables() -> Set[str]:
+    """returns the GTFS tables the configured review categories read, including tables used by related field
+    selectors and the tables stratified data selectors join to"""
+    tables = set(get_referenced_fields())
+    for category in review_category.objects.select_related('review_widget', 'data_selector'):
+        if category.review_widget.has_related_field_other_table:
+            tables.update(related_fields_selector_factory(category.review_widget.related_field_other_table).related_tables)
+        if category.data_selector.stratify_by:
+            tables.update(table_name for key, table_name in STRATA_JOINS)
+    return tables
@@ -0,0 +1,91 @@
+#####
+# This file keeps the feed cache (see feed_cache.py) inside a disk quota.
+#
+# sweep deletes the least recently used cache entries until the cache fits in settings.GTFS_FEED_CACHE_QUOTA bytes.
+# An entry is never deleted while:
+#   - a review that is not completed was sampled from it
+#   - a queued or running review setup job reads it
+#   - it was used in the last settings.GTFS_FEED_CACHE_MIN_AGE seconds, so a feed that was just uploaded or is being
+#     read by a request is left alone
+# It also deletes the temporary files of uploads and extractions that never finished.
+#
+# sweep runs from the sweep_feed_cache management command and every settings.GTFS_FEED_CACHE_SWEEP_INTERVAL seconds
+# from run_review_setup_worker, see sweep_if_due.
+#####
+
+import logging
+import os
+import time
+from typing import Optional, Set
+
+from django.conf import settings
+
+from gtfs_grading_app.Functions import feed_cache
+from gtfs_grading_app.models import review, review_setup_job
+
+logger = logging.getLogger(__name__)
+
+
+def get_protected_feed_hashes() -> Set[str]:
+    """returns the hashes of cache entries in use by reviews in progress and by unfinished review setup jobs"""
+    protected = set(review.objects.exclude(review_status="Completed").exclude(gtfs_feed_hash=None)
+                    .values_list('gtfs_feed_hash', flat=True))
+    for gtfs_feed_hash, filtered_feed_hash in review_setup_job.objects.filter(status__in=["Queued", "Running"]) \
+            .values_list('gtfs_feed_hash', 'filtered_feed_hash'):
+        protected.add(gtfs_feed_hash)
+        if filtered_feed_hash:
+            protected.add(filtered_feed_hash)
+    return protected
+
+
+def sweep(quota: Optional[int] = None, dry_run=False) -> dict:
+    """Deletes least recently used cache entries until the cache fits in quota bytes and returns
+    {'evicted': [hashes], 'freed_bytes', 'size_bytes' (after the sweep), 'quota', 'abandoned_files'}"""
+    if quota is None:
+        quota = settings.GTFS_FEED_CACHE_QUOTA
+    abandoned_files = 0 if dry_run else feed_cache.remove_abandoned_files(settings.GTFS_FEED_CACHE_MIN_AGE)
+
+    entries = sorted(feed_cache.list_entries(), key=lambda entry: entry['last_access'])
+    size_bytes = sum(entry['size_bytes'] for entry in entries)
+    protected = get_protected_feed_hashes()
+    recent = time.time() - settings.GTFS_FEED_CACHE_MIN_AGE
+
+    evicted = []
+    freed_bytes = 0
+    for entry in entries:
+        if size_bytes <= quota:
+            break
+        if entry['feed_hash'] in protected or entry['last_access'] >= recent:
+            continue
+        if not dry_run:
+            try:
+                feed_cache.remove_entry(entry['feed_hash'])
+            except OSError:
+                logger.exception("could not evict feed %s", entry['feed_hash'])
+                continue
+        evicted.append(entry['feed_hash'])
+        freed_bytes += entry['size_bytes']
+        size_bytes -= entry['size_bytes']
+
+    if size_bytes > quota:
+        logger.warning("feed cache is %d bytes after the sweep, over its %d byte quota, the rest is in use",
+                       size_bytes, quota)
+    return {'evicted': evicted,
+            'freed_bytes': freed_bytes,
+            'size_bytes': size_bytes,
+            'quota': quota,
+            'abandoned_files': abandoned_files}
+
+
+def sweep_if_due() -> Optional[dict]:
+    """Sweeps when the last sweep, by any process, was more than GTFS_FEED_CACHE_SWEEP_INTERVAL seconds ago"""
+    marker = os.path.join(feed_cache.get_cache_root(), '.last_sweep')
+    try:
+        if time.time() - os.path.getmtime(marker) < settings.GTFS_FEED_CACHE_SWEEP_INTERVAL:
+            return None
+    except FileNotFoundError:
+        os.makedirs(feed_cache.get_cache_root(), exist_ok=True)
+    with open(marker, 'a'):
+        pass
+    os.utime(marker)
+    return sweep()
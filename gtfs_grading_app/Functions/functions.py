@@ -1,7 +1,6 @@
-from django.core.exceptions import ObjectDoesNotExist
 from django.urls import reverse
 
-from gtfs_grading_app.models import result, mode_lookup_table
+from gtfs_grading_app.Functions import lookup_cache
 
 
 def list_to_tuple_of_tuples(list):
@@ -17,9 +16,8 @@ def get_mode_drop_down(mode_id_list) -> tuple:
     return output
 
 def mode_id_to_name(mode_id):
-    try:
-        mode_name = mode_lookup_table.objects.get(mode_id=mode_id).mode_name
-    except ObjectDoesNotExist:
+    mode_name = lookup_cache.mode_names.get(str(mode_id))
+    if mode_name is None:
         mode_name = str(mode_id) + " - Mode id not found"
     return mode_name
 
@@ -48,7 +46,8 @@ def get_next_review_item(active_result_number, max_items, active_review, active_
         return None
 
 
-def get_previous_review_item(active_result_number, max_items, active_review, active_review_category, review_categories):
+def get_previous_review_item(active_result_number, max_items, active_review, active_review_category, review_categories,
+                             category_progress=None):
     if active_result_number > 1:
         return reverse('evaluate_feed',
                        kwargs={
@@ -60,7 +59,9 @@ def get_previous_review_item(active_result_number, max_items, active_review, act
         item_found = False
         for cat in review_categories.order_by('-id'):
             if item_found:
-                max_items = result.objects.filter(review_id=active_review.id, review_category_id=cat.id).count()
+                if category_progress is None:
+                    category_progress = active_review.get_category_progress()
+                max_items = category_progress[cat.id].total_results
                 return reverse('evaluate_feed',
                                kwargs={
                                    'review_id': active_review.id,
@@ -0,0 +1,57 @@
+#####
+# This file contains small per-process caches over lookup tables that templates read once per rendered row.
+#
+# Each cache loads the whole table with one query the first time it is read and is dropped whenever a row of the
+# table is saved or deleted in this process. The first read of a missing key triggers one reload, so rows added by
+# another process are still found, later reads of that key do not hit the database again.
+#####
+
+import threading
+from typing import Callable, Dict, Optional, Set
+
+from django.db.models.signals import post_save, post_delete
+
+from gtfs_grading_app.models import mode_lookup_table, gtfs_field
+
+
+class ModelLookupCache:
+    """A {key: value} map built from every row of a model"""
+
+    def __init__(self, model, key: Callable, value: Callable):
+        self.model = model
+        self.key = key
+        self.value = value
+        self._values: Optional[Dict] = None
+        self._missing: Set = set()
+        self._lock = threading.Lock()
+        post_save.connect(self.invalidate, sender=model, weak=False)
+        post_delete.connect(self.invalidate, sender=model, weak=False)
+
+    def _load(self, reload: bool = False) -> Dict:
+        with self._lock:
+            if self._values is None or reload:
+                self._values = {self.key(row): self.value(row) for row in self.model.objects.all()}
+            return self._values
+
+    def get(self, key, default=None):
+        values = self._load()
+        if key not in values and key not in self._missing:
+            # the keys already known to be missing are kept, only a save or delete of a row forgets them
+            values = self._load(reload=True)
+            if key not in values:
+                self._missing.add(key)
+        return values.get(key, default)
+
+    def invalidate(self, **kwargs):
+        with self._lock:
+            self._values = None
+            self._missing = set()
+
+
+mode_names = ModelLookupCache(mode_lookup_table,
+                              key=lambda row: str(row.mode_id),
+                              value=lambda row: row.mode_name)
+
+gtfs_field_labels = ModelLookupCache(gtfs_field,
+                                     key=lambda row: row.id,
+                                     value=lambda row: row.field_name_to_label)
@@ -0,0 +1,61 @@
+#####
+# This file holds a pool of worker processes for CPU bound work, see build_review_plan in
+# gtfs_grading_app/classes/review_setup.py.
+#
+# Starting a worker means importing django and pandas, which takes longer than most of the work we give it, so the pool
+# is created once per process and reused, by run_review_setup_worker for every job it runs. Workers are spawned rather
+# than forked so they never share the parent's database connections, and they are not meant to use the database at
+# all: tasks get plain values and return plain values. A spawned worker starts from the settings module, so the pool
+# is started with the current value of the settings its tasks read, and started again when they change, see
+# get_process_pool.
+#
+# This module must not import models, workers import it before django is set up.
+#####
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+_pool_lock = threading.Lock()
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_size = 0
+_pool_settings: Dict = {}
+
+
+def get_process_pool(max_workers, setting_names: List[str]) -> ProcessPoolExecutor:
+    """returns the pool of this process, started with max_workers processes and the settings named in setting_names
+    set as they are in this process. The pool is started the first time it is asked for, and again when the size or
+    one of the settings changes or a worker died."""
+    global _pool, _pool_size, _pool_settings
+    worker_settings = {name: getattr(settings, name) for name in setting_names}
+    with _pool_lock:
+        if _pool is not None and (_pool_size != max_workers or _pool_settings != worker_settings
+                                  or getattr(_pool, '_broken', False)):
+            _pool.shutdown(wait=False)
+            _pool = None
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=max_workers,
+                                        mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_init_worker,
+                                        initargs=(worker_settings,))
+            _pool_size = max_workers
+            _pool_settings = worker_settings
+        return _pool
+
+
+def shutdown_process_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+def _init_worker(worker_settings: Dict):
+    import django
+    for name, value in worker_settings.items():
+        setattr(settings, name, value)
+    django.setup()
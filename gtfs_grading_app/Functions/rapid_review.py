@@ -0,0 +1,48 @@
+#####
+# This file contains the payload of rapid review mode.
+#
+# In rapid review mode the reviewer steps through the results of a review category in the browser with the keyboard.
+# Entering a category fetches one payload with every result of the category, its review field, related fields and
+# current score, and each score is then saved on its own with a small request to rapid_review_score. Only categories
+# BatchResultsCaptureWidget supports can be reviewed this way, they need no map, image or reference.
+#####
+
+from django.urls import reverse
+
+from gtfs_grading_app.Functions import lookup_cache
+from gtfs_grading_app.classes.classes import review_field_factory
+from gtfs_grading_app.models import result, related_field, score
+
+
+def build_category_payload(my_review, my_review_category) -> dict:
+    """returns the rapid review payload of a review category, read with a fixed number of queries. my_review_category
+    needs its gtfs_field and results_capture_widget."""
+    my_gtfs_field = my_review_category.gtfs_field
+    my_results_capture_widget = my_review_category.results_capture_widget
+    results = list(result.objects.filter(review=my_review, review_category=my_review_category).order_by('position'))
+    related_fields = {}
+    for field in related_field.objects.filter(result__in=results).order_by('id'):
+        related_fields.setdefault(field.result_id, []).append(
+            {'label': lookup_cache.gtfs_field_labels.get(field.gtfs_field_id), 'value': field.gtfs_field_value})
+    scores = score.objects.filter(results_capture_widget=my_results_capture_widget).order_by('score')
+
+    payload_results = []
+    for my_result in results:
+        review_field = review_field_factory(my_gtfs_field, my_result)
+        payload_results.append({'id': my_result.id,
+                                'position': my_result.position,
+                                'reviewed_data': my_result.reviewed_data,
+                                'field': review_field.get_template_context(),
+                                'related_fields': related_fields.get(my_result.id, []),
+                                'score_id': my_result.score_id,
+                                'score_reason': my_result.score_reason,
+                                'save_url': reverse('rapid_review_score', args=[my_result.id])})
+
+    return {'review_id': my_review.id,
+            'review_category': {'id': my_review_category.id,
+                                'label': my_gtfs_field.field_name_to_label,
+                                'type': my_gtfs_field.type,
+                                'has_score_reason': my_results_capture_widget.has_score_reason,
+                                'scores': [{'id': my_score.id, 'score': float(my_score.score),
+                                            'help_text': my_score.help_text} for my_score in scores]},
+            'results': payload_results}
@@ -0,0 +1,62 @@
+#####
+# This file contains the ETags of the review and completed review pages.
+#
+# A review's version is bumped by every write to the review or its results, scores, images and references, see
+# ResultForm, BatchResultForm, skip_result, mark_review_complete and review.mark_status_*. The configuration the pages
+# show, scores and review categories with their fields and widgets, is shared by every review, so writing it bumps the
+# version of all of them but the completed ones. Completed reviews are rendered from their review_snapshot, which
+# configuration writes do not change, so their ETag is built from the snapshot instead of the version.
+#
+# The pages answer If-None-Match with 304 after reading the version only, before the results are queried or rendered.
+# Reviews still in progress get no ETag, setup may still be adding their results. review_evaluation_results moves a
+# review to review before its ETag is computed. Responses that would show pending messages get no ETag either.
+#####
+
+from typing import Optional
+
+from django.contrib import messages
+from django.db.models import Count, F, Max, Sum
+from django.db.models.signals import post_save, post_delete
+
+from gtfs_grading_app.models import review, score, review_category, gtfs_field, review_widget, results_capture_widget
+
+
+def bump_all_review_versions(**kwargs):
+    review.objects.exclude(review_status="Completed").update(version=F('version') + 1)
+
+
+def get_review_etag(request, review_id, active_result_id=None) -> Optional[str]:
+    """returns the ETag of the pages of a review, or None when they should not be answered with 304"""
+    if _has_messages(request):
+        return None
+    row = review.objects.filter(id=review_id).values_list('review_status', 'version', 'snapshot__id').first()
+    if row is None:
+        return None
+    review_status, version, snapshot_id = row
+    if review_status == "Completed":
+        # reviews completed before snapshots existed get theirs when they are first rendered
+        return None if snapshot_id is None else '"review-{}-snapshot-{}"'.format(review_id, snapshot_id)
+    if review_status == "In progress":
+        return None
+    return '"review-{}-{}"'.format(review_id, version)
+
+
+def get_completed_reviews_etag(request) -> Optional[str]:
+    """returns the ETag of the list of completed reviews, it changes when a review is completed, deleted or completed
+    again"""
+    if _has_messages(request):
+        return None
+    completed = review.objects.filter(review_status="Completed").aggregate(count=Count('id'), last=Max('id'),
+                                                                           versions=Sum('version'))
+    return '"completed-reviews-{count}-{last}-{versions}"'.format(**completed)
+
+
+def _has_messages(request) -> bool:
+    """returns True when messages are waiting to be shown, a 304 would leave them unseen. Reading the length of the
+    storage does not mark them as shown."""
+    return len(messages.get_messages(request)) > 0
+
+
+for model in [score, review_category, gtfs_field, review_widget, results_capture_widget]:
+    post_save.connect(bump_all_review_versions, sender=model, weak=False)
+    post_delete.connect(bump_all_review_versions, sender=model, weak=False)
@@ -0,0 +1,142 @@
+#####
+# This file contains the database backed job queue that runs review setup outside of the request cycle.
+#
+# start_new_evaluation queues a review_setup_job and the browser polls its status while a worker, started with
+#   python manage.py run_review_setup_worker
+# claims queued jobs one at a time and runs DataSelector.setup_initial_data_for_review on them. A job is claimed with a
+# conditional update, so several workers can share the queue without running a job twice. A running job that has not
+# reported progress for settings.REVIEW_SETUP_JOB_TIMEOUT seconds is assumed to belong to a dead worker and is queued
+# again.
+#
+# Uploading a feed queues a precompute job for its first agencies and route types, at most
+# settings.REVIEW_PRECOMPUTE_MAX_PER_UPLOAD of them, see enqueue_plan_precompute. Those build the review plan ahead of
+# time so setup only has to commit it, and they run after any review setup job that is waiting. Setting up a review
+# queues the precompute of the next review of its agency and route type.
+#####
+
+import logging
+from datetime import timedelta
+from typing import List, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from gtfs_grading_app.Functions import feed_cache
+from gtfs_grading_app.classes.classes import DataSelector
+from gtfs_grading_app.classes.review_setup import precompute_review_plan
+from gtfs_grading_app.models import review_category, review_setup_job
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_review_setup(gtfs_feed_hash, agency, mode) -> review_setup_job:
+    """Queues review setup for an agency and mode of a cached feed"""
+    categories = review_category.objects.select_related('gtfs_field').order_by('id')
+    return review_setup_job.objects.create(gtfs_feed_hash=gtfs_feed_hash,
+                                           agency=agency,
+                                           mode=mode,
+                                           category_progress=[{'id': category.id,
+                                                               'name': category.gtfs_field.field_name_to_label,
+                                                               'done': False}
+                                                              for category in categories])
+
+
+def enqueue_plan_precompute(gtfs_feed_hash, agency=None, mode=None) -> List[review_setup_job]:
+    """Queues precompute jobs for an agency and mode of a cached feed, or for the first
+    settings.REVIEW_PRECOMPUTE_MAX_PER_UPLOAD agencies and route types of its manifest, skipping the ones that are
+    already queued"""
+    if agency is None:
+        pairs = [(agency_info['agency_name'], route_type)
+                 for agency_info in feed_cache.load_manifest(gtfs_feed_hash)['agencies']
+                 for route_type in agency_info['route_types']][:settings.REVIEW_PRECOMPUTE_MAX_PER_UPLOAD]
+    else:
+        pairs = [(agency, mode)]
+    queued = set(review_setup_job.objects.filter(gtfs_feed_hash=gtfs_feed_hash, precompute=True, status="Queued")
+                 .values_list('agency', 'mode'))
+    return [review_setup_job.objects.create(gtfs_feed_hash=gtfs_feed_hash, agency=agency, mode=mode, precompute=True)
+            for agency, mode in pairs if (agency, int(mode)) not in queued]
+
+
+def claim_next_job() -> Optional[review_setup_job]:
+    """Marks the oldest queued job as running and returns it, or returns None when the queue is empty. Review setup
+    jobs are claimed before precompute jobs."""
+    for job_id in review_setup_job.objects.filter(status="Queued").order_by('precompute', 'created_date', 'id') \
+            .values_list('id', flat=True):
+        claimed = review_setup_job.objects.filter(id=job_id, status="Queued") \
+            .update(status="Running", updated_date=timezone.now())
+        if claimed:
+            return review_setup_job.objects.get(id=job_id)
+    return None
+
+
+def requeue_stale_jobs() -> int:
+    """Queues running jobs that stopped reporting progress again and returns how many there were"""
+    cutoff = timezone.now() - timedelta(seconds=settings.REVIEW_SETUP_JOB_TIMEOUT)
+    return review_setup_job.objects.filter(status="Running", updated_date__lt=cutoff) \
+        .update(status="Queued", stage=None, updated_date=timezone.now())
+
+
+class JobProgress:
+    """The progress callback passed to setup_initial_data_for_review, it saves each step on the job"""
+
+    def __init__(self, job):
+        self.job = job
+
+    def __call__(self, stage, review_category_id=None):
+        self.job.stage = stage
+        if review_category_id is not None:
+            for category in self.job.category_progress:
+                if category['id'] == review_category_id:
+                    category['done'] = True
+        self.job.save(update_fields=['stage', 'category_progress', 'updated_date'])
+
+
+def run_job(job):
+    """Runs review setup, or the precompute, for a claimed job and records the result, or the error, on it. Once a
+    review is set up the plan of the next review of its agency and mode is precomputed."""
+    my_review = None
+    try:
+        if job.precompute:
+            filtered_feed_hash = precompute_review_plan(job.gtfs_feed_hash, job.agency, job.mode)
+        else:
+            filtered_feed_hash, my_review = DataSelector.setup_initial_data_for_review(job.gtfs_feed_hash,
+                                                                                      job.agency,
+                                                                                      job.mode,
+                                                                                      progress=JobProgress(job))
+    except Exception as e:
+        logger.exception("review setup job %s failed", job.id)
+        job.status = "Failed"
+        job.error = str(e) or e.__class__.__name__
+        job.save(update_fields=['status', 'error', 'updated_date'])
+        return
+
+    job.status = "Completed"
+    job.stage = None
+    job.review = my_review
+    job.filtered_feed_hash = filtered_feed_hash
+    job.save(update_fields=['status', 'stage', 'review', 'filtered_feed_hash', 'updated_date'])
+    if not job.precompute and settings.REVIEW_PRECOMPUTE_PLANS:
+        enqueue_plan_precompute(job.gtfs_feed_hash, job.agency, job.mode)
+
+
+def run_queued_jobs() -> int:
+    """Runs queued jobs until the queue is empty and returns how many were run"""
+    count = 0
+    job = claim_next_job()
+    while job is not None:
+        run_job(job)
+        count += 1
+        job = claim_next_job()
+    return count
+
+
+def get_job_status(job) -> dict:
+    """returns the status of a job as a json serializable dict"""
+    return {'id': job.id,
+            'status': job.status,
+            'stage': job.stage,
+            'categories': job.category_progress,
+            'completed_categories': sum(1 for category in job.category_progress if category['done']),
+            'total_categories': len(job.category_progress),
+            'review_id': job.review_id,
+            'error': job.error}
@@ -0,0 +1,126 @@
+#####
+# This file contains the snapshot of a completed review.
+#
+# A completed review never changes, so when it is marked complete every result is copied, with everything the
+# completed review pages show about it (category label, score, reason, related fields, image and reference), into one
+# review_snapshot row. Those pages then read that one row instead of rebuilding each result from the live tables, and
+# they keep showing the review as it was when the review categories are configured differently later, which also lets
+# them keep their ETag.
+#
+# Snapshot results are dicts shaped like the result model (result.score.score, result.review_category.gtfs_field...)
+# so the templates read them the same way they read results.
+#####
+
+from typing import List, Optional
+
+from django.db import transaction
+from django.http import Http404
+
+from gtfs_grading import settings
+
+from gtfs_grading_app.classes.classes import review_field_factory, ReviewField
+from gtfs_grading_app.models import result, related_field, result_image, result_reference, review_snapshot
+
+
+def build_review_snapshot(my_review) -> List[dict]:
+    """returns the snapshot results of a review, read with a fixed number of queries"""
+    results = result.objects.filter(review=my_review).select_related('review_category__gtfs_field', 'score') \
+        .order_by('id')
+    related_fields = {}
+    for field in related_field.objects.filter(result__review=my_review).select_related('gtfs_field').order_by('id'):
+        related_fields.setdefault(field.result_id, []).append(field)
+    images = {image.result_id: image for image in result_image.objects.filter(result__review=my_review)}
+    references = {reference.result_id: reference
+                  for reference in result_reference.objects.filter(result__review=my_review)}
+
+    snapshot = []
+    for my_result in results:
+        my_gtfs_field = my_result.review_category.gtfs_field
+        review_field_template, review_field_context = _get_review_field(my_gtfs_field, my_result)
+        image = images.get(my_result.id)
+        reference = references.get(my_result.id)
+        snapshot.append({
+            'id': my_result.id,
+            'review_id': my_result.review_id,
+            'review_category_id': my_result.review_category_id,
+            'position': my_result.position,
+            'review_category': {'gtfs_field': {'name': my_gtfs_field.name,
+                                               'table': my_gtfs_field.table,
+                                               'type': my_gtfs_field.type,
+                                               'field_name_to_label': my_gtfs_field.field_name_to_label}},
+            'reviewed_data': my_result.reviewed_data,
+            'score': None if my_result.score is None else {'score': float(my_result.score.score),
+                                                           'help_text': my_result.score.help_text},
+            'score_reason': my_result.score_reason,
+            'related_fields': [{'label': field.gtfs_field.field_name_to_label,
+                                'gtfs_field_value': field.gtfs_field_value}
+                               for field in related_fields.get(my_result.id, [])],
+            'image': {'url': image.image.url} if image is not None and image.image else None,
+            'reference': None if reference is None else {
+                'reference_name': reference.reference_name,
+                'url': reference.url,
+                'published_reference_date': None if reference.published_reference_date is None
+                else reference.published_reference_date.isoformat()},
+            'review_field_template': review_field_template,
+            'review_field_context': review_field_context,
+        })
+    return snapshot
+
+
+def write_review_snapshot(my_review) -> review_snapshot:
+    """Writes, or rewrites, the snapshot of a review. A rewritten snapshot gets a new id, the ETag of the completed
+    review pages is built from it, see gtfs_grading_app/Functions/review_etags.py"""
+    with transaction.atomic():
+        results = build_review_snapshot(my_review)
+        review_snapshot.objects.filter(review=my_review).delete()
+        snapshot = review_snapshot.objects.create(review=my_review, results=results)
+    return snapshot
+
+
+def get_review_snapshot(my_review) -> Optional[review_snapshot]:
+    """returns the snapshot of a completed review, writing it for reviews completed before snapshots existed, or None
+    when the review is not completed"""
+    if my_review.review_status != "Completed":
+        return None
+    snapshot = review_snapshot.objects.filter(review=my_review).first()
+    if snapshot is None:
+        snapshot = write_review_snapshot(my_review)
+    return snapshot
+
+
+def get_snapshot_context(snapshot, active_result_id=None) -> dict:
+    """returns the template context of a completed review page rendered from its snapshot, with the review widget of
+    the active result when there is one. The review categories listed are the ones the review was completed with."""
+    review_categories = {}
+    for snapshot_result in snapshot.results:
+        review_categories.setdefault(snapshot_result['review_category_id'],
+                                     dict(snapshot_result['review_category'], id=snapshot_result['review_category_id']))
+    context = {'results': snapshot.results,
+               'review_categories': [review_categories[category_id] for category_id in sorted(review_categories)]}
+    if active_result_id:
+        active_result = next((snapshot_result for snapshot_result in snapshot.results
+                              if snapshot_result['id'] == int(active_result_id)), None)
+        if active_result is None:
+            raise Http404("The review has no such result")
+        context.update({'active_result': active_result,
+                        'review_widget_template': 'review_widgets/snapshot_review_widget.html',
+                        'review_field_template': active_result['review_field_template'],
+                        'related_fields': active_result['related_fields'],
+                        'image': active_result['image'],
+                        'GOOGLE_API_KEY': settings.GOOGLE_API_KEY})
+        context.update(active_result['review_field_context'])
+    return context
+
+
+def _get_review_field(my_gtfs_field, my_result):
+    """returns the template and context of the review field of a result, the field is shown as text when its type can
+    not be displayed. The google api key is left out, it is added when the page is rendered."""
+    try:
+        review_field = review_field_factory(my_gtfs_field, my_result)
+        context = review_field.get_template_context() or {}
+        template = review_field.get_field_template()
+    except (NotImplementedError, AttributeError, IndexError):
+        return 'review_field/text.html', {'field_value': ReviewField.get_field_value(my_result.reviewed_data)}
+    context.pop('GOOGLE_API_KEY', None)
+    return template, {key: value if isinstance(value, (str, int, float, type(None))) else str(value)
+                      for key, value in context.items()}
@@ -29,10 +29,10 @@
 #   - Any classes derived from the abstract class
 #####
 import math
-import tempfile
+import secrets
 from abc import ABC, abstractmethod, ABCMeta
 # from django.core.files import File
-from typing import final, Type, Union, List, Any, Dict
+from typing import final, Type, Union, List, Any, Dict, Tuple
 # from django.forms import forms
 
 # from gtfs_grading_app.forms import AddConsistencyWidgetVisualExample, AddConsistencyWidgetLink, \
@@ -44,10 +44,11 @@ from django.http import Http404
 from django.shortcuts import get_object_or_404
 
 from gtfs_grading import settings
-from gtfs_grading_app.gtfs_spec.import_gtfs_spec import get_field_type, get_table_primary_key
+from gtfs_grading_app.Functions import feed_cache
 from gtfs_grading_app.models import review_category, consistency_widget_visual_example, consistency_widget_link, score, \
-    review, result, related_field, gtfs_field
-import partridge as ptg # type: ignore
+    review, result, related_field, review_candidate_pool
+import numpy as np
+import pandas as pd
 
 # region ReviewWidget
 
@@ -348,6 +349,60 @@ class DefaultResultsCaptureWidget(ResultsCaptureWidget):
         return ResultForm(results_capture_widget=self.results_capture_widget, *args, **kwargs)
 
 
+class BatchResultsCaptureWidget(ResultsCaptureWidget):
+    """Scores a page of results of one review category in a single form. Only categories whose field is shown
+    without a map and whose results capture widget does not require an image or a reference can be scored this
+    way, those are scored one result at a time."""
+
+    BATCH_FIELD_TYPES = ['Text', 'Color']
+
+    def __init__(self, results_capture_widget, results):
+        super().__init__(results_capture_widget)
+        self.results_capture_widget = results_capture_widget
+        self.results = results
+        self.form = None
+
+    @classmethod
+    def supports(cls, my_review_category) -> bool:
+        """returns True when the results of a review category can be scored in a batch"""
+        my_results_capture_widget = my_review_category.results_capture_widget
+        return my_review_category.gtfs_field.type in cls.BATCH_FIELD_TYPES and 'Required' not in [
+            my_results_capture_widget.has_score_image,
+            my_results_capture_widget.has_reference_link,
+            my_results_capture_widget.has_reference_date]
+
+    def get_template(self) -> str:
+        return "result_capture_widgets/batch_result_capture_widget.html"
+
+    def get_template_context(self) -> Union[None, dict]:
+        """returns the scores and, for each result, its review field, related fields and form fields. get_form has to
+        be called first."""
+        related_fields: Dict[int, List[related_field]] = {}
+        for field in related_field.objects.filter(result__in=self.results).order_by('id'):
+            related_fields.setdefault(field.result_id, []).append(field)
+
+        items = []
+        for my_result in self.results:
+            review_field = review_field_factory(my_result.review_category.gtfs_field, my_result)
+            item = {'result': my_result,
+                    'review_field_template': review_field.get_field_template(),
+                    'related_fields': related_fields.get(my_result.id, []),
+                    'score_field': self.form[self.form.score_field_name(my_result)],
+                    'score_reason_field': None}
+            item.update(review_field.get_template_context())
+            if self.form.score_reason_field_name(my_result) in self.form.fields:
+                item['score_reason_field'] = self.form[self.form.score_reason_field_name(my_result)]
+            items.append(item)
+
+        return {'scores': self.form.scores, 'items': items}
+
+    def get_form(self, *args, **kwargs):
+        from gtfs_grading_app.forms import BatchResultForm
+        self.form = BatchResultForm(results_capture_widget=self.results_capture_widget, results=self.results,
+                                    *args, **kwargs)
+        return self.form
+
+
 # endregion
 
 # region DataSelector
@@ -357,11 +412,14 @@ class DataSelector(ABC):
 
     @staticmethod
     def get_valid_choices_and_related_fields():
+        '''returns the data selector choices and, for each choice, the list of data_selector fields it uses'''
         choices = (
             ("log10(n) + 2", "log10(n) + 2"),
-            ("number", 'number')
+            ("number", 'number'),
+            ("stratified log10(n) + 2", "stratified log10(n) + 2"),
+            ("stratified number", "stratified number")
         )
-        related_fields = [None, 'number_to_review']
+        related_fields = [[], ['number_to_review'], ['stratify_by'], ['number_to_review', 'stratify_by']]
         return choices, related_fields
 
     @abstractmethod
@@ -369,119 +427,93 @@ class DataSelector(ABC):
         '''This method takes the total number of rows in a table and returns the number of rows to sample'''
         raise NotImplementedError
 
+    def select_rows(self, gtfs_table, number, rng, gtfs_feed=None) -> np.ndarray:
+        '''This method returns the positions of number randomly selected rows of gtfs_table, in the order they should
+        be reviewed. rng is a numpy Generator, the same seed selects the same rows.'''
+        return rng.choice(len(gtfs_table), size=number, replace=False)
+
+    def get_required_columns(self, columns, gtfs_feed) -> List[str]:
+        '''This method returns the columns, of a table with the given columns, select_rows reads besides the ones the
+        review category shows'''
+        return []
+
+    def sample_stream(self, gtfs_feed, table, extra, rng, usecols=None) -> Tuple[pd.DataFrame, int]:
+        '''This method samples a table that is too large to load, reading it in chunks from a cached feed. It returns
+        the sampled rows, as strings in the order they should be reviewed, and how many of them are to be reviewed.
+        Up to extra more rows follow those. Only usecols are read, all columns if it is None. Memory holds one chunk
+        and the reservoir of sampled rows.'''
+        reservoir_size = self.select_row_sample_count(gtfs_feed.count_rows(table)) + extra
+        sample, total_rows = reservoir_sample(gtfs_feed.iter_chunks(table, usecols=usecols), reservoir_size, rng)
+        number = self.select_row_sample_count(total_rows)
+        return sample.iloc[:number + min(extra, total_rows - number)], number
+
 
     @staticmethod
-    def setup_initial_data_for_review(gtfs_feed_zip_file, agency, mode):
-        '''This method will select the initial set of data that will be reviewed from the provided GTFS zip file'''
-        my_review = review.objects.create(agency=agency,
-                                          mode=mode)
-        view = {
-            'agency.txt': {'agency_name': agency},
-            'routes.txt': {'route_type': mode},
-        }
-        new_tmp_dir = tempfile.mkdtemp()
-        outpath = new_tmp_dir
-        ptg.extract_feed(gtfs_feed_zip_file, outpath + "view.zip", view)
-        gtfs_feed = ptg.load_feed(gtfs_feed_zip_file)
-
-        new_session_gtfs_path = outpath + "view.zip"
-
-        for category in review_category.objects.all():
-            target_field_name = category.gtfs_field.name
-            target_table = category.gtfs_field.table
-            has_related_field_same_table = category.review_widget.has_related_field_same_table
-            has_related_field_other_table = category.review_widget.has_related_field_other_table
-            ptg_target_table = getattr(gtfs_feed, target_table.replace('.txt', ''))
-            total_table_rows = ptg_target_table.shape[0]
-            ds = data_selector_factory(category.data_selector)
-
-            number_to_sample = ds.select_row_sample_count(total_table_rows)
-            random_sample = ptg_target_table.sample(n=number_to_sample)
-
-            reviewed_data_pk_name = get_table_primary_key(target_table)
-
-            for index, row in random_sample.iterrows():
-                try:
-                    reviewed_data = row[target_field_name]
-                except KeyError:
-                    reviewed_data = "[blank]"
-                try:
-                    reviewed_data_pk_value = row[reviewed_data_pk_name]
-                except KeyError:
-                    reviewed_data_pk_value = None
-
-                this_result = result.objects.create(review=my_review,
-                                                    review_category=category,
-                                                    reviewed_data=reviewed_data,
-                                                    reviewed_data_pk_name=reviewed_data_pk_name,
-                                                    reviewed_data_pk_value=reviewed_data_pk_value)
-                if has_related_field_same_table:
-                    related_fields = category.review_widget.related_field_same_table.all()
-                    for field in related_fields:
-                        try:
-                            gtfs_field_value = row[field.name]
-                        except KeyError:
-                            gtfs_field_value = "[blank]"
-                        my_field = related_field.objects.create(gtfs_field=field,
-                                                                result=this_result,
-                                                                gtfs_field_value=gtfs_field_value)
-
-                if has_related_field_other_table:
-                    RelatedFieldsSelector = related_fields_selector_factory(category.review_widget)
-                    field_list = RelatedFieldsSelector.get_related_fields_from_gtfs(row, gtfs_feed)
-                    for field in field_list:
-                        gf, created = gtfs_field.objects.get_or_create(name=field[0],
-                                                                       table=field[1],
-                                                                       type=get_field_type(field[0], field[1]))
-                        my_field = related_field.objects.create(gtfs_field=gf,
-                                                                result=this_result,
-                                                                gtfs_field_value=str(field[2]))
-
-        return new_session_gtfs_path, my_review
+    def setup_initial_data_for_review(gtfs_feed_hash, agency, mode, progress=None):
+        '''This method will select the initial set of data that will be reviewed from the provided cached GTFS feed.
+        Rows are sampled from the subset of the feed that belongs to the agency and mode, that subset is cached once
+        and shared by every review of it. It returns the hash of the subset along with the new review. progress, if
+        given, is called with (stage, review category id or None) as setup moves along. A plan sampled ahead of time,
+        see precompute_review_plan, is used when there is one.'''
+        from gtfs_grading_app.Functions.feed_ingest import get_referenced_tables, PICKER_FILES
+        from gtfs_grading_app.classes.review_setup import build_review_plan, commit_review_plan, \
+            get_category_specs, take_precomputed_plan
+
+        if progress is None:
+            progress = _ignore_progress
+        progress('Filtering feed')
+        tables = get_referenced_tables() | set(PICKER_FILES)
+        new_session_gtfs_feed = feed_cache.get_filtered_feed(gtfs_feed_hash, agency, mode, tables)
+        specs = get_category_specs()
+
+        precomputed = take_precomputed_plan(new_session_gtfs_feed, specs)
+        if precomputed is not None:
+            seed, plan = precomputed
+            for spec in specs:
+                progress('Sampling', spec['id'])
+        else:
+            seed = secrets.randbits(31)
+            plan = build_review_plan(feed_cache.load_feed(new_session_gtfs_feed), specs, progress=progress, seed=seed)
+        progress('Writing results')
+        with transaction.atomic():
+            my_review = review.objects.create(agency=agency,
+                                              mode=mode,
+                                              gtfs_feed_hash=new_session_gtfs_feed,
+                                              sample_seed=seed)
+            commit_review_plan(my_review, plan)
+
+        return new_session_gtfs_feed, my_review
 
     @staticmethod
-    def select_new_item_for_review(self, gtfs_feed, current_result_id):
-        '''This method will replace the specified current result with a new one from the gtfs_feed'''
+    def select_new_item_for_review(current_result_id):
+        '''This method will replace the specified current result with the next candidate sampled for its category when
+        the review was set up. It returns the replaced result, or None when there are no candidates left.'''
+        from gtfs_grading_app.classes.review_setup import skip_result
 
         target_result = get_object_or_404(result, id=current_result_id)
-        gtfs_feed = ptg.load_feed(gtfs_feed)
-
-        # check that gtfs_feed matches result
+        return skip_result(target_result)
 
     @staticmethod
-    def validate_skip_result(self, request, current_result_id):
+    def validate_skip_result(request, current_result_id):
         '''This method validates that you may replace a result in the review.  It returns True or False and a request
-        with an error or success message.'''
-        target_result = get_object_or_404(result, id=current_result_id)
-        gtfs_feed = ptg.load_feed(request.session['gtfs_feed'])
-        if not self.__gtfs_feed_matches_result(gtfs_feed, target_result):
-            messages.error(request, 'Your active GTFS feed does not appear to match the review you are working on. You may no longer skip an item')
+        with an error or success message. Only the review and its candidate pool are read.'''
+        target_result = get_object_or_404(result.objects.select_related('review'), id=current_result_id)
+        if target_result.review.review_status == "Completed":
+            messages.error(request, 'This review has been completed. You may no longer skip an item')
             return False, request
-        if not self.__check_all_gtfs_rows_are_not_selected(gtfs_feed, target_result):
-            messages.warning(request, "You can not skip any items in this category, all items in the feed have been selected for review.")
+        if target_result.score_id is not None:
+            messages.warning(request, "This item has already been scored, only items that have not been scored may be skipped.")
+            return False, request
+        pool = review_candidate_pool.objects.filter(review_id=target_result.review_id,
+                                                    review_category_id=target_result.review_category_id).first()
+        if pool is None or not pool.remaining:
+            messages.warning(request, "You can not skip any more items in this category, there are no other items left to review in its place.")
             return False, request
         return True, request
 
 
-    @staticmethod
-    def __gtfs_feed_matches_result(self, gtfs_feed, current_result):
-        current_review_agency = current_result.review.agency
-        feed_agency_list = gtfs_feed.agency['agency_name'].tolist()
-        return current_review_agency in feed_agency_list
-
-    @staticmethod
-    def __check_all_gtfs_rows_are_not_selected(self, gtfs_feed, current_result):
-        # get data_selector
-        data_selector = data_selector_factory(current_result.review_category.data_selector)
-
-        # find total rows in GTFS table
-        target_table = current_result.review_category.gtfs_field.table
-        ptg_target_table = getattr(gtfs_feed, target_table.replace('.txt', ''))
-        total_table_rows = ptg_target_table.shape[0]
-
-        sample_size = data_selector.select_row_sample_count(total_table_rows)
-
-        return sample_size != total_table_rows
+def _ignore_progress(stage, review_category_id=None):
+    pass
 
 
 def data_selector_factory(data_selector):
@@ -491,10 +523,16 @@ def data_selector_factory(data_selector):
             data_selector: an instance of the data_selector model
     """
     if data_selector.name == "log10(n) + 2":
-        return LogPlusTwoDataSelector()
+        return LogPlusTwoDataSelector(data_selector)
 
     elif data_selector.name == "number":
-        return NumberDataSelector()
+        return NumberDataSelector(data_selector)
+
+    elif data_selector.name == "stratified log10(n) + 2":
+        return StratifiedLogPlusTwoDataSelector(data_selector)
+
+    elif data_selector.name == "stratified number":
+        return StratifiedNumberDataSelector(data_selector)
 
     else:
         raise NotImplementedError
@@ -502,12 +540,11 @@ def data_selector_factory(data_selector):
 
 class LogPlusTwoDataSelector(DataSelector):
 
-    def __int__(self, data_selector):
+    def __init__(self, data_selector):
         self.data_selector = data_selector
 
     def select_row_sample_count(self, total_row) -> int:
         x = math.log10(total_row) + 2
-        print(x)
         x = round(x)
         if total_row > x:
             return x
@@ -517,7 +554,7 @@ class LogPlusTwoDataSelector(DataSelector):
 
 class NumberDataSelector(DataSelector):
 
-    def __int__(self, data_selector):
+    def __init__(self, data_selector):
         self.data_selector = data_selector
 
     def select_row_sample_count(self, total_row) -> int:
@@ -528,35 +565,315 @@ class NumberDataSelector(DataSelector):
             return total_row
 
 
+class StratifiedDataSelector(DataSelector):
+    """Spreads the sample across the values of the data_selector's stratify_by column, so every route (or mode,
+    station or shape) gets a share of the sample proportional to its number of rows. A table without the column is
+    joined to it through trips, routes or stops, and is sampled uniformly when that is not possible either.
+
+    Rows are shuffled within their stratum and then ordered by (rank in stratum + jitter) / stratum size. Every prefix
+    of that order is stratified, so replacements for skipped results stay spread across the strata as well. Only the
+    few rows at the front of each stratum are ranked, so sampling costs a handful of vectorized passes over the
+    table."""
+
+    def __init__(self, data_selector):
+        self.data_selector = data_selector
+
+    def select_rows(self, gtfs_table, number, rng, gtfs_feed=None) -> np.ndarray:
+        strata = get_strata(gtfs_table, self.data_selector.stratify_by, gtfs_feed)
+        if strata is None or number == 0:
+            return super().select_rows(gtfs_table, number, rng, gtfs_feed)
+        return stratified_positions(strata, number, rng)
+
+    def get_required_columns(self, columns, gtfs_feed) -> List[str]:
+        encoder = get_strata_encoder(columns, self.data_selector.stratify_by, gtfs_feed)
+        return [] if encoder is None else encoder.usecols
+
+    def sample_stream(self, gtfs_feed, table, extra, rng, usecols=None) -> Tuple[pd.DataFrame, int]:
+        '''Streams the table twice. The first pass only keeps the stratum of each row, as a small integer, the second
+        one keeps the rows stratified_positions picks.'''
+        encoder = get_strata_encoder(gtfs_feed.get_columns(table), self.data_selector.stratify_by, gtfs_feed)
+        if encoder is None:
+            return super().sample_stream(gtfs_feed, table, extra, rng, usecols)
+        strata = np.concatenate([encoder(chunk) for chunk in gtfs_feed.iter_chunks(table, usecols=encoder.usecols)]
+                                or [np.empty(0, dtype=np.int64)])
+        number = self.select_row_sample_count(len(strata))
+        if number == 0:
+            return super().sample_stream(gtfs_feed, table, extra, rng, usecols)
+        positions = stratified_positions(strata, number + min(extra, len(strata) - number), rng)
+        return gather_rows(gtfs_feed.iter_chunks(table, usecols=usecols), positions), number
+
+
+class StratifiedLogPlusTwoDataSelector(StratifiedDataSelector, LogPlusTwoDataSelector):
+    pass
+
+
+class StratifiedNumberDataSelector(StratifiedDataSelector, NumberDataSelector):
+    pass
+
+
+# tables a stratify_by column can be joined from, as (key column, table)
+STRATA_JOINS = [('trip_id', 'trips.txt'), ('route_id', 'routes.txt'), ('stop_id', 'stops.txt')]
+
+
+def get_strata(gtfs_table, column, gtfs_feed) -> Union[None, np.ndarray]:
+    """returns the integer stratum of each row of gtfs_table, rows with the same value of column share a stratum and
+    rows without one form their own. Returns None when column can not be reached from the table."""
+    encoder = get_strata_encoder(gtfs_table.columns, column, gtfs_feed)
+    if encoder is None:
+        return None
+    return encoder(gtfs_table)
+
+
+def get_strata_encoder(columns, column, gtfs_feed, visited=()):
+    """returns a callable giving the stratum of each row of a DataFrame, or chunk, of a table with the given columns,
+    strata are numbered the same way across calls. It reads the DataFrame's usecols. Returns None when column can not
+    be reached from the table."""
+    if column in columns:
+        return ValueStrataEncoder(column)
+    if gtfs_feed is None:
+        return None
+    for key, table_name in STRATA_JOINS:
+        if key not in columns or table_name in visited:
+            continue
+        other_table = gtfs_feed.get(table_name)
+        if key not in other_table.columns:
+            continue
+        other_encoder = get_strata_encoder(other_table.columns, column, gtfs_feed, visited + (table_name,))
+        if other_encoder is None:
+            continue
+        other_codes = other_encoder(other_table)
+        first = ~other_table[key].duplicated().to_numpy()
+        return JoinStrataEncoder(key, pd.Index(other_table[key].to_numpy()[first]), other_codes[first])
+    return None
+
+
+class ValueStrataEncoder:
+    """Strata of the values of a column of the table itself"""
+
+    def __init__(self, column):
+        self.column = column
+        self.usecols = [column]
+        self._codes: Dict[Any, int] = {}
+
+    def __call__(self, df) -> np.ndarray:
+        codes, uniques = pd.factorize(df[self.column])
+        uniques = _strip_values(uniques)
+        mapping = np.array([self._codes.setdefault(value, len(self._codes)) for value in uniques], dtype=np.int64)
+        if (codes < 0).any():
+            # rows without a value form one more stratum
+            mapping = np.append(mapping, self._codes.setdefault(None, len(self._codes)))
+        return mapping[codes]
+
+
+class JoinStrataEncoder:
+    """Strata of a column of another table, joined on key"""
+
+    def __init__(self, key, index, codes):
+        self.key = key
+        self.usecols = [key]
+        self.index = index
+        # keys missing from the other table (-1) pick an extra stratum appended at the end
+        self.codes = np.append(codes, codes.max(initial=-1) + 1)
+
+    def __call__(self, df) -> np.ndarray:
+        return self.codes[_get_indexer(self.index, df[self.key])]
+
+
+def _get_indexer(index, values) -> np.ndarray:
+    """index.get_indexer(values) of the stripped values, each distinct value is stripped and looked up once"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+    else:
+        codes, uniques = pd.factorize(values)
+    indexer = np.append(index.get_indexer(_strip_values(uniques)), -1)
+    return indexer[codes]
+
+
+def _strip_values(values):
+    """values with the whitespace around strings removed, as partridge does when it reads a table. Chunks read with
+    CachedFeed.iter_chunks are not stripped yet."""
+    if values.dtype != object:
+        return values
+    return pd.Index(values).map(lambda value: value.strip() if isinstance(value, str) else value)
+
+
+def stratified_positions(strata, number, rng) -> np.ndarray:
+    """returns the positions of number rows spread across strata proportionally to their sizes, see
+    StratifiedDataSelector"""
+    total = len(strata)
+    counts = np.bincount(strata)
+    u = rng.random(total)
+
+    # Only the first (number + strata) * size / total rows of each stratum, in u order, can be among the number
+    # smallest keys. Rows are filtered on u with a threshold that keeps a few more than that, so ranks are only
+    # computed for those. A stratum that kept too few rows falls back to keeping all of its rows.
+    needed = np.minimum(np.ceil((number + len(counts)) * counts / total), counts)
+    threshold = (needed + 4 * np.sqrt(needed) + 4) / np.maximum(counts, 1)
+    candidates = np.flatnonzero(u < threshold[strata])
+    kept = np.bincount(strata[candidates], minlength=len(counts))
+    if np.any(kept < needed):
+        threshold[kept < needed] = 1
+        candidates = np.flatnonzero(u < threshold[strata])
+        kept = np.bincount(strata[candidates], minlength=len(counts))
+
+    candidate_strata = strata[candidates]
+    order = np.lexsort((u[candidates], candidate_strata))
+    rank = np.empty(len(candidates))
+    rank[order] = np.arange(len(candidates)) - np.repeat(np.cumsum(kept) - kept, kept)
+    key = (rank + rng.random(len(candidates))) / counts[candidate_strata]
+
+    if number < len(candidates):
+        selected = np.argpartition(key, number - 1)[:number]
+    else:
+        selected = np.arange(len(candidates))
+    return candidates[selected[np.argsort(key[selected], kind='stable')]]
+
+
+def reservoir_sample(chunks, size, rng) -> Tuple[pd.DataFrame, int]:
+    """Returns a uniform random sample of size rows, in random order, from an iterable of DataFrames along with the
+    number of rows read. Every row gets a random key and the reservoir keeps the rows with the smallest keys, so only
+    rows whose key beats the largest one in a full reservoir are ever copied out of a chunk."""
+    reservoir = None
+    keys = np.empty(0)
+    total_rows = 0
+    for chunk in chunks:
+        chunk_keys = rng.random(len(chunk))
+        total_rows += len(chunk)
+        if reservoir is not None and len(reservoir) == size:
+            entering = chunk_keys < keys.max(initial=np.inf)
+            chunk, chunk_keys = chunk[entering], chunk_keys[entering]
+        reservoir = chunk if reservoir is None else pd.concat([reservoir, chunk], ignore_index=True)
+        keys = np.concatenate([keys, chunk_keys])
+        if len(reservoir) > size:
+            keep = np.argpartition(keys, size - 1)[:size] if size else np.empty(0, dtype=np.int64)
+            reservoir, keys = reservoir.iloc[keep].reset_index(drop=True), keys[keep]
+    if reservoir is None:
+        return pd.DataFrame(), 0
+    order = np.argsort(keys, kind='stable')
+    return reservoir.iloc[order].reset_index(drop=True), total_rows
+
+
+def gather_rows(chunks, positions) -> pd.DataFrame:
+    """returns the rows at positions, in that order, from an iterable of DataFrames"""
+    sorted_positions = np.sort(positions)
+    pieces = []
+    offset = 0
+    for chunk in chunks:
+        start, stop = np.searchsorted(sorted_positions, [offset, offset + len(chunk)])
+        if stop > start:
+            pieces.append(chunk.iloc[sorted_positions[start:stop] - offset])
+        offset += len(chunk)
+    if not pieces:
+        return pd.DataFrame()
+    rows = pd.concat(pieces)
+    rows.index = sorted_positions[:len(rows)]
+    return rows.loc[positions].reset_index(drop=True)
+
 class RelatedFieldSelector(ABC):
+    """A RelatedFieldSelector finds data in other GTFS tables that is related to the rows sampled for a review, for
+    example the route names of a sampled trip."""
+
+    # GTFS tables, other than the reviewed table, this selector reads
+    related_tables: List[str] = []
+    # columns of the sampled rows this selector reads, None when it may read any of them
+    sample_columns: Union[None, List[str]] = None
 
     @abstractmethod
     def get_related_fields_from_gtfs(self, gtfs_table_row, gtfs_feed) -> list:
+        """returns a list of [field name, file, value] for one sampled row"""
         raise NotImplementedError
 
+    def get_related_fields_for_sample(self, sample, gtfs_feed) -> List[list]:
+        """returns, in the order of the sample DataFrame, the list get_related_fields_from_gtfs returns for each row.
+        Selectors should override this with a vectorized lookup, this default calls get_related_fields_from_gtfs per
+        row."""
+        return [self.get_related_fields_from_gtfs(row, gtfs_feed) for index, row in sample.iterrows()]
+
+
+class JoinRelatedFieldSelector(RelatedFieldSelector):
+    """Selects related fields by joining the sampled rows to one other table on a key column. The related table is
+    indexed once, so the cost of a lookup barely changes with the size of the sample. Concrete classes only declare
+    the join."""
+
+    related_table: str
+    sample_key: str
+    related_key: str
+    related_fields: List[str]
 
-def related_fields_selector_factory(review_widget):
-    if review_widget.related_field_other_table == "trip_headsign":
+    @property  # type: ignore
+    def related_tables(self) -> List[str]:  # type: ignore
+        return [self.related_table]
+
+    @property  # type: ignore
+    def sample_columns(self) -> List[str]:  # type: ignore
+        return [self.sample_key]
+
+    def get_related_fields_from_gtfs(self, gtfs_table_row, gtfs_feed) -> list:
+        return self.get_related_fields_for_sample(gtfs_table_row.to_frame().T, gtfs_feed)[0]
+
+    def get_related_fields_for_sample(self, sample, gtfs_feed) -> List[list]:
+        table = gtfs_feed.get(self.related_table)
+        lookup = table.drop_duplicates(self.related_key).set_index(self.related_key) \
+            .reindex(columns=self.related_fields)
+        if self.sample_key in sample.columns:
+            keys = sample[self.sample_key].to_numpy()
+        else:
+            keys = [None] * len(sample)
+        values = lookup.reindex(keys).to_numpy(dtype=object)
+
+        return [[[field, self.related_table, ReviewField.get_field_value(None if pd.isna(value) else value)]
+                 for field, value in zip(self.related_fields, row)]
+                for row in values]
+
+
+def related_fields_selector_factory(related_field_other_table):
+    """This factory produces the appropriate RelatedFieldSelector
+
+        Args:
+            related_field_other_table: the related_field_other_table name stored on a review_widget
+    """
+    if related_field_other_table == "trip_headsign":
         return TripHeadsignRelatedFieldSelector()
+    elif related_field_other_table == "trip_route":
+        return TripRouteRelatedFieldSelector()
+    elif related_field_other_table == "parent_station":
+        return ParentStationRelatedFieldSelector()
+    elif related_field_other_table == "stop_time_stop":
+        return StopTimeStopRelatedFieldSelector()
     else:
-        return NotImplementedError
+        raise NotImplementedError
 
 
-class TripHeadsignRelatedFieldSelector(RelatedFieldSelector):
+class TripHeadsignRelatedFieldSelector(JoinRelatedFieldSelector):
+    """Route names and description of a sampled trip, shown when reviewing trip headsigns"""
+    related_table = 'routes.txt'
+    sample_key = 'route_id'
+    related_key = 'route_id'
+    related_fields = ['route_short_name', 'route_long_name', 'route_desc']
+
+
+class TripRouteRelatedFieldSelector(JoinRelatedFieldSelector):
+    """Route of a sampled trip"""
+    related_table = 'routes.txt'
+    sample_key = 'route_id'
+    related_key = 'route_id'
+    related_fields = ['route_short_name', 'route_long_name', 'route_type']
+
+
+class ParentStationRelatedFieldSelector(JoinRelatedFieldSelector):
+    """Parent station of a sampled stop"""
+    related_table = 'stops.txt'
+    sample_key = 'parent_station'
+    related_key = 'stop_id'
+    related_fields = ['stop_name', 'stop_code']
 
-    def get_related_fields_from_gtfs(self, gtfs_table_row, gtfs_feed) -> list:
-        """function takes a gtfs table row and a gtfs feed and returns the a list containing the file, field name, and
-        value of the related field"""
-
-        route_id = gtfs_table_row['route_id']
-        routes = gtfs_feed.routes
-        route_row = routes[routes.route_id.eq(route_id)]
-        return [
-            ['route_short_name', 'routes.txt', route_row.iloc[0]['route_short_name']],
-            ['route_long_name', 'routes.txt', route_row.iloc[0]['route_long_name']],
-            ['route_desc', 'routes.txt', route_row.iloc[0]['route_desc']]
-        ]
 
+class StopTimeStopRelatedFieldSelector(JoinRelatedFieldSelector):
+    """Stop served by a sampled stop time"""
+    related_table = 'stops.txt'
+    sample_key = 'stop_id'
+    related_key = 'stop_id'
+    related_fields = ['stop_name', 'stop_lat', 'stop_lon']
 
 
 # endregion
\ No newline at end of file
@@ -0,0 +1,451 @@
+#####
+# This file contains the pipeline that selects the initial data for a review.
+#
+# Setup happens in two steps:
+#   - build_review_plan samples every review category and resolves its related fields in memory. A plan only holds
+#     plain python values, nothing in it touches the database.
+#   - commit_review_plan writes the whole plan, and the review progress counters, with bulk inserts inside a single
+#     transaction.
+#
+# DataSelector.setup_initial_data_for_review ties the two steps together.
+#
+# A plan reads each table of the feed once, and only the columns the review categories use, with compact dtypes, see
+# load_review_tables. Tables at least settings.REVIEW_STREAMING_SAMPLE_THRESHOLD bytes large are sampled while
+# streaming their CSV instead, see DataSelector.sample_stream, so stop_times and shapes of big feeds are never loaded
+# whole.
+#
+# Each table is planned on its own, see plan_table, and with settings.REVIEW_SETUP_WORKERS above one the tables are
+# planned in parallel by the process pool of gtfs_grading_app/Functions/process_pool.py. Only plain values come back
+# from the workers and the plan is still written by commit_review_plan in one transaction.
+#
+# With settings.REVIEW_SHARED_TABLE_SAMPLES, categories on the same table with the same data selector share one sample,
+# see group_specs, so the table is sampled once for all of them.
+#
+# Plans can be built ahead of time, right after a feed is uploaded, see precompute_review_plan. Setup then takes the
+# stored plan, if the review categories did not change since, and only has to commit it.
+#
+# Each category samples settings.REVIEW_SKIP_CANDIDATES rows more than it reviews. The extra rows are stored, with their
+# related fields, in a review_candidate_pool and skip_result replaces a skipped result with the next one, so skipping
+# never reads the feed again.
+#####
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import secrets
+import tempfile
+import time
+from concurrent.futures import as_completed
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+
+from gtfs_grading_app.Functions import feed_cache, process_pool
+from gtfs_grading_app.classes.classes import data_selector_factory, related_fields_selector_factory
+from gtfs_grading_app.gtfs_spec.import_gtfs_spec import get_field_type, get_table_primary_key
+from gtfs_grading_app.models import review_category, result, related_field, gtfs_field, review, \
+    review_category_progress, review_candidate_pool, result_image, result_reference
+
+logger = logging.getLogger(__name__)
+
+def get_category_specs() -> List[dict]:
+    """returns everything the plan needs to know about each review category, read with a fixed number of queries"""
+    specs = []
+    categories = review_category.objects.select_related('gtfs_field', 'review_widget', 'data_selector') \
+        .prefetch_related('review_widget__related_field_same_table').order_by('id')
+    for category in categories:
+        my_review_widget = category.review_widget
+        specs.append({'id': category.id,
+                      'field_name': category.gtfs_field.name,
+                      'table': category.gtfs_field.table,
+                      'pk_name': get_table_primary_key(category.gtfs_field.table),
+                      'data_selector': category.data_selector,
+                      'related_same_table': [(f.id, f.name) for f in my_review_widget.related_field_same_table.all()],
+                      'related_other_table': my_review_widget.related_field_other_table or None})
+    return specs
+
+
+def build_category_plan(spec, gtfs_feed, seed=None, ptg_target_table=None) -> dict:
+    """Samples the rows of one review category and returns them, with their related fields, as plain values. Rows
+    sampled beyond the number to review are returned as candidates to replace skipped results. The same seed samples
+    the same rows of the same feed. ptg_target_table, if given, is the table to sample, see load_review_tables."""
+    random_sample, number_to_sample = sample_rows([spec], gtfs_feed, seed, ptg_target_table)
+    return plan_sampled_rows(spec, random_sample, number_to_sample, gtfs_feed)
+
+
+def sample_rows(specs, gtfs_feed, seed=None, ptg_target_table=None) -> Tuple[pd.DataFrame, int]:
+    """Samples rows for review categories that share their table and data selector. Returns the sampled rows, in the
+    order they are reviewed, and how many of them are reviewed, the rest are candidates to replace skipped results."""
+    spec = specs[0]
+    ds = data_selector_factory(spec['data_selector'])
+    rng = np.random.default_rng(None if seed is None else [seed, spec['id']])
+
+    if ptg_target_table is None and should_stream_table(gtfs_feed, spec['table']):
+        sample_columns = [get_sample_columns(group_spec) for group_spec in specs]
+        # None reads every column, a category of the group needs all of them
+        usecols: Optional[List[str]] = None
+        if None not in sample_columns:
+            usecols = [column for columns in sample_columns if columns is not None for column in columns]
+        random_sample, number_to_sample = ds.sample_stream(gtfs_feed, spec['table'], settings.REVIEW_SKIP_CANDIDATES,
+                                                           rng, usecols)
+        return gtfs_feed.convert_types(spec['table'], random_sample), number_to_sample
+
+    if ptg_target_table is None:
+        ptg_target_table = getattr(gtfs_feed, spec['table'].replace('.txt', ''))
+    total_table_rows = ptg_target_table.shape[0]
+    number_to_sample = ds.select_row_sample_count(total_table_rows)
+    number_of_candidates = min(settings.REVIEW_SKIP_CANDIDATES, total_table_rows - number_to_sample)
+    positions = ds.select_rows(ptg_target_table, number_to_sample + number_of_candidates, rng, gtfs_feed)
+    return ptg_target_table.take(positions), number_to_sample
+
+
+def plan_sampled_rows(spec, random_sample, number_to_sample, gtfs_feed) -> dict:
+    """returns the plan of a review category for rows sampled by sample_rows"""
+    other_table_fields = None
+    if spec['related_other_table']:
+        related_fields_selector = related_fields_selector_factory(spec['related_other_table'])
+        other_table_fields = related_fields_selector.get_related_fields_for_sample(random_sample, gtfs_feed)
+
+    items = []
+    for i, (index, row) in enumerate(random_sample.iterrows()):
+        try:
+            reviewed_data = row[spec['field_name']]
+        except KeyError:
+            reviewed_data = "[blank]"
+        try:
+            reviewed_data_pk_value = row[spec['pk_name']]
+        except KeyError:
+            reviewed_data_pk_value = None
+
+        related_fields: List[Tuple] = []
+        for gtfs_field_id, field_name in spec['related_same_table']:
+            try:
+                gtfs_field_value = row[field_name]
+            except KeyError:
+                gtfs_field_value = "[blank]"
+            related_fields.append((gtfs_field_id, gtfs_field_value))
+        if other_table_fields is not None:
+            for field in other_table_fields[i]:
+                related_fields.append(((field[0], field[1]), str(field[2])))
+
+        items.append({'reviewed_data': reviewed_data,
+                      'reviewed_data_pk_value': reviewed_data_pk_value,
+                      'related_fields': related_fields})
+
+    return {'category_id': spec['id'],
+            'reviewed_data_pk_name': spec['pk_name'],
+            'items': items[:number_to_sample],
+            'candidates': items[number_to_sample:]}
+
+
+def should_stream_table(gtfs_feed, table) -> bool:
+    """Tables whose CSV is at least settings.REVIEW_STREAMING_SAMPLE_THRESHOLD bytes are sampled by streaming the file
+    instead of loading the whole table, unless the feed already holds the table in memory"""
+    if not isinstance(gtfs_feed, feed_cache.CachedFeed) or gtfs_feed.is_loaded(table):
+        return False
+    return gtfs_feed.get_file_size(table) >= settings.REVIEW_STREAMING_SAMPLE_THRESHOLD
+
+
+def get_sample_columns(spec) -> Optional[List[str]]:
+    """returns the columns of the reviewed table a category plan reads, or None when that is not known"""
+    columns = [spec['field_name']]
+    pk_name = spec['pk_name']
+    if isinstance(pk_name, list):
+        columns.extend(pk_name)
+    elif pk_name:
+        columns.append(pk_name)
+    columns.extend(field_name for gtfs_field_id, field_name in spec['related_same_table'])
+    if spec['related_other_table']:
+        sample_columns = related_fields_selector_factory(spec['related_other_table']).sample_columns
+        if sample_columns is None:
+            return None
+        columns.extend(sample_columns)
+    return columns
+
+
+def get_table_columns(specs, gtfs_feed) -> Dict[str, Optional[List[str]]]:
+    """returns {table: the columns the review categories sampling it read}, None when a category needs all of them"""
+    table_columns: Dict[str, Optional[List[str]]] = {}
+    for spec in specs:
+        table = spec['table']
+        columns = get_sample_columns(spec)
+        if columns is not None:
+            ds = data_selector_factory(spec['data_selector'])
+            columns = columns + ds.get_required_columns(gtfs_feed.get_columns(table), gtfs_feed)
+        if table not in table_columns:
+            table_columns[table] = columns
+        elif table_columns[table] is not None:
+            table_columns[table] = None if columns is None else table_columns[table] + columns
+    return {table: None if columns is None else list(dict.fromkeys(columns))
+            for table, columns in table_columns.items()}
+
+
+def load_review_tables(gtfs_feed, specs) -> Tuple[Dict[str, pd.DataFrame], List[Dict[str, Any]]]:
+    """Reads, once each, the columns of the cached feed's tables the review categories use. Tables that are sampled
+    while streaming them are left out. Returns the tables, by file name, and for each one
+    {'table', 'rows', 'columns', 'bytes', 'seconds'} with the memory the DataFrame holds and the time it took to read."""
+    tables: Dict[str, pd.DataFrame] = {}
+    stats: List[Dict[str, Any]] = []
+    for table, columns in get_table_columns(specs, gtfs_feed).items():
+        if should_stream_table(gtfs_feed, table):
+            continue
+        start = time.perf_counter()
+        tables[table] = gtfs_feed.load_columns(table, columns)
+        stats.append({'table': table,
+                      'rows': len(tables[table]),
+                      'columns': list(tables[table].columns),
+                      'bytes': int(tables[table].memory_usage(deep=True).sum()),
+                      'seconds': time.perf_counter() - start})
+        logger.info("loaded %s: %d rows, %d columns, %d bytes in %.3fs", table, stats[-1]['rows'],
+                    len(stats[-1]['columns']), stats[-1]['bytes'], stats[-1]['seconds'])
+    return tables, stats
+
+
+def group_specs(specs) -> List[List[dict]]:
+    """returns the review categories that can share one sample: the ones on the same table with the same data
+    selector, data_selector rows are shared by every category configured the same way"""
+    groups: Dict[Tuple[str, int], List[dict]] = {}
+    for spec in specs:
+        groups.setdefault((spec['table'], spec['data_selector'].id), []).append(spec)
+    return list(groups.values())
+
+
+def build_review_plan(gtfs_feed, specs=None, progress=None, seed=None) -> List[dict]:
+    """returns a plan with one entry per review category. progress, if given, is called with ('Sampling', category id)
+    after each category is planned. With settings.REVIEW_SHARED_TABLE_SAMPLES the categories of a group_specs group
+    review the same rows, so the reviewer sees for example the same routes for route_color and route_text_color.
+    Tables are planned in a pool of settings.REVIEW_SETUP_WORKERS processes when that is more than one."""
+    if specs is None:
+        specs = get_category_specs()
+    table_specs: Dict[str, List[dict]] = {}
+    for spec in specs:
+        table_specs.setdefault(spec['table'], []).append(spec)
+
+    category_plans = {}
+    if settings.REVIEW_SETUP_WORKERS > 1 and len(table_specs) > 1 and isinstance(gtfs_feed, feed_cache.CachedFeed):
+        pool = process_pool.get_process_pool(settings.REVIEW_SETUP_WORKERS, WORKER_SETTINGS)
+        futures = [pool.submit(_plan_table_in_worker, gtfs_feed.feed_hash, same_table_specs, seed)
+                   for same_table_specs in table_specs.values()]
+        for future in as_completed(futures):
+            for category_plan in future.result():
+                category_plans[category_plan['category_id']] = category_plan
+                if progress is not None:
+                    progress('Sampling', category_plan['category_id'])
+    else:
+        for same_table_specs in table_specs.values():
+            for category_plan in plan_table(gtfs_feed, same_table_specs, seed, progress):
+                category_plans[category_plan['category_id']] = category_plan
+    return [category_plans[spec['id']] for spec in specs]
+
+
+def plan_table(gtfs_feed, specs, seed=None, progress=None) -> List[dict]:
+    """returns the plans of review categories that all sample the same table, the unit of work of build_review_plan"""
+    tables: Dict[str, pd.DataFrame] = {}
+    if isinstance(gtfs_feed, feed_cache.CachedFeed):
+        tables, stats = load_review_tables(gtfs_feed, specs)
+    if settings.REVIEW_SHARED_TABLE_SAMPLES:
+        groups = group_specs(specs)
+    else:
+        groups = [[spec] for spec in specs]
+
+    plans = []
+    for group in groups:
+        random_sample, number_to_sample = sample_rows(group, gtfs_feed, seed, tables.get(group[0]['table']))
+        for spec in group:
+            plans.append(plan_sampled_rows(spec, random_sample, number_to_sample, gtfs_feed))
+            if progress is not None:
+                progress('Sampling', spec['id'])
+    return plans
+
+
+# settings plan_table reads, copied to the worker processes
+WORKER_SETTINGS = ['GTFS_FEED_CACHE_DIR', 'REVIEW_SKIP_CANDIDATES', 'REVIEW_STREAMING_SAMPLE_THRESHOLD',
+                   'REVIEW_SHARED_TABLE_SAMPLES']
+
+
+def _plan_table_in_worker(feed_hash, specs, seed) -> List[dict]:
+    return plan_table(feed_cache.load_feed(feed_hash), specs, seed)
+
+
+def precompute_review_plan(gtfs_feed_hash, agency, mode) -> str:
+    """Builds the plan of a review of an agency and mode of a cached feed ahead of time and stores it with the subset
+    of the feed it samples, unless a plan for the current review categories is already stored there. Returns the hash
+    of the subset."""
+    from gtfs_grading_app.Functions.feed_ingest import get_referenced_tables, PICKER_FILES
+
+    tables = get_referenced_tables() | set(PICKER_FILES)
+    filtered_feed_hash = feed_cache.get_filtered_feed(gtfs_feed_hash, agency, mode, tables)
+    specs = get_category_specs()
+    plan_path = get_plan_path(filtered_feed_hash, specs)
+    if os.path.exists(plan_path):
+        return filtered_feed_hash
+
+    seed = secrets.randbits(31)
+    plan = build_review_plan(feed_cache.load_feed(filtered_feed_hash), specs, seed=seed)
+    os.makedirs(os.path.dirname(plan_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(plan_path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump({'seed': seed, 'plan': plan}, f)
+    os.replace(tmp_path, plan_path)
+    return filtered_feed_hash
+
+
+def take_precomputed_plan(filtered_feed_hash, specs) -> Optional[Tuple[int, List[dict]]]:
+    """returns (seed, plan) of the plan precompute_review_plan stored for the subset of a feed and these review
+    categories, or None when there is none. The plan is removed, so two reviews never get the same rows from it."""
+    plan_path = get_plan_path(filtered_feed_hash, specs)
+    claimed_path = '{}.{}.claimed'.format(plan_path, secrets.token_hex(8))
+    try:
+        os.rename(plan_path, claimed_path)
+    except FileNotFoundError:
+        return None
+    try:
+        with open(claimed_path, 'rb') as f:
+            stored = pickle.load(f)
+    finally:
+        os.remove(claimed_path)
+    return stored['seed'], stored['plan']
+
+
+def get_plan_path(filtered_feed_hash, specs) -> str:
+    """Plans are stored by a hash of everything about the review categories, and the settings, that shapes a plan, so
+    editing a category leaves the plans sampled before behind"""
+    key = json.dumps({'specs': [{'id': spec['id'],
+                                 'field_name': spec['field_name'],
+                                 'table': spec['table'],
+                                 'pk_name': spec['pk_name'],
+                                 'data_selector': [spec['data_selector'].name,
+                                                   spec['data_selector'].number_to_review,
+                                                   spec['data_selector'].stratify_by],
+                                 'related_same_table': spec['related_same_table'],
+                                 'related_other_table': spec['related_other_table']} for spec in specs],
+                      'skip_candidates': settings.REVIEW_SKIP_CANDIDATES,
+                      'shared_table_samples': settings.REVIEW_SHARED_TABLE_SAMPLES}, sort_keys=True)
+    return os.path.join(feed_cache.get_plans_dir(filtered_feed_hash),
+                        hashlib.sha256(key.encode()).hexdigest() + '.pkl')
+
+
+def commit_review_plan(my_review, plan):
+    """Writes the results and related fields of a plan for a review with bulk inserts in one transaction"""
+    with transaction.atomic():
+        new_results = []
+        for category_plan in plan:
+            for position, item in enumerate(category_plan['items'], start=1):
+                new_results.append(result(review=my_review,
+                                          review_category_id=category_plan['category_id'],
+                                          reviewed_data=item['reviewed_data'],
+                                          reviewed_data_pk_name=category_plan['reviewed_data_pk_name'],
+                                          reviewed_data_pk_value=item['reviewed_data_pk_value'],
+                                          position=position))
+        result.objects.bulk_create(new_results)
+        _set_result_ids(my_review, new_results)
+
+        other_table_field_ids = _get_or_create_gtfs_fields(plan)
+        new_related_fields = []
+        i = 0
+        for category_plan in plan:
+            for item in category_plan['items']:
+                for field_key, value in item['related_fields']:
+                    if isinstance(field_key, tuple):
+                        field_key = other_table_field_ids[field_key]
+                    new_related_fields.append(related_field(result_id=new_results[i].id,
+                                                            gtfs_field_id=field_key,
+                                                            gtfs_field_value=value))
+                i += 1
+        related_field.objects.bulk_create(new_related_fields)
+
+        review_candidate_pool.objects.bulk_create([
+            review_candidate_pool(review=my_review,
+                                  review_category_id=category_plan['category_id'],
+                                  candidates=[_serialize_candidate(item, other_table_field_ids)
+                                              for item in category_plan.get('candidates', [])])
+            for category_plan in plan])
+
+        review_category_progress.objects.bulk_create([
+            review_category_progress(review=my_review,
+                                     review_category_id=category_plan['category_id'],
+                                     total_results=len(category_plan['items']))
+            for category_plan in plan])
+        my_review.total_results = len(new_results)
+        my_review.completed_results = 0
+        review.objects.filter(id=my_review.id).update(total_results=my_review.total_results,
+                                                      completed_results=my_review.completed_results)
+
+
+def _set_result_ids(my_review, new_results):
+    """bulk_create does not return primary keys on every database backend (SQLite on django 3.1 among them). The review
+    is new, so its results in id order are exactly the rows we just inserted."""
+    if not new_results or new_results[0].id is not None:
+        return
+    ids = result.objects.filter(review=my_review).order_by('id').values_list('id', flat=True)
+    for my_result, result_id in zip(new_results, ids):
+        my_result.id = result_id
+
+
+def skip_result(my_result) -> Optional[result]:
+    """Replaces an unscored result with the next candidate of its category, in place so it keeps its id and position.
+    Returns the result, or None when the category has no candidates left."""
+    with transaction.atomic():
+        pool = review_candidate_pool.objects.filter(review_id=my_result.review_id,
+                                                    review_category_id=my_result.review_category_id).first()
+        if pool is None or not pool.remaining:
+            return None
+        claimed = review_candidate_pool.objects.filter(id=pool.id, next_candidate=pool.next_candidate) \
+            .update(next_candidate=pool.next_candidate + 1)
+        if not claimed:
+            # another request used this candidate first
+            return skip_result(my_result)
+        candidate = pool.candidates[pool.next_candidate]
+
+        my_result.reviewed_data = candidate['reviewed_data']
+        my_result.reviewed_data_pk_value = candidate['reviewed_data_pk_value']
+        my_result.score_reason = None
+        my_result.save(update_fields=['reviewed_data', 'reviewed_data_pk_value', 'score_reason'])
+        related_field.objects.filter(result=my_result).delete()
+        result_image.objects.filter(result=my_result).delete()
+        result_reference.objects.filter(result=my_result).delete()
+        related_field.objects.bulk_create([related_field(result=my_result,
+                                                         gtfs_field_id=gtfs_field_id,
+                                                         gtfs_field_value=value)
+                                           for gtfs_field_id, value in candidate['related_fields']])
+        review.bump_version(my_result.review_id)
+    return my_result
+
+
+def _serialize_candidate(item, other_table_field_ids) -> dict:
+    """returns a planned item as json, with the values the result and related_field rows would store"""
+    related_fields = []
+    for field_key, value in item['related_fields']:
+        if isinstance(field_key, tuple):
+            field_key = other_table_field_ids[field_key]
+        related_fields.append([field_key, _to_text(value)])
+    return {'reviewed_data': _to_text(item['reviewed_data']),
+            'reviewed_data_pk_value': _to_text(item['reviewed_data_pk_value']),
+            'related_fields': related_fields}
+
+
+def _to_text(value):
+    return None if value is None else str(value)
+
+
+def _get_or_create_gtfs_fields(plan) -> Dict[Tuple[str, str], int]:
+    """returns {(name, table): gtfs_field id} for the related fields that come from other tables"""
+    keys = set()
+    for category_plan in plan:
+        for item in category_plan['items'] + category_plan.get('candidates', []):
+            for field_key, value in item['related_fields']:
+                if isinstance(field_key, tuple):
+                    keys.add(field_key)
+
+    field_ids = {}
+    for name, table in keys:
+        gf, created = gtfs_field.objects.get_or_create(name=name,
+                                                       table=table,
+                                                       type=get_field_type(name, table))
+        field_ids[(name, table)] = gf.id
+    return field_ids
@@ -1,13 +1,16 @@
 from django import forms
+from django.db import transaction
+from django.db.models import Case, F, When
 
 from gtfs_grading import settings
 
 from gtfs_grading_app.models import review_category, review_widget, consistency_widget, results_capture_widget, \
     gtfs_field, consistency_widget_visual_example, consistency_widget_link, score, data_selector, result, result_image, \
-    result_reference
+    result_reference, review, review_category_progress
 from gtfs_grading_app.gtfs_spec.import_gtfs_spec import get_gtfs_table_tuple, get_field_type, \
     get_gtfs_field_tuple_from_table, get_all_gtfs_field_tuple
 from gtfs_grading_app.classes.classes import DataSelector # type: ignore
+from gtfs_grading_app.Functions.functions import list_to_tuple_of_tuples, get_mode_drop_down
 
 class GtfsZipForm(forms.Form):
     file = forms.FileField()
@@ -23,7 +26,6 @@ class AddReviewCategory(forms.Form):
     def __init__(self, *args, **kwargs):
         CHOICES_TABLE = get_gtfs_table_tuple()
         CHOICES_FIELD = get_all_gtfs_field_tuple()
-        print(CHOICES_FIELD)
         super().__init__(*args, **kwargs)
         self.fields['review_table'].choices = CHOICES_TABLE
         self.fields['gtfs_field'].choices = CHOICES_FIELD
@@ -147,24 +149,43 @@ class ChooseDataSelector(forms.Form):
                                                 label=False,
                                                 widget=forms.Select(
                                                     attrs={'class': 'form-select form-select-sm'}))
-        self.fields['number_to_review'] = forms.IntegerField(widget=forms.NumberInput(attrs={'class': 'form-control form-control-sm'}))
-        self.related_fields = related_fields
+        self.fields['number_to_review'] = forms.IntegerField(required=False,
+                                                             min_value=1,
+                                                             widget=forms.NumberInput(attrs={'class': 'form-control form-control-sm'}))
+        self.fields['stratify_by'] = forms.ChoiceField(choices=data_selector.STRATIFY_BY_CHOICES,
+                                                       required=False,
+                                                       widget=forms.Select(
+                                                           attrs={'class': 'form-select form-select-sm'}))
+        # {choice: [fields the choice uses]}
+        self.related_fields = {choice: fields for (choice, label), fields in zip(CHOICES, related_fields)}
+
+    def clean(self):
+        cleaned_data = super().clean()
+        used_fields = self.related_fields.get(cleaned_data.get('name'), [])
+        for field in ['number_to_review', 'stratify_by']:
+            if field not in used_fields:
+                cleaned_data[field] = None
+            elif not cleaned_data.get(field):
+                self.add_error(field, 'This field is required.')
+        return cleaned_data
 
     def save(self):
-        if self.cleaned_data['name'] == "log10(n) + 2":
-            self.cleaned_data['number_to_review'] = None
-
         my_data_selector, created = data_selector.objects.get_or_create(name=self.cleaned_data['name'],
-                                                                        number_to_review=self.cleaned_data['number_to_review'])
+                                                                        number_to_review=self.cleaned_data['number_to_review'],
+                                                                        stratify_by=self.cleaned_data['stratify_by'])
         self.my_review_catagory.data_selector = my_data_selector
         self.my_review_catagory.save()
 
 
 class NewReviewForm(forms.Form):
+    """Agency and mode pickers for a new review, the choices come from the manifest of the active feed"""
 
     def __init__(self, *args, **kwargs):
-        agency_options_choices = kwargs.pop('agency_options')
-        mode_options_choices = kwargs.pop('mode_options')
+        manifest = kwargs.pop('manifest')
+        agency_options = [agency['agency_name'] for agency in manifest['agencies']]
+        agency_options_choices = list_to_tuple_of_tuples(agency_options)
+        mode_options = sorted({route_type for agency in manifest['agencies'] for route_type in agency['route_types']})
+        mode_options_choices = get_mode_drop_down(mode_options)
 
         super(NewReviewForm, self).__init__(*args, **kwargs)
         self.fields['agency'] = forms.ChoiceField(choices=agency_options_choices,
@@ -209,12 +230,22 @@ class ResultForm(forms.Form):
             self.fields['score_reason'].required = False
 
 
+    @transaction.atomic
     def __save__(self):
         my_review_category = review_category.objects.get(id=self.cleaned_data['review_category_id'])
         my_results_capture_widget = results_capture_widget.objects.get(id=my_review_category.results_capture_widget.id)
         my_result = result.objects.get(id=self.cleaned_data['result_id'])
         my_result.score_id = self.cleaned_data['score_id']
 
+        # only the request that moves the result from unscored to scored counts it as completed
+        newly_scored = result.objects.filter(id=my_result.id, score=None).update(score_id=my_result.score_id)
+        review.objects.filter(id=my_result.review_id).update(completed_results=F('completed_results') + newly_scored,
+                                                             version=F('version') + 1)
+        if newly_scored:
+            review_category_progress.objects.filter(review_id=my_result.review_id,
+                                                    review_category_id=my_result.review_category_id) \
+                .update(completed_results=F('completed_results') + 1)
+
         if my_results_capture_widget.has_score_reason in ['Optional', 'Required']:
             my_result.score_reason = self.cleaned_data['score_reason']
         if my_results_capture_widget.has_score_image in ['Optional', 'Required']:
@@ -241,3 +272,71 @@ class ResultForm(forms.Form):
 
 
 
+
+
+class BatchResultForm(forms.Form):
+    """Scores and score reasons of a page of results of one review category. Results left without a score are not
+    saved."""
+
+    def __init__(self, *args, **kwargs):
+        my_results_capture_widget = kwargs.pop('results_capture_widget')
+        self.results = kwargs.pop('results')
+        super(BatchResultForm, self).__init__(*args, **kwargs)
+
+        self.scores = list(score.objects.filter(results_capture_widget=my_results_capture_widget).order_by('score'))
+        score_choices = [(my_score.id, '{:g}'.format(my_score.score)) for my_score in self.scores]
+        self.score_reason_required = my_results_capture_widget.has_score_reason == 'Required'
+
+        for my_result in self.results:
+            self.fields[self.score_field_name(my_result)] = forms.TypedChoiceField(
+                choices=score_choices, coerce=int, empty_value=None, required=False, label='',
+                initial=my_result.score_id, widget=forms.RadioSelect(attrs={'class': 'form-check-input'}))
+            if my_results_capture_widget.has_score_reason in ['Optional', 'Required']:
+                self.fields[self.score_reason_field_name(my_result)] = forms.CharField(
+                    required=False, label='', initial=my_result.score_reason,
+                    widget=forms.TextInput(attrs={'class': 'form-control form-control-sm'}))
+
+    @staticmethod
+    def score_field_name(my_result):
+        return 'score_id_{}'.format(my_result.id)
+
+    @staticmethod
+    def score_reason_field_name(my_result):
+        return 'score_reason_{}'.format(my_result.id)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.score_reason_required:
+            for my_result in self.results:
+                if cleaned_data.get(self.score_field_name(my_result)) is not None \
+                        and not cleaned_data.get(self.score_reason_field_name(my_result)):
+                    self.add_error(self.score_reason_field_name(my_result), 'This field is required.')
+        return cleaned_data
+
+    @transaction.atomic
+    def save(self) -> int:
+        """Saves the scored results with one bulk update and returns how many were saved"""
+        scored_results = []
+        for my_result in self.results:
+            score_id = self.cleaned_data[self.score_field_name(my_result)]
+            if score_id is None:
+                continue
+            my_result.score_id = score_id
+            if self.score_reason_field_name(my_result) in self.cleaned_data:
+                my_result.score_reason = self.cleaned_data[self.score_reason_field_name(my_result)]
+            scored_results.append(my_result)
+        if not scored_results:
+            return 0
+
+        # like ResultForm, only the update that moves a result from unscored to scored counts it as completed
+        newly_scored = result.objects.filter(id__in=[my_result.id for my_result in scored_results], score=None) \
+            .update(score_id=Case(*[When(id=my_result.id, then=my_result.score_id) for my_result in scored_results]))
+        result.objects.bulk_update(scored_results, ['score', 'score_reason'])
+        first_result = scored_results[0]
+        review.objects.filter(id=first_result.review_id) \
+            .update(completed_results=F('completed_results') + newly_scored, version=F('version') + 1)
+        if newly_scored:
+            review_category_progress.objects.filter(review_id=first_result.review_id,
+                                                    review_category_id=first_result.review_category_id) \
+                .update(completed_results=F('completed_results') + newly_scored)
+        return len(scored_results)
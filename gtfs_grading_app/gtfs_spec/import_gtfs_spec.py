@@ -7,6 +7,7 @@
 #####
 
 import json
+from typing import Dict, List, Tuple, Union
 
 from django.http import Http404
 
@@ -19,70 +20,94 @@ def load_data_package(path):
     return gtfs_spec
 
 
+class GtfsSpecRegistry:
+    """Indexes of the GTFS spec, built once when settings are loaded (settings.GTFS_SPEC_REGISTRY). Lookups are dict
+    reads and the choice tuples used by forms are built ahead of time."""
+
+    def __init__(self, gtfs_spec):
+        self.field_types: Dict[Tuple[str, str], str] = {}
+        self.primary_keys: Dict[str, Union[str, List[str], None]] = {}
+        self.table_fields: Dict[str, Tuple[str, ...]] = {}
+        self.required_fields: Dict[str, Tuple[str, ...]] = {}
+
+        for t in gtfs_spec['resources']:
+            fields = t['schema']['fields']
+            self.primary_keys.setdefault(t['name'], t['schema'].get('primaryKey'))
+            self.table_fields[t['name']] = tuple(f['name'] for f in fields)
+            self.required_fields[t['name']] = tuple(f['name'] for f in fields if f['gtfs_required'] == 'Required')
+            for f in fields:
+                self.field_types.setdefault((t['name'], f['name']), f['gtfs_type'])
+
+        blank = (('', ''),)
+        self.table_choices = blank + tuple((table, table) for table in self.table_fields)
+        self.table_field_choices = {table: blank + tuple((f, f) for f in fields)
+                                    for table, fields in self.table_fields.items()}
+        self.all_field_choices = blank + tuple((f, f) for fields in self.table_fields.values() for f in fields)
+
+    def get_cascading_drop_down(self) -> Dict[str, List[str]]:
+        return {table: list(fields) for table, fields in self.table_fields.items()}
+
+    def get_field_type(self, field, table) -> str:
+        try:
+            return self.field_types[(table, field)]
+        except KeyError:
+            raise ValueError("Field not found in GTFS spec.")
+
+    def get_table_primary_key(self, table):
+        return self.primary_keys.get(table)
+
+    def get_table_fields(self, table) -> Tuple[str, ...]:
+        try:
+            return self.table_fields[table]
+        except KeyError:
+            raise ValueError("Table name not found in GTFS spec.")
+
+    def get_required_fields(self, table) -> Tuple[str, ...]:
+        return self.required_fields.get(table, ())
+
+    def get_gtfs_field_tuple_from_table(self, table):
+        try:
+            return self.table_field_choices[table]
+        except KeyError:
+            raise ValueError("Table name not found in GTFS spec.")
+
+
+def get_spec_registry(gtfs_spec=None) -> GtfsSpecRegistry:
+    """returns the registry built at startup, or a new one for a spec other than settings.GTFS_SPEC"""
+    if gtfs_spec:
+        return GtfsSpecRegistry(gtfs_spec)
+    return settings.GTFS_SPEC_REGISTRY
+
+
 def get_cascading_drop_down(gtfs_spec=None):
     """returns a dictionary in the appropriate format for cascading dropdowns to select fields from tables"""
-    if not gtfs_spec:
-        gtfs_spec = settings.GTFS_SPEC
-    gtfs_dict = {}
-    for i in gtfs_spec['resources']:
-        field_list = []
-        for j in i['schema']['fields']:
-            field_list.append(j['name'])
-        gtfs_dict[i['name']] = field_list
-    return gtfs_dict
+    return get_spec_registry(gtfs_spec).get_cascading_drop_down()
 
 
 def get_gtfs_table_tuple(gtfs_spec=None):
     """returns a tuple of GTFS tables in the GTFS Spec"""
-    if not gtfs_spec:
-        gtfs_spec = settings.GTFS_SPEC
-    choice_tuple = (('',''),)
-    for t in gtfs_spec['resources']:
-        choice_tuple = choice_tuple + ((t['name'], t['name']),)
-    return choice_tuple
+    return get_spec_registry(gtfs_spec).table_choices
 
 
 def get_gtfs_field_tuple_from_table(table_name, gtfs_spec=None):
     """returns a tuple of GTFS fields in a specific table"""
-    if not gtfs_spec:
-        gtfs_spec = settings.GTFS_SPEC
-    choice_tuple = choice_tuple = (('',''),)
-    for t in gtfs_spec['resources']:
-        if t['name'] == table_name:
-            for f in t['schema']['fields']:
-                choice_tuple = choice_tuple + ((f['name'], f['name']),)
-            return choice_tuple
-    raise ValueError("Table name not found in GTFS spec.")
+    return get_spec_registry(gtfs_spec).get_gtfs_field_tuple_from_table(table_name)
 
 
 def get_all_gtfs_field_tuple(gtfs_spec=None):
-    if not gtfs_spec:
-        gtfs_spec = settings.GTFS_SPEC
+    return get_spec_registry(gtfs_spec).all_field_choices
 
-    choice_tuple = choice_tuple = (('',''),)
-    for t in gtfs_spec['resources']:
-        for f in t['schema']['fields']:
-            choice_tuple = choice_tuple + ((f['name'], f['name']),)
-    return choice_tuple
 
 def get_field_type(field, table):
     """returns the GTFS field type of the given field in a given table"""
-    for i in settings.GTFS_SPEC['resources']:
-        print(i['name'])
-        if i['name'] == table:
-            for j in i['schema']['fields']:
-                print(j['name'])
-                if j['name'] == field:
-                    return j['gtfs_type']
-    raise ValueError("Field not found in GTFS spec.")
+    return get_spec_registry().get_field_type(field, table)
 
 
 def get_table_primary_key(table):
     '''Returns the primary key of a table or None'''
-    for i in settings.GTFS_SPEC['resources']:
-        print(i['name'])
-        if i['name'] == table:
-            print(i['name'])
-            print(i['schema']['primaryKey'])
-            return i['schema']['primaryKey']
-    return None
+    return get_spec_registry().get_table_primary_key(table)
+
+
+def get_required_fields(table):
+    """returns the names of the fields the GTFS spec marks as required in a table"""
+    return list(get_spec_registry().get_required_fields(table))
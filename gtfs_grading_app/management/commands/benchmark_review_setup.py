@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from gtfs_grading_app.Functions import feed_cache, feed_ingest
+from gtfs_grading_app.classes.classes import DataSelector
+from gtfs_grading_app.classes.review_setup import get_category_specs, load_review_tables
+from gtfs_grading_app.models import result
+
+
+class Command(BaseCommand):
+    help = "Times DataSelector.setup_initial_data_for_review on a GTFS zip and counts the SQL statements it issues. " \
+           "Setup runs in autocommit like it does in a request, the reviews it creates are deleted afterwards. " \
+           "Then reports, per table, the memory and load time of the columns setup reads against the whole table " \
+           "parsed by partridge."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--feed', default='files_for_testing/BART.zip')
+        parser.add_argument('--agency', default='Bay Area Rapid Transit')
+        parser.add_argument('--mode', default='1')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--workers', type=int, nargs='+', default=[1],
+                            help="REVIEW_SETUP_WORKERS values to time setup with, for example --workers 1 4 8")
+
+    def handle(self, *args, **options):
+        # cache the feed the way an upload does, extracting only the tables review categories reference
+        tables = feed_ingest.get_referenced_tables() | set(feed_ingest.PICKER_FILES)
+        feed_hash = feed_cache.add_feed_zip(options['feed'], tables=tables)
+
+        for workers in options['workers']:
+            for i in range(options['repeat']):
+                with CaptureQueriesContext(connection) as queries, override_settings(REVIEW_SETUP_WORKERS=workers):
+                    start = time.perf_counter()
+                    new_session_gtfs_feed, my_review = DataSelector.setup_initial_data_for_review(feed_hash,
+                                                                                                  options['agency'],
+                                                                                                  options['mode'])
+                    elapsed = time.perf_counter() - start
+
+                with transaction.atomic():
+                    result.objects.filter(review=my_review).delete()
+                    my_review.delete()
+
+                self.stdout.write("{} worker(s), run {}: {} statements, {:.3f}s".format(
+                    workers, i + 1, len(queries.captured_queries), elapsed))
+
+        tables, stats = load_review_tables(feed_cache.load_feed(new_session_gtfs_feed), get_category_specs())
+        for table_stats in stats:
+            start = time.perf_counter()
+            whole_table = feed_cache.load_feed(new_session_gtfs_feed)._parse(table_stats['table'])
+            elapsed = time.perf_counter() - start
+            self.stdout.write("{}: {} rows, {} column(s) {:.1f} KiB in {:.3f}s, whole table {} column(s) {:.1f} KiB "
+                              "in {:.3f}s".format(table_stats['table'], table_stats['rows'],
+                                                  len(table_stats['columns']), table_stats['bytes'] / 1024,
+                                                  table_stats['seconds'], len(whole_table.columns),
+                                                  whole_table.memory_usage(deep=True).sum() / 1024, elapsed))
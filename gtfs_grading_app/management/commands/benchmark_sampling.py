@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from gtfs_grading_app.Functions import feed_cache
+from gtfs_grading_app.classes.classes import data_selector_factory
+from gtfs_grading_app.models import data_selector
+
+
+def write_synthetic_feed(path, number_of_stop_times, trips_per_route=500, stops_per_trip=40):
+    """Writes a GTFS zip with number_of_stop_times stop times, spread over routes of trips_per_route trips"""
+    number_of_trips = max(number_of_stop_times // stops_per_trip, 1)
+    number_of_routes = max(number_of_trips // trips_per_route, 1)
+    trip_index = np.arange(number_of_stop_times) // stops_per_trip
+    tables = {
+        'agency.txt': pd.DataFrame({'agency_id': ['A'], 'agency_name': ['Synthetic'],
+                                    'agency_url': ['https://example.com'], 'agency_timezone': ['UTC']}),
+        'routes.txt': pd.DataFrame({'route_id': ['r%d' % i for i in range(number_of_routes)], 'agency_id': 'A',
+                                    'route_short_name': [str(i) for i in range(number_of_routes)], 'route_type': 3}),
+        'calendar.txt': pd.DataFrame({'service_id': ['s'], 'monday': [1], 'tuesday': [1], 'wednesday': [1],
+                                      'thursday': [1], 'friday': [1], 'saturday': [1], 'sunday': [1],
+                                      'start_date': ['20200101'], 'end_date': ['20301231']}),
+        'trips.txt': pd.DataFrame({'route_id': ['r%d' % (i % number_of_routes) for i in range(number_of_trips)],
+                                   'service_id': 's',
+                                   'trip_id': ['t%d' % i for i in range(number_of_trips)]}),
+        'stops.txt': pd.DataFrame({'stop_id': ['p%d' % i for i in range(stops_per_trip * 10)],
+                                   'stop_name': ['Stop %d' % i for i in range(stops_per_trip * 10)],
+                                   'stop_lat': 37.0, 'stop_lon': -122.0}),
+        'stop_times.txt': pd.DataFrame({'trip_id': np.char.add('t', trip_index.astype(str)),
+                                        'arrival_time': '08:00:00',
+                                        'departure_time': '08:00:00',
+                                        'stop_id': np.char.add('p', (np.arange(number_of_stop_times) % (
+                                            stops_per_trip * 10)).astype(str)),
+                                        'stop_sequence': np.arange(number_of_stop_times) % stops_per_trip}),
+    }
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for file_name, df in tables.items():
+            zip_ref.writestr(file_name, df.to_csv(index=False))
+
+
+def measure(function):
+    """returns (result, seconds, peak bytes traced by tracemalloc) of a call"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        value = function()
+        seconds = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return value, seconds, peak
+
+
+class Command(BaseCommand):
+    help = "Samples stop_times of a synthetic feed with --rows stop times by loading the table and by streaming it, " \
+           "and reports the time and the peak memory, as traced by tracemalloc, of each."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000000)
+        parser.add_argument('--stratify-by', default=None, choices=[None, 'route_id'])
+
+    def handle(self, *args, **options):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            with override_settings(GTFS_FEED_CACHE_DIR=cache_dir):
+                zip_path = os.path.join(cache_dir, 'synthetic.zip')
+                write_synthetic_feed(zip_path, options['rows'])
+                feed_hash = feed_cache.add_feed_zip(zip_path, move=True)
+                self.stdout.write("stop_times.txt: {} rows, {:.1f} MiB".format(
+                    options['rows'], feed_cache.load_feed(feed_hash).get_file_size('stop_times') / 1024 ** 2))
+                # the join to trips is loaded once here so neither run below pays for it
+                feed_cache.load_feed(feed_hash).trips
+
+                if options['stratify_by']:
+                    ds = data_selector_factory(data_selector(name="stratified log10(n) + 2",
+                                                             stratify_by=options['stratify_by']))
+                else:
+                    ds = data_selector_factory(data_selector(name="log10(n) + 2"))
+
+                def load_and_sample():
+                    gtfs_feed = feed_cache.load_feed(feed_hash)
+                    table = gtfs_feed._parse('stop_times.txt')
+                    number = ds.select_row_sample_count(len(table))
+                    return table.take(ds.select_rows(table, number, np.random.default_rng(0), gtfs_feed))
+
+                def stream_and_sample():
+                    gtfs_feed = feed_cache.load_feed(feed_hash)
+                    sample, number = ds.sample_stream(gtfs_feed, 'stop_times.txt', 0, np.random.default_rng(0))
+                    return sample
+
+                for name, function in [('loaded', load_and_sample), ('streamed', stream_and_sample)]:
+                    sample, seconds, peak = measure(function)
+                    self.stdout.write("{}: {} rows sampled in {:.2f}s, peak memory {:.1f} MiB".format(
+                        name, len(sample), seconds, peak / 1024 ** 2))
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
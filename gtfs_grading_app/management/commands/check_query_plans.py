@@ -0,0 +1,88 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from gtfs_grading_app.models import gtfs_field, review_widget, consistency_widget, results_capture_widget, \
+    data_selector, review_category, review, result, related_field
+
+
+def get_index_name(model, fields) -> str:
+    for index in model._meta.indexes:
+        if index.fields == fields:
+            return index.name
+    raise ValueError("{} has no index on {}".format(model.__name__, fields))
+
+
+def get_hot_queries(my_review, my_review_category, my_result) -> list:
+    """returns (description, queryset, index name or None) for the queries run on every evaluation click and on the
+    search page. None means any index on the filtered foreign key will do."""
+    return [
+        ('active result by position',
+         result.objects.filter(review_id=my_review.id, review_category_id=my_review_category.id, position=1),
+         get_index_name(result, ['review', 'review_category', 'position'])),
+        ('unscored results of a review',
+         result.objects.filter(review_id=my_review.id, score__isnull=True),
+         get_index_name(result, ['review', 'score'])),
+        ('related fields of a result',
+         related_field.objects.filter(result_id=my_result.id),
+         None),
+        ('completed reviews',
+         review.objects.filter(review_status="Completed"),
+         get_index_name(review, ['review_status'])),
+    ]
+
+
+def check_query_plan(queryset, index_name) -> str:
+    """returns the SQLite query plan of a queryset, raises CommandError unless it searches the expected index"""
+    plan = queryset.explain()
+    if 'SEARCH' not in plan or (index_name and index_name not in plan):
+        raise CommandError("Expected {} to be used, the query plan was:\n{}".format(index_name or 'an index', plan))
+    return plan
+
+
+class Command(BaseCommand):
+    help = "Seeds a throwaway review with --seed results and checks, with EXPLAIN, that the queries run on every " \
+           "evaluation click use their indexes. Everything seeded is rolled back."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=100000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            my_review, my_review_category, my_result = self.seed(options['seed'])
+            try:
+                for description, queryset, index_name in get_hot_queries(my_review, my_review_category, my_result):
+                    plan = check_query_plan(queryset, index_name)
+                    self.stdout.write("{}: {}".format(description, plan.replace('\n', ' | ')))
+            finally:
+                transaction.set_rollback(True)
+
+    @staticmethod
+    def seed(number_of_results):
+        my_gtfs_field = gtfs_field.objects.create(name='route_color', table='routes.txt', type='Color')
+        my_review_category = review_category.objects.create(
+            gtfs_field=my_gtfs_field,
+            review_widget=review_widget.objects.create(),
+            consistency_widget=consistency_widget.objects.create(),
+            results_capture_widget=results_capture_widget.objects.create(),
+            data_selector=data_selector.objects.get_or_create(id=1, defaults={'name': 'log10(n) + 2'})[0])
+
+        my_review = review.objects.create(agency='agency', mode=3)
+        review_ids = [my_review.id] + [review.objects.create(agency='agency {}'.format(i), mode=3,
+                                                             review_status="Completed").id
+                                       for i in range(100)]
+
+        result.objects.bulk_create([result(review_id=review_ids[i % len(review_ids)],
+                                           review_category=my_review_category,
+                                           reviewed_data='FFFFFF',
+                                           reviewed_data_pk_name='route_id',
+                                           reviewed_data_pk_value=str(i),
+                                           position=i // len(review_ids) + 1)
+                                    for i in range(number_of_results)], batch_size=5000)
+        my_result = result.objects.filter(review=my_review).first()
+        related_field.objects.bulk_create([related_field(result_id=result_id,
+                                                         gtfs_field=my_gtfs_field,
+                                                         gtfs_field_value='FFFFFF')
+                                           for result_id in result.objects.filter(review_id__in=review_ids)
+                                                                          .values_list('id', flat=True)],
+                                          batch_size=5000)
+        return my_review, my_review_category, my_result
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from gtfs_grading_app.models import review
+
+
+class Command(BaseCommand):
+    help = "Recounts the total and completed result counters of reviews from their results. Rebuilds every review " \
+           "unless review ids are given."
+
+    def add_arguments(self, parser):
+        parser.add_argument('review_ids', nargs='*', type=int)
+
+    def handle(self, *args, **options):
+        reviews = review.objects.order_by('id')
+        if options['review_ids']:
+            reviews = reviews.filter(id__in=options['review_ids'])
+            missing = set(options['review_ids']) - set(reviews.values_list('id', flat=True))
+            if missing:
+                raise CommandError("Review(s) not found: {}".format(', '.join(str(i) for i in sorted(missing))))
+
+        for my_review in reviews:
+            my_review.rebuild_progress()
+            self.stdout.write("review {}: {}/{} results completed".format(my_review.id,
+                                                                          my_review.completed_results,
+                                                                          my_review.total_results))
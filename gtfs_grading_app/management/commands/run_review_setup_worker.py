@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from gtfs_grading_app.Functions import feed_workspace, review_jobs
+
+
+class Command(BaseCommand):
+    help = "Runs queued review setup jobs. Polls the queue until stopped, or drains it and exits with --once."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true')
+        parser.add_argument('--poll-interval', type=float, default=2.0)
+
+    def handle(self, *args, **options):
+        while True:
+            requeued = review_jobs.requeue_stale_jobs()
+            if requeued:
+                self.stdout.write("queued {} stale job(s) again".format(requeued))
+            count = review_jobs.run_queued_jobs()
+            if count:
+                self.stdout.write("ran {} job(s)".format(count))
+            report = feed_workspace.sweep_if_due()
+            if report and report['evicted']:
+                self.stdout.write("evicted {} feed(s) from the feed cache".format(len(report['evicted'])))
+            if options['once']:
+                return
+            time.sleep(options['poll_interval'])
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from gtfs_grading_app.Functions import feed_workspace
+
+
+class Command(BaseCommand):
+    help = "Deletes the least recently used feeds from the feed cache until it fits in its quota. Feeds used by " \
+           "reviews in progress or by unfinished review setup jobs are kept."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quota', type=int, help="quota in bytes, defaults to settings.GTFS_FEED_CACHE_QUOTA")
+        parser.add_argument('--dry-run', action='store_true', help="list the feeds that would be deleted")
+
+    def handle(self, *args, **options):
+        report = feed_workspace.sweep(quota=options['quota'], dry_run=options['dry_run'])
+        for feed_hash in report['evicted']:
+            self.stdout.write("{} {}".format('would evict' if options['dry_run'] else 'evicted', feed_hash))
+        self.stdout.write("{} feed(s), {} bytes freed, cache is {} of {} bytes".format(len(report['evicted']),
+                                                                                     report['freed_bytes'],
+                                                                                     report['size_bytes'],
+                                                                                     report['quota']))
@@ -0,0 +1,57 @@
+# Generated by Django 3.1.3 on 2026-10-18 07:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_review_progress(apps, schema_editor):
+    review = apps.get_model('gtfs_grading_app', 'review')
+    result = apps.get_model('gtfs_grading_app', 'result')
+    review_category_progress = apps.get_model('gtfs_grading_app', 'review_category_progress')
+
+    counts = result.objects.values('review_id', 'review_category_id') \
+        .annotate(total=models.Count('id'), completed=models.Count('score'))
+    totals = {}
+    for row in counts:
+        review_category_progress.objects.create(review_id=row['review_id'],
+                                                review_category_id=row['review_category_id'],
+                                                total_results=row['total'],
+                                                completed_results=row['completed'])
+        total, completed = totals.get(row['review_id'], (0, 0))
+        totals[row['review_id']] = (total + row['total'], completed + row['completed'])
+    for review_id, (total, completed) in totals.items():
+        review.objects.filter(id=review_id).update(total_results=total, completed_results=completed)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gtfs_grading_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='completed_results',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='total_results',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='review_category_progress',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_results', models.IntegerField(default=0)),
+                ('completed_results', models.IntegerField(default=0)),
+                ('review', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='gtfs_grading_app.review')),
+                ('review_category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='gtfs_grading_app.review_category')),
+            ],
+            options={
+                'unique_together': {('review', 'review_category')},
+            },
+        ),
+        migrations.RunPython(count_review_progress, migrations.RunPython.noop),
+    ]
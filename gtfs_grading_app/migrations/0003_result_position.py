@@ -0,0 +1,36 @@
+# Generated by Django 3.1.3 on 2026-10-18 07:31
+
+from django.db import migrations, models
+
+
+def number_results(apps, schema_editor):
+    result = apps.get_model('gtfs_grading_app', 'result')
+
+    positions = {}
+    numbered = []
+    for my_result in result.objects.order_by('id').only('id', 'review_id', 'review_category_id'):
+        key = (my_result.review_id, my_result.review_category_id)
+        positions[key] = positions.get(key, 0) + 1
+        my_result.position = positions[key]
+        numbered.append(my_result)
+    result.objects.bulk_update(numbered, ['position'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gtfs_grading_app', '0002_review_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='position',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='result',
+            index=models.Index(fields=['review', 'review_category', 'position'], name='gtfs_gradin_review__61825f_idx'),
+        ),
+        migrations.RunPython(number_results, migrations.RunPython.noop),
+    ]
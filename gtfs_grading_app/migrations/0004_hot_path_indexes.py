@@ -0,0 +1,21 @@
+# Generated by Django 3.1.3 on 2026-10-18 07:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gtfs_grading_app', '0003_result_position'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='result',
+            index=models.Index(fields=['review', 'score'], name='result_review_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['review_status'], name='review_status_idx'),
+        ),
+    ]
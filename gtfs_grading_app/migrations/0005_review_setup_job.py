@@ -0,0 +1,35 @@
+# Generated by Django 3.1.3 on 2026-10-18 07:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gtfs_grading_app', '0004_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='review_setup_job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gtfs_feed_hash', models.CharField(max_length=64)),
+                ('agency', models.CharField(max_length=150)),
+                ('mode', models.IntegerField()),
+                ('status', models.CharField(choices=[('Queued', 'Queued'), ('Running', 'Running'), ('Completed', 'Completed'), ('Failed', 'Failed')], default='Queued', max_length=50)),
+                ('stage', models.CharField(max_length=150, null=True)),
+                ('category_progress', models.JSONField(default=list)),
+                ('filtered_feed_hash', models.CharField(max_length=64, null=True)),
+                ('error', models.TextField(null=True)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('updated_date', models.DateTimeField(auto_now=True)),
+                ('review', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='gtfs_grading_app.review')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='review_setup_job',
+            index=models.Index(fields=['status', 'created_date'], name='review_setup_job_status_idx'),
+        ),
+    ]
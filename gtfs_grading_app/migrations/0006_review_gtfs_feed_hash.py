@@ -0,0 +1,18 @@
+# Generated by Django 3.1.3 on 2026-10-18 07:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gtfs_grading_app', '0005_review_setup_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='gtfs_feed_hash',
+            field=models.CharField(max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.1.3 on 2026-10-18 07:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gtfs_grading_app', '0006_review_gtfs_feed_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='review_candidate_pool',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('candidates', models.JSONField(default=list)),
+                ('next_candidate', models.IntegerField(default=0)),
+                ('review', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='gtfs_grading_app.review')),
+                ('review_category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='gtfs_grading_app.review_category')),
+            ],
+            options={
+                'unique_together': {('review', 'review_category')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.3 on 2026-10-18 07:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gtfs_grading_app', '0007_review_candidate_pool'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='data_selector',
+            name='stratify_by',
+            field=models.CharField(choices=[('route_id', 'Route'), ('route_type', 'Mode'), ('parent_station', 'Parent station'), ('shape_id', 'Shape')], max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='sample_seed',
+            field=models.IntegerField(null=True),
+        ),
+    ]
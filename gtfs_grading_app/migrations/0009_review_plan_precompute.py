@@ -0,0 +1,18 @@
+# Generated by Django 3.1.3 on 2026-10-18 08:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gtfs_grading_app', '0008_stratified_sampling'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review_setup_job',
+            name='precompute',
+            field=models.BooleanField(default=False),
+        ),
+    ]
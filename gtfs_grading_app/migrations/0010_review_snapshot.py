@@ -0,0 +1,23 @@
+# Generated by Django 3.1.3 on 2026-10-18 08:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gtfs_grading_app', '0009_review_plan_precompute'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='review_snapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('results', models.JSONField(default=list)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('review', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='snapshot', to='gtfs_grading_app.review')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.3 on 2026-10-18 08:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gtfs_grading_app', '0010_review_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
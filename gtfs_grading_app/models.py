@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 
 # Create your models here.
 
@@ -88,8 +88,15 @@ class score(models.Model):
 
 
 class data_selector(models.Model):
+    STRATIFY_BY_CHOICES = (("route_id", "Route"),
+                           ("route_type", "Mode"),
+                           ("parent_station", "Parent station"),
+                           ("shape_id", "Shape"))
+
     name = models.CharField(max_length=150)
     number_to_review = models.IntegerField(null=True)
+    # column the stratified data selectors spread their samples across
+    stratify_by = models.CharField(max_length=50, null=True, choices=STRATIFY_BY_CHOICES)
 
 
 class review_category(models.Model):
@@ -111,14 +118,131 @@ class review(models.Model):
     review_status = models.CharField(null=False, max_length=50, default="In progress", choices=CHOICES)
     completed_date = models.DateTimeField(null=True)
     final_score = models.FloatField(null=True)
+    # feed cache entry of the agency and mode subset the results were sampled from
+    gtfs_feed_hash = models.CharField(max_length=64, null=True)
+    # seed of the random generator the results were sampled with, the same seed and feed select the same rows
+    sample_seed = models.IntegerField(null=True)
+    # progress counters, kept up to date as results are created and scored, see review_category_progress
+    total_results = models.IntegerField(null=False, default=0)
+    completed_results = models.IntegerField(null=False, default=0)
+    # bumped by every write to the review, its results or what its pages show, the pages use it as their ETag
+    version = models.IntegerField(null=False, default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['review_status'], name='review_status_idx')]
+
+    @property
+    def percentage_complete(self):
+        if not self.total_results:
+            return 0
+        return int(round(self.completed_results/self.total_results, 2) * 100)
+
+    def get_category_progress(self) -> dict:
+        """returns {review_category id: review_category_progress} for this review"""
+        return {progress.review_category_id: progress
+                for progress in review_category_progress.objects.filter(review=self)}
+
+    def rebuild_progress(self):
+        """Recounts the progress counters of this review and its categories from its results"""
+        counts = result.objects.filter(review=self).values('review_category_id') \
+            .annotate(total=models.Count('id'), completed=models.Count('score'))
+        with transaction.atomic():
+            review_category_progress.objects.filter(review=self).delete()
+            review_category_progress.objects.bulk_create([
+                review_category_progress(review=self,
+                                         review_category_id=row['review_category_id'],
+                                         total_results=row['total'],
+                                         completed_results=row['completed'])
+                for row in counts])
+            self.total_results = sum(row['total'] for row in counts)
+            self.completed_results = sum(row['completed'] for row in counts)
+            review.objects.filter(id=self.id).update(total_results=self.total_results,
+                                                     completed_results=self.completed_results)
 
     def mark_status_in_review(self):
         self.review_status = "In review"
-        self.save()
+        review.objects.filter(id=self.id).update(review_status=self.review_status, version=models.F('version') + 1)
+
+    @staticmethod
+    def mark_in_review(review_id):
+        """Moves a review that is in progress to review. Its status is read first, the results page calls this on
+        every request and reviews already in review or completed should not be written to."""
+        in_progress = review.objects.filter(id=review_id, review_status="In progress")
+        if in_progress.exists():
+            in_progress.update(review_status="In review", version=models.F('version') + 1)
 
     def mark_status_complete(self):
         self.review_status = "Completed"
-        self.save()
+        review.objects.filter(id=self.id).update(review_status=self.review_status, version=models.F('version') + 1)
+
+    @staticmethod
+    def bump_version(review_id):
+        """Marks the pages of a review as changed, see gtfs_grading_app/Functions/review_etags.py"""
+        review.objects.filter(id=review_id).update(version=models.F('version') + 1)
+
+
+class review_category_progress(models.Model):
+    review = models.ForeignKey(review, on_delete=models.CASCADE)
+    review_category = models.ForeignKey(review_category, on_delete=models.CASCADE)
+    total_results = models.IntegerField(null=False, default=0)
+    completed_results = models.IntegerField(null=False, default=0)
+
+    class Meta:
+        unique_together = ('review', 'review_category')
+
+
+class review_candidate_pool(models.Model):
+    """Rows sampled along with the results of a review category that were not selected, skipped results are replaced
+    with them, see gtfs_grading_app/classes/review_setup.py"""
+    review = models.ForeignKey(review, on_delete=models.CASCADE)
+    review_category = models.ForeignKey(review_category, on_delete=models.CASCADE)
+    # [{'reviewed_data', 'reviewed_data_pk_value', 'related_fields': [[gtfs_field id, value]]}] in random order
+    candidates = models.JSONField(default=list)
+    # index of the next candidate in candidates, the ones before it have been used
+    next_candidate = models.IntegerField(null=False, default=0)
+
+    class Meta:
+        unique_together = ('review', 'review_category')
+
+    @property
+    def remaining(self):
+        return max(len(self.candidates) - self.next_candidate, 0)
+
+
+class review_snapshot(models.Model):
+    """The results of a completed review as they were when it was completed, completed review pages are rendered from
+    it, see gtfs_grading_app/Functions/review_snapshot.py"""
+    review = models.OneToOneField(review, on_delete=models.CASCADE, related_name='snapshot')
+    # one dict per result, shaped like the result models so templates read them the same way
+    results = models.JSONField(default=list)
+    created_date = models.DateTimeField(auto_now_add=True)
+
+
+class review_setup_job(models.Model):
+    """A queued DataSelector.setup_initial_data_for_review run, see gtfs_grading_app/Functions/review_jobs.py"""
+    CHOICES = (("Queued", "Queued"),
+               ("Running", "Running"),
+               ("Completed", "Completed"),
+               ("Failed", "Failed"))
+
+    gtfs_feed_hash = models.CharField(max_length=64, null=False)
+    agency = models.CharField(max_length=150, null=False)
+    mode = models.IntegerField()
+    # only builds and stores the plan of a future review, see precompute_review_plan, it creates no review
+    precompute = models.BooleanField(null=False, default=False)
+    status = models.CharField(null=False, max_length=50, default="Queued", choices=CHOICES)
+    stage = models.CharField(null=True, max_length=150)
+    # [{'id': review category id, 'name': field label, 'done': bool}] in the order categories are sampled
+    category_progress = models.JSONField(default=list)
+    review = models.ForeignKey(review, null=True, on_delete=models.SET_NULL)
+    filtered_feed_hash = models.CharField(max_length=64, null=True)
+    error = models.TextField(null=True)
+    created_date = models.DateTimeField(auto_now_add=True)
+    updated_date = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_date'], name='review_setup_job_status_idx')]
+
 
 class result(models.Model):
     review = models.ForeignKey(review, on_delete=models.PROTECT)
@@ -128,6 +252,12 @@ class result(models.Model):
     reviewed_data = models.TextField()
     reviewed_data_pk_name = models.CharField(max_length=100)
     reviewed_data_pk_value = models.CharField(max_length=100)
+    # 1 based position of the result within its review category, this is the active_result_number of evaluate_feed
+    position = models.IntegerField(null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['review', 'review_category', 'position']),
+                   models.Index(fields=['review', 'score'], name='result_review_score_idx')]
 
 
 class related_field(models.Model):
@@ -0,0 +1,107 @@
+#####
+# This file contains the opt-in request profiler.
+#
+# With settings.REQUEST_PROFILING on, RequestProfileMiddleware records for every request:
+#   - the number of SQL queries and the time spent running them, through a database execute wrapper
+#   - the time spent rendering templates, through ProfiledDjangoTemplates (the template backend in settings)
+#   - the total time spent in the view and the middleware below it
+# and reports them in a Server-Timing response header and one line of the gtfs_grading.profiling log.
+#####
+
+import logging
+import threading
+import time
+from contextlib import ExitStack
+from typing import Optional
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger('gtfs_grading.profiling')
+
+_local = threading.local()
+
+
+class RequestProfile:
+    """Counters for a single request"""
+
+    def __init__(self):
+        self.query_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.total_time = 0.0
+        self._render_depth = 0
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.query_count += 1
+
+    def get_server_timing(self) -> str:
+        return 'sql;dur={:.1f};desc="{} queries", template;dur={:.1f}, total;dur={:.1f}'.format(
+            self.sql_time * 1000, self.query_count, self.template_time * 1000, self.total_time * 1000)
+
+
+def get_current_profile() -> Optional[RequestProfile]:
+    return getattr(_local, 'profile', None)
+
+
+class RequestProfileMiddleware:
+    """Records query count, SQL time, template render time and total time of each request"""
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        _local.profile = profile
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(profile.record_query))
+                response = self.get_response(request)
+        finally:
+            _local.profile = None
+        profile.total_time = time.perf_counter() - start
+
+        response['Server-Timing'] = profile.get_server_timing()
+        logger.info('%s %s %s queries=%d sql_ms=%.1f template_ms=%.1f total_ms=%.1f',
+                    request.method, request.path, response.status_code, profile.query_count,
+                    profile.sql_time * 1000, profile.template_time * 1000, profile.total_time * 1000)
+        return response
+
+
+class ProfiledTemplate(Template):
+
+    def render(self, context=None, request=None):
+        profile = get_current_profile()
+        if profile is None:
+            return super().render(context, request)
+
+        # templates rendered from inside another template are already counted by the outer one
+        profile._render_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            profile._render_depth -= 1
+            if profile._render_depth == 0:
+                profile.template_time += time.perf_counter() - start
+
+
+class ProfiledDjangoTemplates(DjangoTemplates):
+    """The django template backend, with render time recorded on the current RequestProfile"""
+
+    def from_string(self, template_code):
+        return ProfiledTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return ProfiledTemplate(super().get_template(template_name).template, self)
@@ -1,5 +1,6 @@
 from django import template
 
+from gtfs_grading_app.Functions import lookup_cache
 from gtfs_grading_app.models import gtfs_field
 
 register = template.Library()
@@ -19,7 +20,10 @@ def addition(value, add_amount):
 
 @register.filter
 def get_gtfs_field_name_from_id(gtfs_field_id):
-    return gtfs_field.objects.get(id=gtfs_field_id).field_name_to_label
+    label = lookup_cache.gtfs_field_labels.get(gtfs_field_id)
+    if label is None:
+        raise gtfs_field.DoesNotExist
+    return label
 
 
 @register.filter()
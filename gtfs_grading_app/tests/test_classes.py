@@ -0,0 +1,364 @@
+import math
+import os
+import shutil
+import tempfile
+import zipfile
+
+import numpy as np
+import pandas as pd
+from django.test import TestCase, override_settings
+
+from gtfs_grading_app.Functions import feed_cache, process_pool
+from gtfs_grading_app.classes.classes import related_fields_selector_factory, DataSelector, data_selector_factory, \
+    reservoir_sample, gather_rows
+from gtfs_grading_app.classes.review_setup import build_review_plan, get_category_specs, load_review_tables
+from gtfs_grading_app.forms import ResultForm
+from gtfs_grading_app.models import gtfs_field, review_widget, consistency_widget, results_capture_widget, \
+    data_selector, review_category, result, related_field, score, review_category_progress
+
+
+def create_review_category(name, table, field_type, related_field_other_table=None):
+    my_gtfs_field, created = gtfs_field.objects.get_or_create(name=name, table=table, type=field_type)
+    my_data_selector, created = data_selector.objects.get_or_create(id=1, name="log10(n) + 2")
+    return review_category.objects.create(
+        gtfs_field=my_gtfs_field,
+        review_widget=review_widget.objects.create(related_field_other_table=related_field_other_table),
+        consistency_widget=consistency_widget.objects.create(),
+        results_capture_widget=results_capture_widget.objects.create(),
+        data_selector=my_data_selector)
+
+
+class FeedTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.cache_dir = tempfile.mkdtemp()
+        cls.settings_override = override_settings(GTFS_FEED_CACHE_DIR=cls.cache_dir)
+        cls.settings_override.enable()
+        cls.feed_hash = feed_cache.add_feed_zip('files_for_testing/BART.zip')
+        cls.gtfs_feed = feed_cache.load_feed(cls.feed_hash)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        shutil.rmtree(cls.cache_dir)
+        super().tearDownClass()
+
+
+class RelatedFieldSelectorTests(FeedTestCase):
+
+    def test_batch_lookup_matches_row_lookup(self):
+        sample = self.gtfs_feed.trips.sample(n=50, random_state=1)
+        selector = related_fields_selector_factory('trip_headsign')
+        routes = self.gtfs_feed.routes.set_index('route_id')
+
+        batch = selector.get_related_fields_for_sample(sample, self.gtfs_feed)
+
+        self.assertEqual(len(batch), 50)
+        for (index, row), fields in zip(sample.iterrows(), batch):
+            self.assertEqual(fields[0], ['route_short_name', 'routes.txt',
+                                         routes.loc[row['route_id'], 'route_short_name']])
+            self.assertEqual(fields, selector.get_related_fields_from_gtfs(row, self.gtfs_feed))
+
+    def test_missing_key_is_blank(self):
+        sample = self.gtfs_feed.trips.head(1).assign(route_id='not a route')
+        selector = related_fields_selector_factory('trip_route')
+
+        fields = selector.get_related_fields_for_sample(sample, self.gtfs_feed)[0]
+
+        self.assertEqual([f[2] for f in fields], ['[blank]', '[blank]', '[blank]'])
+
+
+class ReviewSetupTests(FeedTestCase):
+
+    def test_setup_writes_results_and_related_fields(self):
+        route_color = create_review_category('route_color', 'routes.txt', 'Color')
+        trip_headsign = create_review_category('trip_headsign', 'trips.txt', 'Text', 'trip_headsign')
+
+        new_session_gtfs_feed, my_review = DataSelector.setup_initial_data_for_review(self.feed_hash,
+                                                                                      'Bay Area Rapid Transit', '1')
+
+        self.assertEqual(result.objects.filter(review=my_review, review_category=route_color).count(), 3)
+        headsign_results = result.objects.filter(review=my_review, review_category=trip_headsign)
+        self.assertEqual(headsign_results.count(), 5)
+        self.assertEqual(related_field.objects.filter(result__in=headsign_results).count(), 15)
+
+
+class FilteredFeedTests(FeedTestCase):
+
+    def make_mixed_mode_feed(self):
+        """returns the hash of BART with every route but 1 and 2 turned into a bus route"""
+        path = os.path.join(self.cache_dir, 'mixed.zip')
+        with zipfile.ZipFile('files_for_testing/BART.zip') as source, zipfile.ZipFile(path, 'w') as target:
+            for info in source.infolist():
+                data = source.read(info)
+                if info.filename == 'routes.txt':
+                    lines = data.decode('utf-8').splitlines()
+                    for i, line in enumerate(lines[1:], start=1):
+                        values = line.split(',')
+                        if values[0] not in ('1', '2'):
+                            values[4] = '3'
+                        lines[i] = ','.join(values)
+                    data = '\n'.join(lines).encode('utf-8')
+                target.writestr(info, data)
+        return feed_cache.add_feed_zip(path)
+
+    def test_samples_come_from_the_agency_and_mode(self):
+        route_color = create_review_category('route_color', 'routes.txt', 'Color')
+        trip_headsign = create_review_category('trip_headsign', 'trips.txt', 'Text', 'trip_headsign')
+        feed_hash = self.make_mixed_mode_feed()
+
+        filtered_feed_hash, my_review = DataSelector.setup_initial_data_for_review(feed_hash,
+                                                                                   'Bay Area Rapid Transit', 1)
+
+        filtered_feed = feed_cache.load_feed(filtered_feed_hash)
+        self.assertEqual(sorted(filtered_feed.routes['route_id']), ['1', '2'])
+        self.assertEqual(my_review.gtfs_feed_hash, filtered_feed_hash)
+        route_ids = result.objects.filter(review=my_review, review_category=route_color) \
+            .values_list('reviewed_data_pk_value', flat=True)
+        self.assertTrue(set(route_ids) <= {'1', '2'})
+        trip_ids = set(result.objects.filter(review=my_review, review_category=trip_headsign)
+                       .values_list('reviewed_data_pk_value', flat=True))
+        trips = filtered_feed.trips.set_index('trip_id')
+        self.assertTrue(set(trips.loc[list(trip_ids), 'route_id']) <= {'1', '2'})
+
+    def test_subset_is_built_once(self):
+        create_review_category('route_color', 'routes.txt', 'Color')
+        stats_before = feed_cache.get_cache_stats()
+
+        first_hash, first_review = DataSelector.setup_initial_data_for_review(self.feed_hash,
+                                                                             'Bay Area Rapid Transit', '1')
+        second_hash, second_review = DataSelector.setup_initial_data_for_review(self.feed_hash,
+                                                                               'Bay Area Rapid Transit', 1)
+
+        stats_after = feed_cache.get_cache_stats()
+        self.assertEqual(first_hash, second_hash)
+        self.assertEqual(stats_after['view_misses'], stats_before['view_misses'] + 1)
+        self.assertEqual(stats_after['view_hits'], stats_before['view_hits'] + 1)
+
+
+class StratifiedSamplingTests(FeedTestCase):
+
+    def create_stratified_category(self, name, table, field_type, number_to_review, stratify_by):
+        category = create_review_category(name, table, field_type)
+        category.data_selector = data_selector.objects.create(name="stratified number",
+                                                              number_to_review=number_to_review,
+                                                              stratify_by=stratify_by)
+        category.save()
+        return category
+
+    def assertProportional(self, sampled_strata, strata):
+        """each stratum is sampled its proportional share of the sample, rounded up or down"""
+        shares = strata.value_counts() * len(sampled_strata) / len(strata)
+        sampled_counts = sampled_strata.value_counts()
+        for stratum, share in shares.items():
+            self.assertIn(sampled_counts.get(stratum, 0), (math.floor(share), math.ceil(share)))
+
+    def test_samples_are_spread_across_routes(self):
+        category = self.create_stratified_category('trip_headsign', 'trips.txt', 'Text', 19, 'route_id')
+
+        new_session_gtfs_feed, my_review = DataSelector.setup_initial_data_for_review(self.feed_hash,
+                                                                                      'Bay Area Rapid Transit', 1)
+
+        trips = feed_cache.load_feed(new_session_gtfs_feed).trips.set_index('trip_id')
+        trip_ids = result.objects.filter(review=my_review, review_category=category) \
+            .values_list('reviewed_data_pk_value', flat=True)
+        self.assertProportional(trips.loc[list(trip_ids), 'route_id'], trips['route_id'])
+
+    def test_stop_times_are_stratified_through_trips(self):
+        ds = data_selector_factory(data_selector(name="stratified number", number_to_review=30, stratify_by='route_id'))
+        stop_times = self.gtfs_feed.stop_times
+
+        positions = ds.select_rows(stop_times, 30, np.random.default_rng(0), self.gtfs_feed)
+
+        route_ids = stop_times['trip_id'].map(self.gtfs_feed.trips.set_index('trip_id')['route_id'])
+        self.assertEqual(len(set(positions)), 30)
+        self.assertProportional(route_ids.iloc[positions], route_ids)
+
+    def test_same_seed_selects_same_rows(self):
+        self.create_stratified_category('stop_name', 'stops.txt', 'Text', 5, 'parent_station')
+        create_review_category('trip_headsign', 'trips.txt', 'Text', 'trip_headsign')
+
+        first_plan = build_review_plan(self.gtfs_feed, seed=42)
+        second_plan = build_review_plan(self.gtfs_feed, seed=42)
+        other_plan = build_review_plan(self.gtfs_feed, seed=43)
+
+        self.assertEqual(first_plan, second_plan)
+        self.assertNotEqual(first_plan, other_plan)
+
+
+class StreamingSamplingTests(FeedTestCase):
+
+    def test_reservoir_keeps_distinct_rows_of_the_table(self):
+        stop_times = self.gtfs_feed.stop_times
+
+        sample, total_rows = reservoir_sample(self.gtfs_feed.iter_chunks('stop_times', chunk_rows=1000), 25,
+                                              np.random.default_rng(0))
+
+        self.assertEqual(total_rows, len(stop_times))
+        self.assertEqual(len(sample), 25)
+        keys = list(zip(sample['trip_id'], sample['stop_sequence'].astype(int)))
+        self.assertEqual(len(set(keys)), 25)
+        self.assertTrue(set(keys) <= set(zip(stop_times['trip_id'], stop_times['stop_sequence'])))
+
+    def test_streamed_stratified_sample_matches_loaded_sample(self):
+        ds = data_selector_factory(data_selector(name="stratified number", number_to_review=20, stratify_by='route_id'))
+        stop_times = self.gtfs_feed.stop_times
+
+        positions = ds.select_rows(stop_times, 30, np.random.default_rng(7), self.gtfs_feed)
+        streamed = gather_rows(self.gtfs_feed.iter_chunks('stop_times', chunk_rows=1000), positions)
+
+        self.assertEqual(list(streamed['trip_id']), list(stop_times['trip_id'].take(positions)))
+        sample, number = ds.sample_stream(self.gtfs_feed, 'stop_times.txt', 10, np.random.default_rng(7))
+        self.assertEqual(number, 20)
+        self.assertEqual(list(sample['trip_id']), list(stop_times['trip_id'].take(positions)))
+
+    @override_settings(REVIEW_STREAMING_SAMPLE_THRESHOLD=0)
+    def test_setup_streams_tables_over_the_threshold(self):
+        trip_headsign = create_review_category('trip_headsign', 'trips.txt', 'Text', 'trip_headsign')
+
+        new_session_gtfs_feed, my_review = DataSelector.setup_initial_data_for_review(self.feed_hash,
+                                                                                      'Bay Area Rapid Transit', '1')
+
+        headsign_results = result.objects.filter(review=my_review, review_category=trip_headsign)
+        self.assertEqual(headsign_results.count(), 5)
+        self.assertEqual(related_field.objects.filter(result__in=headsign_results).count(), 15)
+        self.assertFalse(os.path.exists(os.path.join(feed_cache.get_tables_dir(new_session_gtfs_feed), 'trips.pkl')))
+        trips = feed_cache.load_feed(new_session_gtfs_feed).trips.set_index('trip_id')
+        for my_result in headsign_results:
+            self.assertEqual(my_result.reviewed_data, trips.loc[my_result.reviewed_data_pk_value, 'trip_headsign'])
+
+
+class SharedSampleTests(FeedTestCase):
+
+    def setUp(self):
+        self.route_color = create_review_category('route_color', 'routes.txt', 'Color')
+        self.route_long_name = create_review_category('route_long_name', 'routes.txt', 'Text')
+        self.trip_headsign = create_review_category('trip_headsign', 'trips.txt', 'Text', 'trip_headsign')
+
+    @override_settings(REVIEW_SHARED_TABLE_SAMPLES=True)
+    def test_categories_on_a_table_review_the_same_rows(self):
+        plan = build_review_plan(self.gtfs_feed, seed=42)
+
+        route_color_plan, route_long_name_plan, trip_headsign_plan = plan
+        self.assertEqual([item['reviewed_data_pk_value'] for item in route_color_plan['items'] +
+                          route_color_plan['candidates']],
+                         [item['reviewed_data_pk_value'] for item in route_long_name_plan['items'] +
+                          route_long_name_plan['candidates']])
+        routes = self.gtfs_feed.routes.set_index('route_id')
+        for item in route_long_name_plan['items']:
+            self.assertEqual(item['reviewed_data'], routes.loc[item['reviewed_data_pk_value'], 'route_long_name'])
+        self.assertEqual(trip_headsign_plan['category_id'], self.trip_headsign.id)
+
+    @override_settings(REVIEW_SHARED_TABLE_SAMPLES=True)
+    def test_categories_with_other_data_selectors_sample_on_their_own(self):
+        self.route_long_name.data_selector = data_selector.objects.create(name="number", number_to_review=5)
+        self.route_long_name.save()
+
+        route_color_plan, route_long_name_plan, trip_headsign_plan = build_review_plan(self.gtfs_feed, seed=42)
+
+        self.assertEqual(len(route_color_plan['items']), round(math.log10(14) + 2))
+        self.assertEqual(len(route_long_name_plan['items']), 5)
+
+
+class ParallelPlanTests(FeedTestCase):
+
+    def test_worker_processes_plan_what_setup_plans_serially(self):
+        create_review_category('route_color', 'routes.txt', 'Color')
+        create_review_category('trip_headsign', 'trips.txt', 'Text', 'trip_headsign')
+        create_review_category('stop_name', 'stops.txt', 'Text', 'parent_station')
+        self.addCleanup(process_pool.shutdown_process_pool)
+        planned = []
+
+        serial_plan = build_review_plan(self.gtfs_feed, seed=42)
+        with override_settings(REVIEW_SETUP_WORKERS=2):
+            parallel_plan = build_review_plan(self.gtfs_feed, seed=42,
+                                              progress=lambda stage, category_id: planned.append(category_id))
+
+        self.assertEqual(parallel_plan, serial_plan)
+        self.assertEqual(sorted(planned), [category_plan['category_id'] for category_plan in serial_plan])
+
+
+class CompactTableLoadingTests(FeedTestCase):
+
+    def test_projected_columns_match_partridge(self):
+        trips = self.gtfs_feed.trips
+
+        compact = feed_cache.load_feed(self.feed_hash).load_columns('trips', ['route_id', 'trip_id', 'direction_id',
+                                                                              'not_a_column'])
+
+        self.assertEqual(list(compact.columns), ['route_id', 'trip_id', 'direction_id'])
+        self.assertIsInstance(compact['route_id'].dtype, pd.CategoricalDtype)
+        self.assertEqual(compact['direction_id'].dtype, np.int8)
+        for column in compact.columns:
+            self.assertEqual(list(compact[column].astype(object)), list(trips[column]))
+        self.assertLess(compact.memory_usage(deep=True).sum(), trips[compact.columns].memory_usage(deep=True).sum())
+
+    def test_review_tables_hold_the_columns_categories_use(self):
+        create_review_category('trip_headsign', 'trips.txt', 'Text', 'trip_headsign')
+        stratified = data_selector.objects.create(name="stratified log10(n) + 2", stratify_by='route_type')
+        route_color = create_review_category('route_color', 'routes.txt', 'Color')
+        route_color.data_selector = stratified
+        route_color.save()
+
+        tables, stats = load_review_tables(feed_cache.load_feed(self.feed_hash), get_category_specs())
+
+        self.assertEqual(list(tables['trips.txt'].columns), ['route_id', 'trip_id', 'trip_headsign'])
+        self.assertEqual(list(tables['routes.txt'].columns), ['route_id', 'route_type', 'route_color'])
+        self.assertEqual([table_stats['table'] for table_stats in stats], ['trips.txt', 'routes.txt'])
+        self.assertEqual(stats[0]['rows'], len(self.gtfs_feed.trips))
+        self.assertEqual(stats[0]['bytes'], tables['trips.txt'].memory_usage(deep=True).sum())
+
+
+class ReviewProgressTests(FeedTestCase):
+
+    def setUp(self):
+        self.route_color = create_review_category('route_color', 'routes.txt', 'Color')
+        self.trip_headsign = create_review_category('trip_headsign', 'trips.txt', 'Text', 'trip_headsign')
+        self.score = score.objects.create(score=1, help_text='',
+                                          results_capture_widget=self.route_color.results_capture_widget)
+        new_session_gtfs_feed, self.my_review = DataSelector.setup_initial_data_for_review(self.feed_hash,
+                                                                                           'Bay Area Rapid Transit',
+                                                                                           '1')
+
+    def score_result(self, my_result):
+        form = ResultForm({'result_id': my_result.id,
+                           'review_category_id': my_result.review_category_id,
+                           'score_id': self.score.id},
+                          results_capture_widget=my_result.review_category.results_capture_widget)
+        self.assertTrue(form.is_valid())
+        form.__save__()
+
+    def test_setup_counts_results(self):
+        self.assertEqual(self.my_review.total_results, 8)
+        self.assertEqual(self.my_review.percentage_complete, 0)
+        progress = self.my_review.get_category_progress()
+        self.assertEqual(progress[self.route_color.id].total_results, 3)
+        self.assertEqual(progress[self.trip_headsign.id].total_results, 5)
+
+    def test_scoring_a_result_twice_counts_it_once(self):
+        my_result = result.objects.filter(review=self.my_review, review_category=self.route_color).first()
+
+        self.score_result(my_result)
+        self.score_result(my_result)
+
+        self.my_review.refresh_from_db()
+        self.assertEqual(self.my_review.completed_results, 1)
+        self.assertEqual(self.my_review.percentage_complete, 12)
+        progress = review_category_progress.objects.get(review=self.my_review, review_category=self.route_color)
+        self.assertEqual(progress.completed_results, 1)
+
+    def test_rebuild_matches_counters(self):
+        for my_result in result.objects.filter(review=self.my_review, review_category=self.route_color):
+            self.score_result(my_result)
+        self.my_review.refresh_from_db()
+        counted = (self.my_review.total_results, self.my_review.completed_results)
+
+        review_category_progress.objects.filter(review=self.my_review).update(completed_results=0)
+        self.my_review.rebuild_progress()
+
+        self.assertEqual((self.my_review.total_results, self.my_review.completed_results), counted)
+        progress = self.my_review.get_category_progress()
+        self.assertEqual(progress[self.route_color.id].completed_results, 3)
+        self.assertEqual(progress[self.trip_headsign.id].completed_results, 0)
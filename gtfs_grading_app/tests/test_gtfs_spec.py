@@ -0,0 +1,79 @@
+from django.test import SimpleTestCase
+
+from gtfs_grading import settings
+from gtfs_grading_app.gtfs_spec.import_gtfs_spec import GtfsSpecRegistry, get_all_gtfs_field_tuple, \
+    get_gtfs_field_tuple_from_table, get_gtfs_table_tuple, get_spec_registry
+
+
+def spec_table(name, fields, primary_key=None):
+    """returns a resource of a Frictionless GTFS spec, fields are (name, gtfs_type, gtfs_required) tuples"""
+    schema = {'fields': [{'name': field, 'gtfs_type': gtfs_type, 'gtfs_required': gtfs_required}
+                         for field, gtfs_type, gtfs_required in fields]}
+    if primary_key is not None:
+        schema['primaryKey'] = primary_key
+    return {'name': name, 'schema': schema}
+
+
+class GtfsSpecRegistryTests(SimpleTestCase):
+
+    def setUp(self):
+        self.registry = GtfsSpecRegistry({'resources': [
+            spec_table('routes.txt', [('route_id', 'ID', 'Required'),
+                                      ('route_color', 'Color', 'Optional')], primary_key='route_id'),
+            spec_table('fare_rules.txt', [('fare_id', 'ID', 'Required'),
+                                          ('route_id', 'ID', 'Optional')]),
+            spec_table('transfers.txt', [('from_stop_id', 'ID', 'Required'),
+                                         ('to_stop_id', 'ID', 'Required')],
+                       primary_key=['from_stop_id', 'to_stop_id']),
+        ]})
+
+    def test_field_type(self):
+        self.assertEqual(self.registry.get_field_type('route_color', 'routes.txt'), 'Color')
+        self.assertEqual(self.registry.get_field_type('route_id', 'fare_rules.txt'), 'ID')
+
+    def test_unknown_field_type_is_an_error(self):
+        with self.assertRaises(ValueError):
+            self.registry.get_field_type('route_color', 'fare_rules.txt')
+
+    def test_primary_key(self):
+        self.assertEqual(self.registry.get_table_primary_key('routes.txt'), 'route_id')
+        self.assertEqual(self.registry.get_table_primary_key('transfers.txt'), ['from_stop_id', 'to_stop_id'])
+
+    def test_tables_without_a_primary_key_have_none(self):
+        self.assertIsNone(self.registry.get_table_primary_key('fare_rules.txt'))
+        self.assertIsNone(self.registry.get_table_primary_key('unknown.txt'))
+
+    def test_required_fields(self):
+        self.assertEqual(self.registry.get_required_fields('fare_rules.txt'), ('fare_id',))
+        self.assertEqual(self.registry.get_required_fields('unknown.txt'), ())
+
+    def test_table_choices_start_blank(self):
+        self.assertEqual(self.registry.table_choices, (('', ''),
+                                                       ('routes.txt', 'routes.txt'),
+                                                       ('fare_rules.txt', 'fare_rules.txt'),
+                                                       ('transfers.txt', 'transfers.txt')))
+
+    def test_field_choices_of_a_table(self):
+        self.assertEqual(self.registry.get_gtfs_field_tuple_from_table('routes.txt'),
+                         (('', ''), ('route_id', 'route_id'), ('route_color', 'route_color')))
+        with self.assertRaises(ValueError):
+            self.registry.get_gtfs_field_tuple_from_table('unknown.txt')
+
+    def test_all_field_choices(self):
+        self.assertEqual(self.registry.all_field_choices, (('', ''),
+                                                           ('route_id', 'route_id'),
+                                                           ('route_color', 'route_color'),
+                                                           ('fare_id', 'fare_id'),
+                                                           ('route_id', 'route_id'),
+                                                           ('from_stop_id', 'from_stop_id'),
+                                                           ('to_stop_id', 'to_stop_id')))
+
+    def test_cascading_drop_down(self):
+        self.assertEqual(self.registry.get_cascading_drop_down()['transfers.txt'], ['from_stop_id', 'to_stop_id'])
+
+    def test_module_functions_read_the_registry_built_at_startup(self):
+        self.assertIs(get_spec_registry(), settings.GTFS_SPEC_REGISTRY)
+        self.assertEqual(get_gtfs_table_tuple(), settings.GTFS_SPEC_REGISTRY.table_choices)
+        self.assertEqual(get_gtfs_field_tuple_from_table('routes.txt'),
+                         settings.GTFS_SPEC_REGISTRY.get_gtfs_field_tuple_from_table('routes.txt'))
+        self.assertEqual(get_all_gtfs_field_tuple(), settings.GTFS_SPEC_REGISTRY.all_field_choices)
@@ -0,0 +1,79 @@
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from gtfs_grading_app.classes.classes import DataSelector
+from gtfs_grading_app.models import result, score, gtfs_field
+from gtfs_grading_app.tests.test_classes import FeedTestCase, create_review_category
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class QueryBudgetTestCase(FeedTestCase):
+    """Seeds a review of BART with a few categories, related fields and scores. Static files are served without the
+    manifest so pages render without running collectstatic first."""
+
+    def setUp(self):
+        self.route_color = create_review_category('route_color', 'routes.txt', 'Color')
+        self.route_long_name = create_review_category('route_long_name', 'routes.txt', 'Text')
+        self.route_long_name.review_widget.related_field_same_table.add(
+            gtfs_field.objects.create(name='route_short_name', table='routes.txt', type='Text'),
+            gtfs_field.objects.create(name='route_type', table='routes.txt', type='Text'))
+        self.trip_headsign = create_review_category('trip_headsign', 'trips.txt', 'Text', 'trip_headsign')
+        new_session_gtfs_feed, self.my_review = DataSelector.setup_initial_data_for_review(self.feed_hash,
+                                                                                           'Bay Area Rapid Transit',
+                                                                                           '1')
+        for my_result in result.objects.filter(review=self.my_review).select_related('review_category'):
+            my_result.score = score.objects.create(score=1, help_text='',
+                                                   results_capture_widget_id=my_result.review_category.results_capture_widget_id)
+            my_result.save()
+
+    def assertQueryBudget(self, url, budget):
+        """Requests url and fails if it runs more than budget queries, listing the queries that ran"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        executed = [query['sql'] for query in queries.captured_queries]
+        self.assertLessEqual(len(executed), budget, "{} ran {} queries, the budget is {}:\n{}".format(
+            url, len(executed), budget, '\n'.join(executed)))
+        return response
+
+
+class ViewQueryBudgetTests(QueryBudgetTestCase):
+    """The budgets include the first load of the per-process lookup caches, the version read of the review pages' ETag
+    and, for the results page of the review still in progress, the status read and update moving it to review. None of
+    them grow with the number of results in the review"""
+
+    def test_evaluate_feed(self):
+        self.assertQueryBudget(reverse('evaluate_feed', args=[self.my_review.id, self.trip_headsign.id, 2]), 11)
+
+    def test_review_evaluation_results(self):
+        self.assertQueryBudget(reverse('review_evaluation_results', args=[self.my_review.id]), 6)
+
+    def test_review_evaluation_results_with_active_result(self):
+        my_result = result.objects.filter(review=self.my_review, review_category=self.trip_headsign).first()
+        self.assertQueryBudget(reverse('review_evaluation_results', args=[self.my_review.id, my_result.id]), 11)
+
+    def test_view_completed_review(self):
+        my_result = result.objects.filter(review=self.my_review, review_category=self.route_long_name).first()
+        self.assertQueryBudget(reverse('view_completed_review', args=[self.my_review.id, my_result.id]), 8)
+
+    def test_admin_details(self):
+        self.assertQueryBudget(reverse('admin_details', args=[self.route_long_name.id]), 4)
+
+
+class RequestProfileMiddlewareTests(QueryBudgetTestCase):
+
+    @override_settings(REQUEST_PROFILING=True)
+    def test_server_timing_header(self):
+        with self.assertLogs('gtfs_grading.profiling', 'INFO') as logs:
+            response = self.client.get(reverse('review_evaluation_results', args=[self.my_review.id]))
+
+        self.assertRegex(response['Server-Timing'], r'^sql;dur=[\d.]+;desc="\d+ queries", template;dur=[\d.]+, '
+                                                    r'total;dur=[\d.]+$')
+        self.assertIn('queries=', logs.output[0])
+
+    def test_off_by_default(self):
+        response = self.client.get(reverse('review_evaluation_results', args=[self.my_review.id]))
+
+        self.assertNotIn('Server-Timing', response)
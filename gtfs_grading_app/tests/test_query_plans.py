@@ -0,0 +1,15 @@
+import io
+
+from django.core.management import call_command
+from django.test import TestCase
+
+
+class QueryPlanTests(TestCase):
+
+    def test_hot_queries_use_their_indexes(self):
+        out = io.StringIO()
+
+        call_command('check_query_plans', seed=100000, stdout=out)
+
+        self.assertIn('USING INDEX result_review_score_idx', out.getvalue())
+        self.assertIn('USING INDEX review_status_idx', out.getvalue())
@@ -0,0 +1,53 @@
+from django.template import Context, Template
+from django.test import TestCase
+
+from gtfs_grading_app.Functions import lookup_cache
+from gtfs_grading_app.Functions.functions import get_mode_drop_down
+from gtfs_grading_app.models import mode_lookup_table, gtfs_field
+
+
+class LookupCacheTests(TestCase):
+
+    def setUp(self):
+        for mode_id, mode_name in [(0, 'Tram'), (1, 'Subway'), (3, 'Bus')]:
+            mode_lookup_table.objects.create(mode_id=str(mode_id), mode_name=mode_name, mode_description='')
+        self.fields = [gtfs_field.objects.create(name='field_{}'.format(i), table='routes.txt', type='Text')
+                       for i in range(20)]
+        lookup_cache.mode_names.invalidate()
+        lookup_cache.gtfs_field_labels.invalidate()
+
+    def test_rows_render_with_one_query_per_lookup_table(self):
+        template = Template("{% load custom_tags %}"
+                            "{% for field in fields %}{{ field.id | get_gtfs_field_name_from_id }}"
+                            "{{ mode | filter_mode_id_to_name }}{% endfor %}")
+
+        with self.assertNumQueries(2):
+            output = template.render(Context({'fields': self.fields, 'mode': 3}))
+
+        self.assertIn('Field 19Bus', output)
+
+    def test_mode_drop_down(self):
+        # one query to load the modes, one to reload them the first time mode 7 is not found
+        with self.assertNumQueries(2):
+            drop_down = get_mode_drop_down([0, 1, 3, 7, 7])
+
+        self.assertEqual(drop_down, ((0, 'Tram'), (1, 'Subway'), (3, 'Bus'), (7, '7 - Mode id not found'),
+                                     (7, '7 - Mode id not found')))
+
+    def test_missing_keys_are_reloaded_once(self):
+        with self.assertNumQueries(3):
+            lookup_cache.mode_names.get('7')
+            lookup_cache.mode_names.get('8')
+
+        with self.assertNumQueries(0):
+            self.assertIsNone(lookup_cache.mode_names.get('7'))
+            self.assertIsNone(lookup_cache.mode_names.get('8'))
+
+    def test_cache_is_dropped_on_save(self):
+        self.assertEqual(lookup_cache.mode_names.get('3'), 'Bus')
+
+        my_mode = mode_lookup_table.objects.get(mode_name='Bus')
+        my_mode.mode_name = 'Coach'
+        my_mode.save()
+
+        self.assertEqual(lookup_cache.mode_names.get('3'), 'Coach')
@@ -1,5 +1,30 @@
-from django.test import TestCase
+import io
+import os
+import pickle
+import shutil
+import struct
+import tempfile
+import zipfile
+import zlib
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib import messages
+from django.contrib.messages import get_messages
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+
+from gtfs_grading_app.Functions import feed_cache, feed_workspace, review_jobs
+from gtfs_grading_app.Functions.review_snapshot import write_review_snapshot
+from gtfs_grading_app.classes.classes import DataSelector
+from gtfs_grading_app.classes.review_setup import get_category_specs, get_plan_path
+from gtfs_grading_app.models import result, review, review_setup_job, review_candidate_pool, related_field, score, \
+    review_snapshot, results_capture_widget, gtfs_field
+from gtfs_grading_app.tests.test_classes import FeedTestCase, create_review_category
 
 
 class ViewTests(TestCase):
@@ -15,4 +40,721 @@ class ViewTests(TestCase):
         with open('files_for_testing/image_test.jpg', 'rb') as file:
             response = self.client.post(reverse('post_gtfs'), {'file': file}, follow=True)
         message = list(response.context.get('messages'))[0]
-        self.assertEqual(message.tags, "alert-danger")
\ No newline at end of file
+        self.assertEqual(message.tags, "alert-danger")
+
+class FeedCacheTests(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(GTFS_FEED_CACHE_DIR=self.cache_dir)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.cache_dir)
+
+    def test_identical_uploads_share_one_cache_entry(self):
+        for i in range(2):
+            with open('files_for_testing/BART.zip', 'rb') as file:
+                self.client.post(reverse('post_gtfs'), {'file': file}, HTTP_REFERER=reverse('home'))
+        feed_hash = self.client.session['gtfs_feed']
+
+        self.assertTrue(feed_cache.is_cached(feed_hash))
+        self.assertEqual(feed_cache.get_cache_stats()['entries'], 1)
+
+    def test_tables_are_parsed_once(self):
+        feed_hash = feed_cache.add_feed_zip('files_for_testing/BART.zip')
+        routes = feed_cache.load_feed(feed_hash).routes
+        stats_before = feed_cache.get_cache_stats()
+
+        cached_routes = feed_cache.load_feed(feed_hash).routes
+        stats_after = feed_cache.get_cache_stats()
+
+        self.assertTrue(routes.equals(cached_routes))
+        self.assertEqual(stats_after['table_hits'], stats_before['table_hits'] + 1)
+        self.assertEqual(stats_after['table_misses'], stats_before['table_misses'])
+
+    def test_manifest_is_written_with_the_entry(self):
+        feed_hash = feed_cache.add_feed_zip('files_for_testing/BART.zip', tables=['agency.txt'])
+
+        manifest = feed_cache.load_manifest(feed_hash)
+
+        self.assertEqual(manifest['feed_hash'], feed_hash)
+        self.assertEqual(manifest['agencies'], [{'agency_id': 'BART',
+                                                 'agency_name': 'Bay Area Rapid Transit',
+                                                 'route_types': [1]}])
+        self.assertEqual(manifest['tables']['agency.txt']['rows'], 1)
+        self.assertGreater(manifest['tables']['stop_times.txt']['size'], 0)
+
+    def test_picker_reads_only_the_manifest(self):
+        feed_hash = feed_cache.add_feed_zip('files_for_testing/BART.zip', tables=[])
+        session = self.client.session
+        session['gtfs_feed'] = feed_hash
+        session.save()
+        stats_before = feed_cache.get_cache_stats()
+
+        with override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'):
+            response = self.client.get(reverse('start_new_evaluation'))
+
+        form = response.context['my_new_review_form']
+        self.assertEqual(form.fields['agency'].choices, [('Bay Area Rapid Transit', 'Bay Area Rapid Transit')])
+        self.assertEqual([value for value, label in form.fields['mode'].choices], [1])
+        stats_after = feed_cache.get_cache_stats()
+        self.assertEqual((stats_after['table_hits'], stats_after['table_misses']),
+                         (stats_before['table_hits'], stats_before['table_misses']))
+        self.assertEqual(os.listdir(feed_cache.get_feed_dir(feed_hash)), [])
+
+    def test_upload_reports_problems_per_file(self):
+        upload = io.BytesIO()
+        with zipfile.ZipFile('files_for_testing/BART.zip') as source, zipfile.ZipFile(upload, 'w') as target:
+            for info in source.infolist():
+                if not info.filename.endswith('stops.txt'):
+                    target.writestr(info, source.read(info))
+        upload.seek(0)
+        upload.name = 'no_stops.zip'
+
+        response = self.client.post(reverse('post_gtfs'), {'file': upload}, HTTP_REFERER=reverse('home'))
+        error_messages = [m.message for m in get_messages(response.wsgi_request) if m.level == messages.ERROR]
+
+        self.assertNotIn('gtfs_feed', self.client.session)
+        self.assertIn('stops.txt: This required file is missing from the feed.', error_messages)
+
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_upload_reports_corrupt_files(self):
+        upload = corrupt_zip_member('files_for_testing/BART.zip', 'agency.txt', 0.3)
+
+        response = self.client.post(reverse('post_gtfs'), {'file': upload}, HTTP_REFERER=reverse('home'), follow=True)
+        error_messages = [m.message for m in response.context['messages'] if m.level == messages.ERROR]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('gtfs_feed', self.client.session)
+        self.assertIn('agency.txt: The file is corrupt and could not be read.', error_messages)
+
+    def test_upload_corrupt_past_the_header_is_not_cached(self):
+        upload = corrupt_zip_member('files_for_testing/BART.zip', 'stop_times.txt', 0.9)
+
+        response = self.client.post(reverse('post_gtfs'), {'file': upload}, HTTP_REFERER=reverse('home'))
+        error_messages = [m.message for m in get_messages(response.wsgi_request) if m.level == messages.ERROR]
+
+        self.assertNotIn('gtfs_feed', self.client.session)
+        self.assertIn('upload: The file is corrupt and could not be read.', error_messages)
+        self.assertEqual(feed_cache.list_entries(), [])
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_upload_failing_to_extract_leaves_an_existing_entry(self):
+        feed_hash = feed_cache.add_feed_zip('files_for_testing/BART.zip', tables=[])
+
+        with mock.patch.object(feed_cache, 'extract_tables', side_effect=zlib.error), \
+                open('files_for_testing/BART.zip', 'rb') as file:
+            response = self.client.post(reverse('post_gtfs'), {'file': file}, HTTP_REFERER=reverse('home'))
+        error_messages = [m.message for m in get_messages(response.wsgi_request) if m.level == messages.ERROR]
+
+        self.assertIn('upload: The file is corrupt and could not be read.', error_messages)
+        self.assertTrue(feed_cache.is_cached(feed_hash))
+
+
+def corrupt_zip_member(path, file_name, position) -> io.BytesIO:
+    """returns a copy of a zip with a few bytes of a member's compressed data flipped, position is the fraction of
+    the member's data they are flipped at. The central directory is left intact."""
+    with open(path, 'rb') as file:
+        data = bytearray(file.read())
+    with zipfile.ZipFile(path) as zip_ref:
+        info = next(info for info in zip_ref.infolist() if os.path.basename(info.filename) == file_name)
+    name_length, extra_length = struct.unpack('<HH', data[info.header_offset + 26:info.header_offset + 30])
+    start = info.header_offset + 30 + name_length + extra_length + int(info.compress_size * position)
+    for i in range(start, start + 8):
+        data[i] ^= 0xFF
+    upload = io.BytesIO(bytes(data))
+    upload.name = 'corrupt.zip'
+    return upload
+
+
+class FeedWorkspaceTests(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(GTFS_FEED_CACHE_DIR=self.cache_dir)
+        self.settings_override.enable()
+        # three copies of the same feed under different hashes, used one hour, two hours and three hours ago
+        self.feed_hashes = [str(i) * 64 for i in range(3)]
+        for hours_ago, feed_hash in enumerate(self.feed_hashes, start=1):
+            feed_cache.add_feed_zip('files_for_testing/BART.zip', feed_hash=feed_hash, tables=[])
+            last_access = timezone.now().timestamp() - hours_ago * 60 * 60
+            os.utime(feed_cache.get_last_access_path(feed_hash), (last_access, last_access))
+        self.entry_size = feed_cache.list_entries()[0]['size_bytes']
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.cache_dir)
+
+    def test_least_recently_used_feeds_are_evicted_first(self):
+        report = feed_workspace.sweep(quota=self.entry_size)
+
+        self.assertEqual(report['evicted'], [self.feed_hashes[2], self.feed_hashes[1]])
+        self.assertEqual([entry['feed_hash'] for entry in feed_cache.list_entries()], [self.feed_hashes[0]])
+        self.assertFalse(feed_cache.is_cached(self.feed_hashes[2]))
+
+    def test_feeds_of_reviews_in_progress_are_kept(self):
+        review.objects.create(agency='Bay Area Rapid Transit', mode=1, gtfs_feed_hash=self.feed_hashes[2])
+        review.objects.create(agency='Bay Area Rapid Transit', mode=1, gtfs_feed_hash=self.feed_hashes[1],
+                              review_status="Completed")
+
+        report = feed_workspace.sweep(quota=0)
+
+        self.assertEqual(report['evicted'], [self.feed_hashes[1], self.feed_hashes[0]])
+        self.assertTrue(feed_cache.is_cached(self.feed_hashes[2]))
+        self.assertEqual(report['size_bytes'], self.entry_size)
+
+    def test_recently_used_feeds_are_kept(self):
+        feed_cache.touch(self.feed_hashes[2])
+
+        report = feed_workspace.sweep(quota=0)
+
+        self.assertEqual(report['evicted'], [self.feed_hashes[1], self.feed_hashes[0]])
+
+    def test_dry_run_deletes_nothing(self):
+        out = io.StringIO()
+        call_command('sweep_feed_cache', quota=0, dry_run=True, stdout=out)
+
+        self.assertIn('would evict ' + self.feed_hashes[2], out.getvalue())
+        self.assertEqual(len(feed_cache.list_entries()), 3)
+
+    def test_abandoned_uploads_are_removed(self):
+        abandoned = tempfile.mkdtemp(dir=self.cache_dir, prefix='.incoming-')
+        os.utime(abandoned, (0, 0))
+        in_flight = tempfile.mkdtemp(dir=self.cache_dir, prefix='.incoming-')
+
+        report = feed_workspace.sweep()
+
+        self.assertEqual(report['abandoned_files'], 1)
+        self.assertFalse(os.path.exists(abandoned))
+        self.assertTrue(os.path.exists(in_flight))
+
+
+class EvaluateFeedNavigationTests(FeedTestCase):
+
+    def setUp(self):
+        self.trip_headsign = create_review_category('trip_headsign', 'trips.txt', 'Text', 'trip_headsign')
+        new_session_gtfs_feed, self.my_review = DataSelector.setup_initial_data_for_review(self.feed_hash,
+                                                                                           'Bay Area Rapid Transit',
+                                                                                           '1')
+        self.results = list(result.objects.filter(review=self.my_review).order_by('position'))
+
+    def test_results_are_numbered_from_one(self):
+        self.assertEqual([r.position for r in self.results], [1, 2, 3, 4, 5])
+
+    def test_result_number_selects_result_at_that_position(self):
+        response = self.client.get(reverse('evaluate_feed', args=[self.my_review.id, self.trip_headsign.id, 3]))
+
+        self.assertEqual(response.context['active_result'], self.results[2])
+        self.assertEqual(response.context['max_items'], 5)
+
+    def test_result_number_out_of_range_is_404(self):
+        response = self.client.get(reverse('evaluate_feed', args=[self.my_review.id, self.trip_headsign.id, 6]))
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_result_id_redirects_to_its_position(self):
+        my_result = self.results[0]
+
+        response = self.client.get(reverse('evaluate_feed_by_result_id',
+                                           args=[self.my_review.id, self.trip_headsign.id, my_result.id]))
+
+        self.assertRedirects(response, reverse('evaluate_feed', args=[self.my_review.id, self.trip_headsign.id, 1]))
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage', REVIEW_BATCH_SIZE=2)
+class BatchScoringTests(FeedTestCase):
+
+    def setUp(self):
+        self.trip_headsign = create_review_category('trip_headsign', 'trips.txt', 'Text', 'trip_headsign')
+        self.good = score.objects.create(score=2, help_text='Matches',
+                                         results_capture_widget=self.trip_headsign.results_capture_widget)
+        self.bad = score.objects.create(score=0, help_text='Does not match',
+                                        results_capture_widget=self.trip_headsign.results_capture_widget)
+        new_session_gtfs_feed, self.my_review = DataSelector.setup_initial_data_for_review(self.feed_hash,
+                                                                                           'Bay Area Rapid Transit',
+                                                                                           '1')
+        self.results = list(result.objects.filter(review=self.my_review).order_by('position'))
+        self.url = reverse('evaluate_feed_batch', args=[self.my_review.id, self.trip_headsign.id, 1])
+
+    def completed_results(self):
+        progress = self.my_review.get_category_progress()[self.trip_headsign.id]
+        self.my_review.refresh_from_db()
+        return self.my_review.completed_results, progress.completed_results
+
+    def test_page_shows_a_batch_of_results(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual([item['result'] for item in response.context['items']], self.results[:2])
+        self.assertContains(response, 'name="score_id_{}"'.format(self.results[1].id))
+        self.assertNotContains(response, 'name="score_id_{}"'.format(self.results[2].id))
+
+    def test_post_scores_the_batch_with_bulk_updates(self):
+        data = {'score_id_{}'.format(self.results[0].id): self.good.id,
+                'score_id_{}'.format(self.results[1].id): self.bad.id}
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, data)
+
+        self.assertRedirects(response, reverse('evaluate_feed_batch', args=[self.my_review.id, self.trip_headsign.id, 2]),
+                             fetch_redirect_response=False)
+        self.assertEqual([r.score_id for r in result.objects.filter(review=self.my_review).order_by('position')],
+                         [self.good.id, self.bad.id, None, None, None])
+        self.assertEqual(self.completed_results(), (2, 2))
+        result_updates = [query['sql'] for query in queries.captured_queries
+                          if query['sql'].startswith('UPDATE "gtfs_grading_app_result"')]
+        self.assertEqual(len(result_updates), 2)
+
+    def test_rescoring_does_not_count_results_twice(self):
+        self.client.post(self.url, {'score_id_{}'.format(self.results[0].id): self.good.id})
+
+        self.client.post(self.url, {'score_id_{}'.format(self.results[0].id): self.bad.id,
+                                    'score_id_{}'.format(self.results[1].id): self.good.id})
+
+        self.assertEqual(result.objects.get(id=self.results[0].id).score_id, self.bad.id)
+        self.assertEqual(self.completed_results(), (2, 2))
+
+    def test_scores_of_other_widgets_are_rejected(self):
+        other_category = create_review_category('route_color', 'routes.txt', 'Color')
+        other_score = score.objects.create(score=1, help_text='',
+                                           results_capture_widget=other_category.results_capture_widget)
+
+        response = self.client.post(self.url, {'score_id_{}'.format(self.results[0].id): other_score.id})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(result.objects.get(id=self.results[0].id).score_id)
+
+    def test_categories_requiring_an_image_are_scored_one_at_a_time(self):
+        results_capture_widget.objects.filter(id=self.trip_headsign.results_capture_widget_id) \
+            .update(has_score_image='Required')
+
+        response = self.client.get(self.url)
+
+        self.assertRedirects(response, reverse('evaluate_feed', args=[self.my_review.id, self.trip_headsign.id]),
+                             fetch_redirect_response=False)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class RapidReviewTests(FeedTestCase):
+
+    def setUp(self):
+        self.trip_headsign = create_review_category('trip_headsign', 'trips.txt', 'Text', 'trip_headsign')
+        self.good = score.objects.create(score=2, help_text='Matches',
+                                         results_capture_widget=self.trip_headsign.results_capture_widget)
+        new_session_gtfs_feed, self.my_review = DataSelector.setup_initial_data_for_review(self.feed_hash,
+                                                                                           'Bay Area Rapid Transit',
+                                                                                           '1')
+        self.results = list(result.objects.filter(review=self.my_review).order_by('position'))
+
+    def test_page_renders(self):
+        response = self.client.get(reverse('rapid_review', args=[self.my_review.id, self.trip_headsign.id]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['payload_url'],
+                         reverse('rapid_review_payload', args=[self.my_review.id, self.trip_headsign.id]))
+
+    def test_payload_has_every_result_of_the_category(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('rapid_review_payload', args=[self.my_review.id, self.trip_headsign.id]))
+
+        payload = response.json()
+        self.assertEqual(payload['review_category']['scores'], [{'id': self.good.id, 'score': 2.0,
+                                                                  'help_text': 'Matches'}])
+        self.assertEqual([item['id'] for item in payload['results']], [my_result.id for my_result in self.results])
+        first = payload['results'][0]
+        self.assertEqual(first['reviewed_data'], self.results[0].reviewed_data)
+        self.assertEqual(first['field'], {'field_value': self.results[0].reviewed_data})
+        self.assertEqual(len(first['related_fields']), 3)
+        self.assertIsNone(first['score_id'])
+        self.assertEqual(first['save_url'], reverse('rapid_review_score', args=[self.results[0].id]))
+        self.assertLessEqual(len(queries.captured_queries), 6)
+
+    def test_score_saves_one_result(self):
+        my_result = self.results[0]
+
+        response = self.client.post(reverse('rapid_review_score', args=[my_result.id]),
+                                    {'score_id_{}'.format(my_result.id): self.good.id})
+
+        self.assertEqual(response.json()['score_id'], self.good.id)
+        self.assertEqual(result.objects.get(id=my_result.id).score_id, self.good.id)
+        self.my_review.refresh_from_db()
+        self.assertEqual(self.my_review.completed_results, 1)
+
+    def test_unknown_score_is_rejected(self):
+        my_result = self.results[0]
+
+        response = self.client.post(reverse('rapid_review_score', args=[my_result.id]),
+                                    {'score_id_{}'.format(my_result.id): self.good.id + 100})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('score_id_{}'.format(my_result.id), response.json()['errors'])
+        self.assertIsNone(result.objects.get(id=my_result.id).score_id)
+
+    def test_score_needs_a_post(self):
+        response = self.client.get(reverse('rapid_review_score', args=[self.results[0].id]))
+
+        self.assertEqual(response.status_code, 405)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class CompletedReviewSnapshotTests(FeedTestCase):
+
+    def setUp(self):
+        self.trip_headsign = create_review_category('trip_headsign', 'trips.txt', 'Text', 'trip_headsign')
+        self.score = score.objects.create(score=2, help_text='Matches the signs',
+                                          results_capture_widget=self.trip_headsign.results_capture_widget)
+        new_session_gtfs_feed, self.my_review = DataSelector.setup_initial_data_for_review(self.feed_hash,
+                                                                                           'Bay Area Rapid Transit',
+                                                                                           '1')
+        self.results = list(result.objects.filter(review=self.my_review).order_by('id'))
+        result.objects.filter(review=self.my_review).update(score=self.score)
+        result.objects.filter(id=self.results[0].id).update(score_reason='Checked on site')
+
+    def complete_review(self):
+        self.client.get(reverse('mark_review_complete', args=[self.my_review.id]), HTTP_REFERER='/')
+
+    def test_completing_a_review_writes_its_snapshot(self):
+        self.complete_review()
+
+        snapshot = review_snapshot.objects.get(review=self.my_review)
+        self.assertEqual([snapshot_result['id'] for snapshot_result in snapshot.results],
+                         [my_result.id for my_result in self.results])
+        first = snapshot.results[0]
+        self.assertEqual(first['score'], {'score': 2.0, 'help_text': 'Matches the signs'})
+        self.assertEqual(first['score_reason'], 'Checked on site')
+        self.assertEqual(first['review_category']['gtfs_field']['field_name_to_label'], 'Trip Headsign')
+        self.assertEqual([field['label'] for field in first['related_fields']],
+                         ['Route Short Name', 'Route Long Name', 'Route Desc'])
+        self.assertEqual(first['review_field_context'], {'field_value': self.results[0].reviewed_data})
+
+    def test_completed_review_page_does_not_read_results(self):
+        self.complete_review()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('view_completed_review', args=[self.my_review.id, self.results[0].id]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Checked on site')
+        self.assertEqual(response.context['active_result']['reviewed_data'], self.results[0].reviewed_data)
+        self.assertFalse([query['sql'] for query in queries.captured_queries
+                          if 'gtfs_grading_app_result' in query['sql'] or 'related_field' in query['sql']])
+
+    def test_completed_review_keeps_the_scores_it_was_completed_with(self):
+        self.complete_review()
+        score.objects.filter(id=self.score.id).update(help_text='Edited later')
+
+        response = self.client.get(reverse('review_evaluation_results', args=[self.my_review.id, self.results[0].id]))
+
+        self.assertContains(response, 'Matches the signs')
+        self.assertNotContains(response, 'Edited later')
+
+    def test_reviews_completed_before_snapshots_get_one_when_viewed(self):
+        review.objects.filter(id=self.my_review.id).update(review_status='Completed')
+
+        response = self.client.get(reverse('view_completed_review', args=[self.my_review.id]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(review_snapshot.objects.get(review=self.my_review).results), len(self.results))
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ConditionalGetTests(FeedTestCase):
+
+    def setUp(self):
+        self.trip_headsign = create_review_category('trip_headsign', 'trips.txt', 'Text', 'trip_headsign')
+        self.score = score.objects.create(score=2, help_text='Matches the signs',
+                                          results_capture_widget=self.trip_headsign.results_capture_widget)
+        new_session_gtfs_feed, self.my_review = DataSelector.setup_initial_data_for_review(self.feed_hash,
+                                                                                           'Bay Area Rapid Transit',
+                                                                                           '1')
+        self.results = list(result.objects.filter(review=self.my_review).order_by('id'))
+        result.objects.filter(review=self.my_review).update(score=self.score)
+        self.my_review.mark_status_in_review()
+
+    def get_etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def complete_review(self):
+        self.my_review.mark_status_complete()
+        write_review_snapshot(self.my_review)
+
+    def test_unchanged_completed_review_is_not_modified(self):
+        self.complete_review()
+        url = reverse('view_completed_review', args=[self.my_review.id, self.results[0].id])
+        etag = self.get_etag(url)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries.captured_queries), 1, [query['sql'] for query in queries.captured_queries])
+        self.assertIn('"version"', queries.captured_queries[0]['sql'])
+
+    def test_scoring_a_result_changes_the_etag(self):
+        url = reverse('review_evaluation_results', args=[self.my_review.id])
+        etag = self.get_etag(url)
+
+        self.client.post(reverse('rapid_review_score', args=[self.results[0].id]),
+                         {'score_id_{}'.format(self.results[0].id): self.score.id})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_editing_a_score_changes_the_etag(self):
+        url = reverse('review_evaluation_results', args=[self.my_review.id])
+        etag = self.get_etag(url)
+
+        self.score.help_text = 'Edited'
+        self.score.save()
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_editing_a_results_capture_widget_changes_the_etag(self):
+        url = reverse('review_evaluation_results', args=[self.my_review.id])
+        etag = self.get_etag(url)
+
+        my_results_capture_widget = self.trip_headsign.results_capture_widget
+        my_results_capture_widget.has_score_reason = 'Required'
+        my_results_capture_widget.save()
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_first_results_page_of_a_review_in_progress_has_a_current_etag(self):
+        review.objects.filter(id=self.my_review.id).update(review_status='In progress')
+        url = reverse('review_evaluation_results', args=[self.my_review.id])
+
+        etag = self.get_etag(url)
+
+        self.assertEqual(review.objects.get(id=self.my_review.id).review_status, 'In review')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_not_modified_results_page_does_not_write(self):
+        url = reverse('review_evaluation_results', args=[self.my_review.id])
+        etag = self.get_etag(url)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual([query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')], [])
+
+    def test_editing_configuration_keeps_the_etag_of_completed_reviews(self):
+        self.complete_review()
+        url = reverse('review_evaluation_results', args=[self.my_review.id])
+        etag = self.get_etag(url)
+
+        self.score.help_text = 'Edited'
+        self.score.save()
+        gtfs_field.objects.filter(id=self.trip_headsign.gtfs_field_id).update(name='renamed')
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        response = self.client.get(url)
+        self.assertEqual([cat['gtfs_field']['name'] for cat in response.context['review_categories']],
+                         ['trip_headsign'])
+
+    def test_completing_a_review_again_changes_its_etag(self):
+        self.complete_review()
+        url = reverse('view_completed_review', args=[self.my_review.id])
+        etag = self.get_etag(url)
+
+        write_review_snapshot(self.my_review)
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_review_in_progress_has_no_etag(self):
+        review.objects.filter(id=self.my_review.id).update(review_status='In progress')
+
+        response = self.client.get(reverse('view_completed_review', args=[self.my_review.id]))
+
+        self.assertNotIn('ETag', response)
+
+    def test_pending_messages_are_not_answered_with_not_modified(self):
+        url = reverse('review_evaluation_results', args=[self.my_review.id])
+        etag = self.get_etag(url)
+
+        self.client.get(reverse('mark_review_complete', args=[self.my_review.id]), HTTP_REFERER=url)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertContains(response, 'Your review has been marked complete.')
+
+    def test_completed_review_list(self):
+        url = reverse('search_competed_review')
+        etag = self.get_etag(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.complete_review()
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(REVIEW_SKIP_CANDIDATES=2)
+class SkipResultTests(FeedTestCase):
+
+    def setUp(self):
+        self.trip_headsign = create_review_category('trip_headsign', 'trips.txt', 'Text', 'trip_headsign')
+        new_session_gtfs_feed, self.my_review = DataSelector.setup_initial_data_for_review(self.feed_hash,
+                                                                                           'Bay Area Rapid Transit',
+                                                                                           '1')
+        self.my_result = result.objects.get(review=self.my_review, position=2)
+
+    def skip(self):
+        return self.client.get(reverse('skip_it_replace_result', args=[self.my_result.id]))
+
+    def test_skip_replaces_result_in_place(self):
+        pool = review_candidate_pool.objects.get(review=self.my_review, review_category=self.trip_headsign)
+        candidate = pool.candidates[0]
+
+        response = self.skip()
+
+        self.assertRedirects(response, reverse('evaluate_feed', args=[self.my_review.id, self.trip_headsign.id, 2]),
+                             fetch_redirect_response=False)
+        self.my_result.refresh_from_db()
+        self.assertEqual(self.my_result.reviewed_data_pk_value, candidate['reviewed_data_pk_value'])
+        self.assertEqual(self.my_result.position, 2)
+        self.assertEqual(sorted(related_field.objects.filter(result=self.my_result)
+                                .values_list('gtfs_field_id', 'gtfs_field_value')),
+                         sorted(tuple(field) for field in candidate['related_fields']))
+        self.assertEqual(result.objects.filter(review=self.my_review).count(), 5)
+
+    def test_skip_does_not_read_the_feed(self):
+        stats_before = feed_cache.get_cache_stats()
+
+        self.skip()
+
+        stats_after = feed_cache.get_cache_stats()
+        self.assertEqual((stats_after['table_hits'], stats_after['table_misses']),
+                         (stats_before['table_hits'], stats_before['table_misses']))
+
+    def test_skip_is_refused_once_the_pool_is_empty(self):
+        self.skip()
+        self.skip()
+        pk_value = result.objects.get(id=self.my_result.id).reviewed_data_pk_value
+
+        response = self.skip()
+
+        warnings = [m.message for m in get_messages(response.wsgi_request) if m.level == messages.WARNING]
+        self.assertEqual(len(warnings), 1)
+        self.assertEqual(result.objects.get(id=self.my_result.id).reviewed_data_pk_value, pk_value)
+
+    def test_scored_result_can_not_be_skipped(self):
+        my_score = score.objects.create(score=1, help_text='',
+                                        results_capture_widget=self.trip_headsign.results_capture_widget)
+        result.objects.filter(id=self.my_result.id).update(score=my_score)
+
+        self.skip()
+
+        pool = review_candidate_pool.objects.get(review=self.my_review, review_category=self.trip_headsign)
+        self.assertEqual(pool.next_candidate, 0)
+
+
+class ReviewSetupJobTests(FeedTestCase):
+
+    def setUp(self):
+        self.trip_headsign = create_review_category('trip_headsign', 'trips.txt', 'Text', 'trip_headsign')
+        session = self.client.session
+        session['gtfs_feed'] = self.feed_hash
+        session.save()
+
+    def get_status(self, job):
+        return self.client.get(reverse('review_setup_job_status', args=[job.id])).json()
+
+    def test_start_new_evaluation_queues_setup(self):
+        response = self.client.post(reverse('start_new_evaluation'), {'agency': 'Bay Area Rapid Transit', 'mode': '1'})
+
+        job = review_setup_job.objects.get()
+        self.assertRedirects(response, reverse('review_setup_progress', args=[job.id]), fetch_redirect_response=False)
+        status = self.get_status(job)
+        self.assertEqual(status['status'], 'Queued')
+        self.assertEqual((status['completed_categories'], status['total_categories']), (0, 1))
+        self.assertFalse(result.objects.exists())
+
+    def test_worker_runs_job_and_status_points_to_review(self):
+        job = review_jobs.enqueue_review_setup(self.feed_hash, 'Bay Area Rapid Transit', '1')
+
+        call_command('run_review_setup_worker', once=True, stdout=io.StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'Completed')
+        self.assertEqual(result.objects.filter(review=job.review).count(), 5)
+        status = self.get_status(job)
+        self.assertEqual(status['categories'], [{'id': self.trip_headsign.id, 'name': 'Trip Headsign', 'done': True}])
+        self.assertEqual(status['redirect_url'], reverse('evaluate_feed', kwargs={'review_id': job.review_id}))
+        self.assertEqual(self.client.session['gtfs_feed'], job.filtered_feed_hash)
+
+    def test_failed_job_reports_error(self):
+        job = review_jobs.enqueue_review_setup('0' * 64, 'Bay Area Rapid Transit', '1')
+
+        with self.assertLogs('gtfs_grading_app.Functions.review_jobs', 'ERROR'):
+            review_jobs.run_queued_jobs()
+
+        status = self.get_status(job)
+        self.assertEqual(status['status'], 'Failed')
+        self.assertTrue(status['error'])
+        self.assertNotIn('redirect_url', status)
+
+    def test_stale_running_job_is_queued_again(self):
+        job = review_jobs.enqueue_review_setup(self.feed_hash, 'Bay Area Rapid Transit', '1')
+        self.assertEqual(review_jobs.claim_next_job(), job)
+        self.assertIsNone(review_jobs.claim_next_job())
+
+        review_setup_job.objects.filter(id=job.id).update(updated_date=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(review_jobs.requeue_stale_jobs(), 1)
+        self.assertEqual(review_jobs.claim_next_job(), job)
+
+    def test_precompute_is_queued_once_for_every_agency_and_mode(self):
+        manifest = feed_cache.load_manifest(self.feed_hash)
+        pairs = {(agency['agency_name'], route_type) for agency in manifest['agencies']
+                 for route_type in agency['route_types']}
+
+        review_jobs.enqueue_plan_precompute(self.feed_hash)
+        review_jobs.enqueue_plan_precompute(self.feed_hash)
+
+        jobs = review_setup_job.objects.filter(precompute=True)
+        self.assertEqual({(job.agency, job.mode) for job in jobs}, pairs)
+        self.assertEqual(jobs.count(), len(pairs))
+
+    @override_settings(REVIEW_PRECOMPUTE_MAX_PER_UPLOAD=1)
+    def test_precompute_queued_by_an_upload_is_capped(self):
+        manifest = feed_cache.load_manifest(self.feed_hash)
+        first_agency = manifest['agencies'][0]
+
+        review_jobs.enqueue_plan_precompute(self.feed_hash)
+
+        jobs = review_setup_job.objects.filter(precompute=True)
+        self.assertEqual([(job.agency, job.mode) for job in jobs],
+                         [(first_agency['agency_name'], first_agency['route_types'][0])])
+
+    def test_review_setup_is_claimed_before_precompute(self):
+        review_jobs.enqueue_plan_precompute(self.feed_hash, 'Bay Area Rapid Transit', '1')
+        job = review_jobs.enqueue_review_setup(self.feed_hash, 'Bay Area Rapid Transit', '1')
+
+        self.assertEqual(review_jobs.claim_next_job(), job)
+
+    def test_setup_commits_the_precomputed_plan(self):
+        review_jobs.enqueue_plan_precompute(self.feed_hash, 'Bay Area Rapid Transit', '1')
+        review_jobs.run_queued_jobs()
+        precompute_job = review_setup_job.objects.get(precompute=True)
+        self.assertEqual(precompute_job.status, 'Completed')
+        self.assertIsNone(precompute_job.review)
+        plan_path = get_plan_path(precompute_job.filtered_feed_hash, get_category_specs())
+        with open(plan_path, 'rb') as f:
+            stored = pickle.load(f)
+
+        with mock.patch('gtfs_grading_app.classes.review_setup.build_review_plan', side_effect=AssertionError):
+            new_session_gtfs_feed, my_review = DataSelector.setup_initial_data_for_review(self.feed_hash,
+                                                                                          'Bay Area Rapid Transit',
+                                                                                          '1')
+
+        self.assertEqual(my_review.sample_seed, stored['seed'])
+        self.assertEqual(list(result.objects.filter(review=my_review).order_by('position')
+                              .values_list('reviewed_data_pk_value', flat=True)),
+                         [item['reviewed_data_pk_value'] for item in stored['plan'][0]['items']])
+        self.assertFalse(os.path.exists(plan_path))
@@ -2,26 +2,30 @@ from datetime import datetime
 
 from django.forms import formset_factory
 from django.forms.models import inlineformset_factory
-from django.http.response import HttpResponse, HttpResponseRedirect, Http404
+from django.http.response import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.http import Http404
 from django.shortcuts import render, redirect, get_object_or_404
-import tempfile
-import zipfile
-import partridge as ptg
+from django.urls import reverse
 from django.contrib import messages
+from django.conf import settings
+from django.db import transaction
 
 # Create your views here.
+from django.views.decorators.http import condition, require_POST
 from django.views.generic import ListView, DetailView
 
+from gtfs_grading_app.Functions import feed_cache, feed_ingest, review_jobs, review_snapshot, review_etags
+from gtfs_grading_app.Functions.rapid_review import build_category_payload
 from gtfs_grading_app.Functions.functions import get_next_review_item, \
-    get_previous_review_item, get_or_none, get_mode_drop_down, list_to_tuple_of_tuples
+    get_previous_review_item, get_or_none
 from gtfs_grading_app.classes.classes import review_widget_factory, consistency_widget_factory, \
-    results_capture_widget_factory, ReviewWidget, DataSelector
+    results_capture_widget_factory, ReviewWidget, DataSelector, BatchResultsCaptureWidget
 from gtfs_grading_app.forms import GtfsZipForm, AddReviewCategory, AddReviewWidget, AddConsistencyWidget, \
     AddResultsCaptureWidget, AddResultCaptureScore, AddReviewWidgetRelatedFieldSameTable, ChooseDataSelector, \
-    NewReviewForm, ResultForm
+    NewReviewForm, ResultForm, BatchResultForm
 from gtfs_grading_app.models import review_category, review_widget, consistency_widget, results_capture_widget, \
     gtfs_field, consistency_widget_visual_example, consistency_widget_link, score, review, result, result_reference, \
-    result_image
+    result_image, review_setup_job
 
 from gtfs_grading_app.gtfs_spec.import_gtfs_spec import get_cascading_drop_down, get_field_type
 
@@ -80,7 +84,8 @@ def admin_details(request, review_id):
     choose_data_selector = ChooseDataSelector(my_review_category=current_review,
                                               prefix="choose_data_selector",
                                               initial={'name': current_review.data_selector.name,
-                                                       'number_to_review': current_review.data_selector.number_to_review})
+                                                       'number_to_review': current_review.data_selector.number_to_review,
+                                                       'stratify_by': current_review.data_selector.stratify_by})
 
     add_score_form = AddResultCaptureScore(initial={
         'results_capture_widget': current_review.results_capture_widget}, prefix='score_form')
@@ -103,7 +108,8 @@ def admin_details(request, review_id):
                 choose_data_selector = ChooseDataSelector(my_review_category=current_review,
                                                           prefix="choose_data_selector",
                                                           initial={'name': current_review.data_selector.name,
-                                                                   'number_to_review': current_review.data_selector.number_to_review})
+                                                                   'number_to_review': current_review.data_selector.number_to_review,
+                                                                   'stratify_by': current_review.data_selector.stratify_by})
 
 
         if 'add_new_score' in request.POST:
@@ -148,29 +154,35 @@ def admin_details(request, review_id):
                                                         'update_results_capture_widget': update_results_capture_widget})
 
 
+# relations of the active review category that evaluate_feed and its widgets read
+ACTIVE_CATEGORY_RELATED = ['gtfs_field', 'review_widget', 'results_capture_widget']
+
+
 def evaluate_feed(request, review_id=None, active_review_category_id=None, active_result_number=None):
     # TODO reorder to improve performance
     if review_id is None:
         return redirect(start_new_evaluation)
     if active_review_category_id is None:
-        active_review_category = review_category.objects.first()
+        active_review_category = review_category.objects.select_related(*ACTIVE_CATEGORY_RELATED).first()
     else:
-        active_review_category = get_object_or_404(review_category, pk=active_review_category_id)
+        active_review_category = get_object_or_404(review_category.objects.select_related(*ACTIVE_CATEGORY_RELATED),
+                                                   pk=active_review_category_id)
     if active_result_number is None:
         active_result_number = 1
 
     active_review = get_object_or_404(review, pk=review_id)
 
     # calculate progress
-    total_results = result.objects.filter(review_id=review_id).count()
-    completed_results = result.objects.filter(review_id=review_id).exclude(score=None).count()
-    percentage_complete = int(round(completed_results/total_results, 2) * 100)
+    percentage_complete = active_review.percentage_complete
+    category_progress = active_review.get_category_progress()
 
     # collect results
-    review_categories = review_category.objects.all()
-    results = result.objects.filter(review_id=review_id, review_category_id=active_review_category.id)
-    active_result = results[active_result_number-1]
-    max_items = results.count()
+    review_categories = review_category.objects.select_related('gtfs_field')
+    active_result = get_object_or_404(result.objects.select_related('review_category__gtfs_field'),
+                                      review_id=review_id,
+                                      review_category_id=active_review_category.id,
+                                      position=active_result_number)
+    max_items = category_progress[active_review_category.id].total_results
 
     # get widgets
     active_review_widget = review_widget_factory(active_review_category.review_widget, active_result)
@@ -186,7 +198,8 @@ def evaluate_feed(request, review_id=None, active_review_category_id=None, activ
                                                     max_items,
                                                     active_review,
                                                     active_review_category,
-                                                    review_categories)
+                                                    review_categories,
+                                                    category_progress)
 
     if request.POST:
         form = active_result_capture_widget.get_form(request.POST, request.FILES)
@@ -242,7 +255,8 @@ def evaluate_feed(request, review_id=None, active_review_category_id=None, activ
                'form': form,
                'next_review_path': next_review_path,
                'previous_review_path': previous_review_path,
-               'percentage_complete': percentage_complete}
+               'percentage_complete': percentage_complete,
+               'can_batch_score': BatchResultsCaptureWidget.supports(active_review_category)}
 
     context.update(review_widget_context)
     context.update(result_capture_context)
@@ -250,34 +264,139 @@ def evaluate_feed(request, review_id=None, active_review_category_id=None, activ
     return render(request, 'evaluate_feed.html', context)
 
 
+def evaluate_feed_batch(request, review_id, active_review_category_id, page_number=1):
+    """Scores a page of REVIEW_BATCH_SIZE results of a review category with one form, see BatchResultsCaptureWidget"""
+    active_review_category = get_object_or_404(review_category.objects.select_related(*ACTIVE_CATEGORY_RELATED),
+                                               pk=active_review_category_id)
+    if not BatchResultsCaptureWidget.supports(active_review_category):
+        return redirect('evaluate_feed', review_id, active_review_category.id)
+    active_review = get_object_or_404(review, pk=review_id)
+
+    first_result_number = (page_number - 1) * settings.REVIEW_BATCH_SIZE + 1
+    results = list(result.objects.select_related('review_category__gtfs_field')
+                   .filter(review_id=review_id,
+                           review_category_id=active_review_category.id,
+                           position__gte=first_result_number,
+                           position__lt=first_result_number + settings.REVIEW_BATCH_SIZE)
+                   .order_by('position'))
+    if not results:
+        raise Http404("The review category has no results on this page")
+    category_progress = active_review.get_category_progress()
+    max_items = category_progress[active_review_category.id].total_results
+
+    active_result_capture_widget = BatchResultsCaptureWidget(active_review_category.results_capture_widget, results)
+    if request.POST:
+        form = active_result_capture_widget.get_form(request.POST)
+        if form.is_valid():
+            form.save()
+            last_result_number = results[-1].position
+            if last_result_number < max_items:
+                return redirect('evaluate_feed_batch', active_review.id, active_review_category.id, page_number + 1)
+            next_review_path = get_next_review_item(last_result_number,
+                                                    max_items,
+                                                    active_review,
+                                                    active_review_category,
+                                                    review_category.objects.all())
+            if next_review_path is None or active_review.review_status != "In progress":
+                return redirect('review_evaluation_results', review_id=active_review.id)
+            return redirect(next_review_path)
+    else:
+        form = active_result_capture_widget.get_form()
+
+    context = {'active_review': active_review,
+               'review_categories': review_category.objects.select_related('gtfs_field'),
+               'active_review_category': active_review_category,
+               'page_number': page_number,
+               'first_result_number': first_result_number,
+               'last_result_number': results[-1].position,
+               'max_items': max_items,
+               'has_next_page': results[-1].position < max_items,
+               'result_capture_template': active_result_capture_widget.get_template(),
+               'form': form,
+               'percentage_complete': active_review.percentage_complete}
+    context.update(active_result_capture_widget.get_template_context())
+
+    return render(request, 'evaluate_feed_batch.html', context)
+
+
+def rapid_review(request, review_id, active_review_category_id):
+    """Keyboard driven review of a review category, the page loads rapid_review_payload and saves each score with
+    rapid_review_score"""
+    active_review_category = get_object_or_404(review_category.objects.select_related(*ACTIVE_CATEGORY_RELATED),
+                                               pk=active_review_category_id)
+    if not BatchResultsCaptureWidget.supports(active_review_category):
+        return redirect('evaluate_feed', review_id, active_review_category.id)
+    active_review = get_object_or_404(review, pk=review_id)
+
+    context = {'active_review': active_review,
+               'active_review_category': active_review_category,
+               'payload_url': reverse('rapid_review_payload', args=[active_review.id, active_review_category.id]),
+               'next_review_path': get_next_review_item(0, 0, active_review, active_review_category,
+                                                        review_category.objects.all())
+               or reverse('review_evaluation_results', args=[active_review.id])}
+    return render(request, 'rapid_review.html', context)
+
+
+def rapid_review_payload(request, review_id, active_review_category_id):
+    active_review_category = get_object_or_404(review_category.objects.select_related(*ACTIVE_CATEGORY_RELATED),
+                                               pk=active_review_category_id)
+    if not BatchResultsCaptureWidget.supports(active_review_category):
+        return JsonResponse({'error': 'This review category can not be reviewed in rapid review mode'}, status=400)
+    active_review = get_object_or_404(review, pk=review_id)
+    return JsonResponse(build_category_payload(active_review, active_review_category))
+
+
+@require_POST
+def rapid_review_score(request, result_id):
+    """Saves the score, and score reason, of one result posted from rapid review mode. The fields are named like
+    BatchResultForm names them."""
+    my_result = get_object_or_404(result.objects.select_related('review_category__gtfs_field',
+                                                                'review_category__results_capture_widget'),
+                                  id=result_id)
+    if not BatchResultsCaptureWidget.supports(my_result.review_category):
+        return JsonResponse({'error': 'This review category can not be reviewed in rapid review mode'}, status=400)
+    form = BatchResultForm(request.POST,
+                           results_capture_widget=my_result.review_category.results_capture_widget,
+                           results=[my_result])
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    form.save()
+    return JsonResponse({'id': my_result.id, 'score_id': my_result.score_id, 'score_reason': my_result.score_reason})
+
+
 def evaluate_feed_by_result_id(request, review_id, active_review_category_id, active_result_id):
-    results = result.objects.filter(review_id=review_id, review_category_id=active_review_category_id)
-    active_result = result.objects.get(id=active_result_id)
-    print('test')
-    i = 0
-    for my_result in results:
-        if my_result == active_result:
-            return redirect('evaluate_feed', review_id, active_review_category_id, i)
-        else:
-            i += 1
+    active_result = get_object_or_404(result,
+                                      id=active_result_id,
+                                      review_id=review_id,
+                                      review_category_id=active_review_category_id)
+    return redirect('evaluate_feed', review_id, active_review_category_id, active_result.position)
 
-    raise Http404("Review not found")
 
 def review_evaluation_results(request, review_id, active_result_id=None):
-    review_categories = review_category.objects.all()
+    # moving the review to review bumps its version, so it is done before the ETag is computed
+    review.mark_in_review(review_id)
+    return _review_evaluation_results(request, review_id, active_result_id)
+
+
+@condition(etag_func=review_etags.get_review_etag)
+def _review_evaluation_results(request, review_id, active_result_id=None):
+    review_categories = review_category.objects.select_related('gtfs_field')
     active_review = get_object_or_404(review, pk=review_id)
-    print(active_review.review_status)
-    if active_review.review_status == "In progress":
-        print('true')
-        active_review.mark_status_in_review()
-    results = result.objects.filter(review_id=active_review.id).select_related()
 
     context = {'active_review': active_review,
-               'review_categories': review_categories,
-               'results': results}
+               'review_categories': review_categories}
+
+    snapshot = review_snapshot.get_review_snapshot(active_review)
+    if snapshot is not None:
+        context.update(review_snapshot.get_snapshot_context(snapshot, active_result_id))
+        return render(request, 'review_evaluation_results.html', context)
 
+    context['results'] = result.objects.filter(review_id=active_review.id) \
+        .select_related('review_category__gtfs_field', 'score')
     if active_result_id:
-        active_result = result.objects.get(id=active_result_id)
+        active_result = result.objects.select_related('review_category__gtfs_field',
+                                                      'review_category__review_widget',
+                                                      'score').get(id=active_result_id)
         active_review_widget = active_result.review_category.review_widget
         my_review_widget = review_widget_factory(active_review_widget, active_result)
         review_widget_template = my_review_widget.get_template()
@@ -299,25 +418,36 @@ def mark_review_complete(request, review_id):
     active_review = get_object_or_404(review, id=review_id)
     active_review.review_status = 'Completed'
     active_review.completed_date = datetime.now()
-    active_review.save()
+    with transaction.atomic():
+        active_review.save(update_fields=['review_status', 'completed_date'])
+        review.bump_version(active_review.id)
+        review_snapshot.write_review_snapshot(active_review)
     messages.success(request, "Your review has been marked complete.")
 
     return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
 
 
+@condition(etag_func=review_etags.get_review_etag)
 def view_completed_review(request, review_id, active_result_id=None):
     active_page = 'search'
-    review_categories = review_category.objects.all()
+    review_categories = review_category.objects.select_related('gtfs_field')
     active_review = get_object_or_404(review, pk=review_id)
-    results = result.objects.filter(review_id=active_review.id).select_related()
 
     context = {'active_page': active_page,
                'active_review': active_review,
-               'review_categories': review_categories,
-               'results': results}
+               'review_categories': review_categories}
 
+    snapshot = review_snapshot.get_review_snapshot(active_review)
+    if snapshot is not None:
+        context.update(review_snapshot.get_snapshot_context(snapshot, active_result_id))
+        return render(request, "view_completed_review.html", context)
+
+    context['results'] = result.objects.filter(review_id=active_review.id) \
+        .select_related('review_category__gtfs_field', 'score')
     if active_result_id:
-        active_result = result.objects.get(id=active_result_id)
+        active_result = result.objects.select_related('review_category__gtfs_field',
+                                                      'review_category__review_widget',
+                                                      'score').get(id=active_result_id)
         active_review_widget = active_result.review_category.review_widget
         my_review_widget = review_widget_factory(active_review_widget, active_result)
         review_widget_template = my_review_widget.get_template()
@@ -338,30 +468,45 @@ def view_completed_review(request, review_id, active_result_id=None):
 
 def start_new_evaluation(request):
     active_page = 'evaluate'
+    if request.session.get('gtfs_feed', None) and not feed_cache.is_cached(request.session['gtfs_feed']):
+        del request.session['gtfs_feed']
     if request.session.get('gtfs_feed', None):
-        tmp_dir = request.session['gtfs_feed']
-        gtfs_feed = ptg.load_feed(tmp_dir)
-        agency_options = gtfs_feed.agency['agency_name'].tolist()
-        agency_options = list_to_tuple_of_tuples(agency_options)
-        mode_options = list(set(gtfs_feed.routes['route_type'].tolist()))
-        mode_options = get_mode_drop_down(mode_options)
-        my_new_review_form = NewReviewForm(agency_options=agency_options, mode_options=mode_options)
+        manifest = feed_cache.load_manifest(request.session['gtfs_feed'])
+        my_new_review_form = NewReviewForm(manifest=manifest)
     else:
         my_new_review_form = None
-    if request.POST:
-        my_new_review_form = NewReviewForm(request.POST, agency_options=agency_options, mode_options=mode_options)
+    if request.POST and my_new_review_form is not None:
+        my_new_review_form = NewReviewForm(request.POST, manifest=manifest)
         if my_new_review_form.is_valid():
             agency_name = my_new_review_form.cleaned_data['agency']
             mode = my_new_review_form.cleaned_data['mode']
-            new_session_gtfs_path, my_review = DataSelector.setup_initial_data_for_review(request.session['gtfs_feed'],
-                                                                                          agency_name,
-                                                                                          mode)
-            request.session['gtfs_feed'] = new_session_gtfs_path
-            return redirect(evaluate_feed, review_id=my_review.id)
+            job = review_jobs.enqueue_review_setup(request.session['gtfs_feed'], agency_name, mode)
+            return redirect(review_setup_progress, job_id=job.id)
 
     return render(request, 'start_new_evaluation.html', {'active_page': active_page,
                                                          'my_new_review_form': my_new_review_form})
 
+def review_setup_progress(request, job_id):
+    active_page = 'evaluate'
+    job = get_object_or_404(review_setup_job, id=job_id)
+
+    return render(request, 'review_setup_progress.html', {'active_page': active_page,
+                                                          'job': job})
+
+
+def review_setup_job_status(request, job_id):
+    job = get_object_or_404(review_setup_job, id=job_id)
+    status = review_jobs.get_job_status(job)
+    if job.status == "Completed":
+        status['redirect_url'] = reverse('evaluate_feed', kwargs={'review_id': job.review_id})
+        # the review is sampled from the filtered feed, make it the active feed
+        if request.session.get('gtfs_feed', None) == job.gtfs_feed_hash:
+            request.session['gtfs_feed'] = job.filtered_feed_hash
+
+    return JsonResponse(status)
+
+
+@condition(etag_func=review_etags.get_completed_reviews_etag)
 def search_competed_review(request):
     active_page = 'search'
     completed_reviews = review.objects.filter(review_status="Completed")
@@ -390,17 +535,19 @@ def post_gtfs_zip(request):
         form = GtfsZipForm(request.POST, request.FILES)
         if form.is_valid():
 
-            try:
-                # TODO implement better file management
-                tmp_dir = tempfile.mkdtemp()
-                zip_ref = zipfile.ZipFile(request.FILES['file'], 'r')
-                zip_ref.extractall(tmp_dir)
-                gtfs_feed = ptg.load_feed(tmp_dir)
-                request.session['gtfs_feed'] = tmp_dir
+            report = feed_ingest.ingest_uploaded_feed(request.FILES['file'])
+            if report.is_valid:
+                request.session['gtfs_feed'] = report.feed_hash
+                if settings.REVIEW_PRECOMPUTE_PLANS:
+                    review_jobs.enqueue_plan_precompute(report.feed_hash)
                 messages.success(request, "Your GTFS file has been successfully uploaded and parsed!")
-            except:
+            else:
                 messages.error(request,
-                               'There was an error uploading your GTFS feed.  Please be sure you submitted a valid .zip GTFS file and try again.')
+                               'There was an error uploading your GTFS feed.  Please correct the problems below and try again.')
+            for file_name, message in report.errors:
+                messages.error(request, "{}: {}".format(file_name, message))
+            for file_name, message in report.warnings:
+                messages.warning(request, "{}: {}".format(file_name, message))
         else:
             messages.error(request,
                            'There was an error uploading your GTFS feed.  Please be sure you submitted a valid .zip GTFS file and try again.')
@@ -408,6 +555,11 @@ def post_gtfs_zip(request):
         return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
 
 
+def feed_cache_stats(request):
+    """Hit and miss counters of the parsed feed cache, used to size the cache"""
+    return JsonResponse(feed_cache.get_cache_stats())
+
+
 def gtfs_admin(request):
     """admin page for adding new review categories (and potentially other features down the road)"""
 
@@ -550,10 +702,11 @@ def delete_results_capture_score(request, score_id):
     return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
 
 def skip_it_replace_result(request, result_id):
-    if not request.session['gtfs_feed']:
-        messages.error("You do not have an active GTFS feed.  You may not skip any fields in this review.")
-
-
-
-
-    return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
+    my_result = get_object_or_404(result, id=result_id)
+    is_valid, request = DataSelector.validate_skip_result(request, result_id)
+    if is_valid:
+        if DataSelector.select_new_item_for_review(result_id) is None:
+            messages.warning(request, "You can not skip any more items in this category, there are no other items left to review in its place.")
+        else:
+            messages.success(request, 'The item has been replaced with another one from the feed.')
+    return redirect('evaluate_feed', my_result.review_id, my_result.review_category_id, my_result.position)